@@ -22,18 +22,23 @@ import time
 import atexit
 from uuid import uuid4
 from collections import defaultdict
-from typing import Any, Union, Tuple
+from typing import Any, Union, Tuple, Optional
 
 from flask import (Flask, request, Response, jsonify,
                    safe_join, send_file, send_from_directory)
 from flask_cors import CORS
-import requests
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
 import pydash
 from thespian.actors import ActorSystem
 
 from rhasspy.profiles import Profile
 from rhasspy.core import RhasspyCore
 from rhasspy.dialogue import ProfileTrainingFailed
+from rhasspy.stt import WavTranscription, PartialTranscription
+from rhasspy.intent import IntentRecognized
+from rhasspy.intent_handler import IntentHandled
+from rhasspy.metrics import to_prometheus
 from rhasspy.utils import recursive_update, buffer_to_wav, load_phoneme_examples
 
 # -----------------------------------------------------------------------------
@@ -43,6 +48,7 @@ from rhasspy.utils import recursive_update, buffer_to_wav, load_phoneme_examples
 app = Flask('rhasspy')
 app.secret_key = str(uuid4())
 CORS(app)
+sock = Sock(app)
 
 # -----------------------------------------------------------------------------
 # Parse Arguments
@@ -318,6 +324,40 @@ def api_sentences():
     # Return file contents
     return send_file(open(sentences_path, 'rb'), mimetype='text/plain')
 
+@app.route('/api/sentence-counts', methods=['GET', 'POST'])
+def api_sentence_counts() -> Response:
+    '''Count the sentences of each intent without generating them.
+    POST sentences ini text to count it instead of the saved sentences.'''
+    assert core is not None
+    from rhasspy.train import JsgfSentenceGenerator, count_sentences
+
+    if request.method == 'POST':
+        ini_file = io.StringIO(request.data.decode())
+    else:
+        sentences_path = core.profile.read_path(
+            core.profile.get('speech_to_text.sentences_ini'))
+
+        if not os.path.exists(sentences_path):
+            return jsonify({})  # no sentences yet
+
+        ini_file = open(sentences_path, 'r')
+
+    slots_dirs = core.profile.read_paths(
+        core.profile.get('speech_to_text.slots_dir'))
+
+    with ini_file:
+        counts = count_sentences(ini_file,
+                                 JsgfSentenceGenerator.load_slots(slots_dirs))
+
+    max_per_intent = core.profile.get('training.sentences.max_per_intent', 0)
+    return jsonify({
+        intent_name: {
+            'count': count,
+            'sampled': (max_per_intent > 0) and (count > max_per_intent)
+        }
+        for intent_name, count in counts.items()
+    })
+
 # -----------------------------------------------------------------------------
 
 @app.route('/api/custom-words', methods=['GET', 'POST'])
@@ -355,19 +395,62 @@ def api_custom_words():
 # -----------------------------------------------------------------------------
 
 @app.route('/api/train', methods=['POST'])
-def api_train() -> str:
+def api_train() -> Union[str, Response]:
     assert core is not None
     start_time = time.time()
     logger.info('Starting training')
 
+    if request.args.get('async', 'false').lower() == 'true':
+        # Poll /api/train/<job_id> for status
+        result = core.train(background=True)
+        if isinstance(result, ProfileTrainingFailed):
+            raise Exception(result.reason)
+
+        response = jsonify({ 'id': result.job_id })
+        response.status_code = 202
+        return response
+
     result = core.train()
     if isinstance(result, ProfileTrainingFailed):
-        raise Exception('Training failed due to unknown words')
+        raise Exception('Training failed: %s' % result.reason)
 
     end_time = time.time()
 
     return 'Training completed in %0.2f second(s)' % (end_time - start_time)
 
+@app.route('/api/train/<job_id>', methods=['GET'])
+def api_train_job(job_id:str) -> Response:
+    '''Get the status of a training job'''
+    assert core is not None
+    job = core.get_training_job(job_id)
+    if job is None:
+        return Response('No training job %s' % job_id, status=404)
+
+    return jsonify(job)
+
+@app.route('/api/train/<job_id>/events', methods=['GET'])
+def api_train_job_events(job_id:str) -> Response:
+    '''Stream the status of a training job as server-sent events'''
+    assert core is not None
+    if core.get_training_job(job_id) is None:
+        return Response('No training job %s' % job_id, status=404)
+
+    interval = float(request.args.get('interval', '0.5'))
+
+    def events():
+        while True:
+            job = core.get_training_job(job_id)
+            if job is None:
+                break
+
+            yield 'data: %s\n\n' % json.dumps(job)
+            if job['status'] != 'running':
+                break
+
+            time.sleep(interval)
+
+    return Response(events(), mimetype='text/event-stream')
+
 # -----------------------------------------------------------------------------
 
 @app.route('/api/restart', methods=['POST'])
@@ -451,6 +534,45 @@ def api_speech_to_intent() -> Response:
 
 # -----------------------------------------------------------------------------
 
+# Get intent from streaming audio
+@sock.route('/api/stream-to-intent')
+def api_stream_to_intent(ws) -> None:
+    '''raw audio -> VAD -> text -> intent (websocket)'''
+    assert core is not None
+    no_hass = request.args.get('nohass', 'false').lower() == 'true'
+
+    def read_chunk() -> Optional[bytes]:
+        try:
+            data = ws.receive(timeout=0.01)
+        except ConnectionClosed:
+            return None
+
+        if data is None:
+            # Nothing yet
+            return bytes()
+        elif isinstance(data, str):
+            # Any text message ends the stream
+            return None
+
+        # Raw 16-bit 16Khz mono audio
+        return data
+
+    for result in core.stream_to_intent(read_chunk, handle=not no_hass):
+        if isinstance(result, PartialTranscription):
+            event = { 'type': 'partial', 'text': result.text }
+        elif isinstance(result, WavTranscription):
+            event = { 'type': 'transcript', 'text': result.text }
+        elif isinstance(result, IntentRecognized):
+            event = { 'type': 'intent', 'intent': result.intent }
+        elif isinstance(result, IntentHandled):
+            event = { 'type': 'handled', 'intent': result.intent }
+        else:
+            continue
+
+        ws.send(json.dumps(event))
+
+# -----------------------------------------------------------------------------
+
 # Start recording a WAV file to a temporary buffer
 @app.route('/api/start-recording', methods=['POST'])
 def api_start_recording() -> str:
@@ -533,7 +655,51 @@ def api_text_to_speech() -> str:
 def api_actor_states() -> Response:
     '''Get the states of all actors'''
     assert core is not None
-    return jsonify(core.get_actor_states())
+    timeline = request.args.get('timeline', 'false').lower() == 'true'
+    return jsonify(core.get_actor_states(timeline=timeline))
+
+# -----------------------------------------------------------------------------
+
+@app.route('/api/ready', methods=['GET'])
+def api_ready() -> Response:
+    '''Get overall readiness and the state of each actor's models (503 if not ready)'''
+    assert core is not None
+    readiness = core.get_readiness()
+    response = jsonify(readiness)
+    if not readiness['ready']:
+        response.status_code = 503
+
+    return response
+
+# -----------------------------------------------------------------------------
+
+@app.route('/api/actor_resources', methods=['GET'])
+def api_actor_resources() -> Response:
+    '''Get the PID, memory usage, and CPU time of all actor processes'''
+    assert core is not None
+    return jsonify(core.get_actor_resources())
+
+# -----------------------------------------------------------------------------
+
+@app.route('/api/metrics', methods=['GET'])
+def api_metrics() -> Response:
+    '''Get message handling statistics for all actors'''
+    assert core is not None
+    metrics = core.get_actor_metrics()
+    if request.args.get('format', 'prometheus').lower() == 'json':
+        return jsonify(metrics)
+
+    return Response(to_prometheus(metrics),
+                    mimetype='text/plain; version=0.0.4')
+
+# -----------------------------------------------------------------------------
+
+@app.route('/api/traces', methods=['GET'])
+def api_traces() -> Response:
+    '''Get timings for recent voice commands'''
+    assert core is not None
+    trace_id = request.args.get('id', None)
+    return jsonify(core.get_traces(trace_id))
 
 # -----------------------------------------------------------------------------
 
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from rhasspy.core import RhasspyCore
+
+# This script starts Rhasspy once for each actor group layout and prints the
+# total memory (PSS) of all actor processes and the latency of a few requests.
+
+LAYOUTS = {
+    'separate': {},
+    'audio': { 'audio': ['recorder', 'command', 'wake'] },
+    'audio+nlu': { 'audio': ['recorder', 'command', 'wake'],
+                   'nlu': ['decoder', 'recognizer'] },
+    'training': { 'training': ['sentence_generator', 'speech_trainer',
+                               'intent_trainer', 'word_pronouncer'] },
+    'all': { 'all': ['mqtt', 'recorder', 'player', 'wake', 'command',
+                     'decoder', 'recognizer', 'handler', 'hass_handler',
+                     'sentence_generator', 'speech_trainer',
+                     'intent_trainer', 'word_pronouncer'] }
+}
+
+def main():
+    parser = argparse.ArgumentParser('measure-actor-groups')
+    parser.add_argument('--profile', default='en', help='Name of profile')
+    parser.add_argument('--profiles-dir', default='profiles',
+                        help='Directory with profiles')
+    parser.add_argument('--wav', default='etc/test/turn_on_living_room_lamp.wav',
+                        help='WAV file to transcribe')
+    parser.add_argument('--text', default='turn on the living room lamp',
+                        help='Text to recognize')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Number of times to run each request')
+    parser.add_argument('--set', nargs=2, action='append', default=[],
+                        metavar=('KEY', 'JSON'), help='Override a profile setting')
+    parser.add_argument('layouts', nargs='*', default=list(LAYOUTS.keys()))
+    args = parser.parse_args()
+
+    with open(args.wav, 'rb') as wav_file:
+        wav_data = wav_file.read()
+
+    results = {}
+    for layout in args.layouts:
+        core = RhasspyCore(args.profile, [args.profiles_dir], do_logging=False)
+        core.profile.set('rhasspy.listen_on_start', False)
+        core.profile.set('rhasspy.actor_groups', LAYOUTS[layout])
+        for key, value in args.set:
+            core.profile.set(key, json.loads(value))
+
+        start_time = time.time()
+        core.start(preload=True)
+        start_sec = time.time() - start_time
+
+        try:
+            transcribe_sec = []
+            recognize_sec = []
+            for i in range(args.repeat):
+                start_time = time.time()
+                core.transcribe_wav(wav_data)
+                transcribe_sec.append(time.time() - start_time)
+
+                start_time = time.time()
+                core.recognize_intent(args.text)
+                recognize_sec.append(time.time() - start_time)
+
+            resources = core.get_actor_resources()
+            pids = set(stats['pid'] for stats in resources.values())
+            pss_bytes = sum(stats['pss_bytes'] for stats in
+                            { stats['pid']: stats for stats in resources.values() }.values())
+
+            results[layout] = {
+                'processes': len(pids),
+                'total_pss_mb': pss_bytes / (1024 * 1024),
+                'start_sec': start_sec,
+                'transcribe_sec': statistics.median(transcribe_sec),
+                'recognize_sec': statistics.median(recognize_sec)
+            }
+        finally:
+            core.shutdown()
+
+        print(layout, json.dumps(results[layout]), file=sys.stderr)
+
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
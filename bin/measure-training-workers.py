@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from rhasspy.profiles import Profile
+from rhasspy.train import JsgfSentenceGenerator
+from rhasspy.training import CORPUS_DIR
+
+# This script generates the sentences of a profile with different numbers of
+# training workers (training.workers) and prints the time taken for each.
+
+def main():
+    parser = argparse.ArgumentParser('measure-training-workers')
+    parser.add_argument('--profile', default='en', help='Name of profile')
+    parser.add_argument('--profiles-dir', default='profiles',
+                        help='Directory with profiles')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of times to generate sentences for each worker count')
+    parser.add_argument('--set', nargs=2, action='append', default=[],
+                        metavar=('KEY', 'JSON'), help='Override a profile setting')
+    parser.add_argument('workers', nargs='*', type=int,
+                        default=list(range(1, (os.cpu_count() or 1) + 1)))
+    args = parser.parse_args()
+
+    results = {}
+    for workers in args.workers:
+        profile = Profile(args.profile, [args.profiles_dir])
+        profile.set('training.cache', False)
+        for key, value in args.set:
+            profile.set(key, json.loads(value))
+
+        profile.set('training.workers', workers)
+
+        # Generate sentences without starting the actor system
+        generator = JsgfSentenceGenerator.__new__(JsgfSentenceGenerator)
+        generator.profile = profile
+        generator._logger = logging.getLogger('measure-training-workers')
+
+        generate_sec = []
+        for i in range(args.repeat):
+            shutil.rmtree(profile.write_path(CORPUS_DIR), ignore_errors=True)
+            start_time = time.time()
+            corpus = generator.generate_sentences()
+            generate_sec.append(time.time() - start_time)
+
+        results[workers] = {
+            'sentences': corpus.num_sentences,
+            'generate_sec': statistics.median(generate_sec),
+            'min_generate_sec': min(generate_sec)
+        }
+
+        print(workers, json.dumps(results[workers]), file=sys.stderr)
+
+    print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
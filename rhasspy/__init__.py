@@ -1,6 +1,14 @@
 #!/usr/bin/env python3
 import os
 import sys
+
+# Needs to be installed before anything else is imported
+startup_profiler = None
+if '--profile-startup' in sys.argv:
+    from .startup import StartupProfiler
+    startup_profiler = StartupProfiler()
+    startup_profiler.install()
+
 import io
 import json
 import argparse
@@ -23,7 +31,7 @@ from .actor import ConfigureEvent, Configured
 from .profiles import Profile
 from .utils import buffer_to_wav, maybe_convert_wav
 from .audio_recorder import AudioData, StartStreaming, StopStreaming
-from .dialogue import DialogueManager
+from .dialogue import DialogueManager, ProfileTrainingFailed
 from .wake import (PocketsphinxWakeListener, ListenForWakeWord,
                    StopListeningForWakeWord, WakeWordDetected,
                    WakeWordNotDetected)
@@ -44,6 +52,8 @@ def main() -> None:
     parser.add_argument('--profile', type=str, help='Name of profile to use', default=None)
     parser.add_argument('--profiles', action='append', help='Directories where profiles are stored', default=None)
     parser.add_argument('--debug', action='store_true', help='Print DEBUG log to console')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='Print import and actor load times to stderr')
 
     sub_parsers = parser.add_subparsers(dest='command')
     sub_parsers.required = True
@@ -139,10 +149,16 @@ def main() -> None:
     # sleep
     sleep_parser = sub_parsers.add_parser('sleep', help='Wait for wake word')
 
+    # resources
+    resources_parser = sub_parsers.add_parser('resources', help='Memory and CPU usage of each actor')
+
     # -------------------------------------------------------------------------
 
     args = parser.parse_args()
 
+    if startup_profiler is not None:
+        startup_profiler.step('imports')
+
     if args.debug:
         logging.basicConfig(level=logging.DEBUG)
         do_logging = True
@@ -218,13 +234,17 @@ def main() -> None:
             'word2phonemes': word2phonemes,
             'word2wav': word2wav,
             'wav2mqtt': wav2mqtt,
-            'sleep': sleep
+            'sleep': sleep,
+            'resources': resources
         }
 
         if not args.command in ['test-wake']:
             # Automatically start core
             core.start()
 
+            if startup_profiler is not None:
+                startup_profiler.step('core started')
+
         if mic_stdin_running:
             logging.debug('Reading audio data from stdin')
             mic_stdin_thread = threading.Thread(target=read_audio_stdin,
@@ -238,6 +258,16 @@ def main() -> None:
             if mic_stdin_thread is not None:
                 mic_stdin_running = False
                 mic_stdin_thread.join()
+
+            if startup_profiler is not None:
+                startup_profiler.step('command done')
+                startup_profiler.uninstall()
+
+                actor_times = None
+                if core.actor_system is not None:
+                    actor_times = core.get_actor_load_times()
+
+                print(startup_profiler.report(actor_times), file=sys.stderr)
         finally:
             core.shutdown()
 
@@ -324,7 +354,18 @@ def wav2intent(core:RhasspyCore, profile:Profile, args:Any) -> None:
 # -----------------------------------------------------------------------------
 
 def train_profile(core:RhasspyCore, profile:Profile, args:Any) -> None:
-    core.train()
+    result = core.train()
+    if result.job is not None:
+        # Time spent in each stage
+        for stage in result.job['stages']:
+            print('%8.3f  %-16s %s item(s)' % (stage['seconds'], stage['name'],
+                                               stage['items']),
+                  file=sys.stderr)
+
+    if isinstance(result, ProfileTrainingFailed):
+        print('Training failed: %s' % result.reason, file=sys.stderr)
+        sys.exit(1)
+
     print('OK')
 
 # -----------------------------------------------------------------------------
@@ -902,6 +943,13 @@ def sleep(core:RhasspyCore, profile:Profile, args:Any) -> None:
     else:
         print('')  # not detected
 
+# -----------------------------------------------------------------------------
+# resources: memory and CPU usage of each actor
+# -----------------------------------------------------------------------------
+
+def resources(core:RhasspyCore, profile:Profile, args:Any) -> None:
+    json.dump(core.get_actor_resources(), sys.stdout, indent=4)
+
 # -----------------------------------------------------------------------------
 
 if __name__ == '__main__':
@@ -1,9 +1,13 @@
+import os
+import time
 import logging
-from typing import List, Callable, Optional, Any, Dict
+from contextlib import contextmanager
+from typing import List, Callable, Optional, Any, Dict, Iterator, Tuple
 
 from thespian.actors import Actor, ActorExitRequest, ChildActorExited, ActorAddress
 
 from .profiles import Profile
+from .metrics import ActorMetrics
 
 # -----------------------------------------------------------------------------
 
@@ -13,7 +17,8 @@ class ConfigureEvent:
         self.config = kwargs
 
 class Configured:
-    pass
+    def __init__(self, pid:Optional[int]=None) -> None:
+        self.pid = pid
 
 class StateTransition:
     def __init__(self, name:str, from_state:str, to_state:str) -> None:
@@ -21,6 +26,73 @@ class StateTransition:
         self.from_state = from_state
         self.to_state = to_state
 
+class TraceSpan:
+    def __init__(self, trace_id:str, name:str,
+                 start_time:float, end_time:float,
+                 actor:Optional[str]=None) -> None:
+        self.trace_id = trace_id
+        self.name = name
+        self.start_time = start_time
+        self.end_time = end_time
+        self.actor = actor
+
+class GetActorMetrics:
+    def __init__(self, name:str='') -> None:
+        self.name = name
+
+class ActorMetricsReport:
+    def __init__(self, name:str, metrics:Optional[Dict[str, Any]]) -> None:
+        self.name = name
+        self.metrics = metrics
+
+class WarmUp:
+    '''Load models in the background (sent after Ready).'''
+    pass
+
+class ModelState:
+    '''Model name -> state (loading, loaded, failed) of one actor.'''
+    def __init__(self, models:Dict[str, Dict[str, Any]]) -> None:
+        self.models = models
+
+# -----------------------------------------------------------------------------
+# Co-located actors (see actor_group.py)
+# -----------------------------------------------------------------------------
+
+class ColocatedAddress(ActorAddress):
+    '''Address of an actor hosted inside of an ActorGroup process.'''
+    def __init__(self, group:ActorAddress, member_id:str) -> None:
+        self.group = group
+        self.member_id = member_id
+
+    @property
+    def addressDetails(self) -> Any:
+        return self.group.addressDetails
+
+    def __eq__(self, o: Any) -> bool:
+        return isinstance(o, ColocatedAddress) \
+            and (self.member_id == o.member_id) \
+            and (self.group == o.group)
+
+    def __ne__(self, o: Any) -> bool:
+        return not self.__eq__(o)
+
+    def __hash__(self) -> int:
+        return hash(self.member_id)
+
+    def __str__(self) -> str:
+        return '%s/%s' % (self.group, self.member_id)
+
+class GroupMessage:
+    '''Envelope for messages to/from co-located actors.
+
+    member_id is the receiving member (None if the receiver is a regular
+    actor). sender is the real sender (None to use the envelope sender).'''
+    def __init__(self, member_id:Optional[str], message:Any,
+                 sender:Optional[ActorAddress]=None) -> None:
+        self.member_id = member_id
+        self.message = message
+        self.sender = sender
+
 # -----------------------------------------------------------------------------
 
 class RhasspyActor(Actor):
@@ -30,20 +102,57 @@ class RhasspyActor(Actor):
         self._state:str = ''
         self._state_method: Optional[Callable[[Any, ActorAddress], None]] = None
         self._transitions:bool = False
+        self._parent:Optional[ActorAddress] = None
+        self._trace_id:Optional[str] = None
+        self._metrics:Optional[ActorMetrics] = None
+
+        # Messages received before ConfigureEvent
+        self._pending:List[Tuple[Any, ActorAddress]] = []
 
     # -------------------------------------------------------------------------
 
     def receiveMessage(self, message: Any, sender: ActorAddress) -> None:
+        if isinstance(message, GroupMessage):
+            # Sent from a co-located actor
+            sender = message.sender or sender
+            message = message.message
+
+        metrics = self._metrics
+        if metrics is not None:
+            start_time = time.perf_counter()
+
         try:
+            # Trace id of the utterance this message belongs to (if any)
+            self._trace_id = getattr(message, 'trace_id', None)
+
             if isinstance(message, ActorExitRequest):
                 self.transition('stopped')
             elif isinstance(message, ConfigureEvent):
-                self._parent: ActorAddress = sender
+                self._parent = sender
                 self.profile: Profile = message.profile
                 self.config: Dict[str, Any] = message.config
                 self._transitions = self.config.get('transitions', True)
+
+                if self.profile.get('metrics.enabled', False):
+                    self._metrics = ActorMetrics(
+                        self.profile.get('metrics.history_size', 100))
+
                 self.transition('started')
-                self.send(sender, Configured())
+                self.send(sender, Configured(os.getpid()))
+
+                # Actors are configured in parallel, so other actors may
+                # have already sent us messages.
+                pending, self._pending = self._pending, []
+                for pending_message, pending_sender in pending:
+                    self.receiveMessage(pending_message, pending_sender)
+            elif isinstance(message, GetActorMetrics):
+                report = self._metrics.json() if self._metrics is not None else None
+                self.send(sender, ActorMetricsReport(message.name, report))
+            elif isinstance(message, WarmUp) and (self._state != ''):
+                self.warm_up()
+            elif self._state == '':
+                # Not configured yet
+                self._pending.append((message, sender))
             else:
                 # Call in_<state> method
                 if self._state_method is not None:
@@ -54,6 +163,38 @@ class RhasspyActor(Actor):
                                       self._state, message)
         except:
             self._logger.exception('receiveMessage')
+            if metrics is not None:
+                metrics.record_error(message.__class__.__name__)
+
+        if metrics is not None:
+            metrics.record_message(message.__class__.__name__,
+                                   time.perf_counter() - start_time)
+
+    # -------------------------------------------------------------------------
+
+    def get_models(self) -> Dict[str, Callable[[], None]]:
+        '''Model name -> function that loads it (if not already loaded).'''
+        return {}
+
+    def warm_up(self) -> None:
+        '''Loads all models and reports their state to the parent after each one.'''
+        models = self.get_models()
+        states:Dict[str, Dict[str, Any]] = \
+            { model: { 'state': 'loading' } for model in models }
+
+        self.send(self._parent, ModelState(dict(states)))
+
+        for model, load in models.items():
+            start_time = time.perf_counter()
+            try:
+                load()
+                states[model] = { 'state': 'loaded',
+                                  'seconds': time.perf_counter() - start_time }
+            except Exception as e:
+                self._logger.exception('loading %s', model)
+                states[model] = { 'state': 'failed', 'error': str(e) }
+
+            self.send(self._parent, ModelState(dict(states)))
 
     # -------------------------------------------------------------------------
 
@@ -71,6 +212,9 @@ class RhasspyActor(Actor):
 
         self._logger.debug('%s -> %s', from_state, to_state)
 
+        if self._metrics is not None:
+            self._metrics.record_transition(from_state, to_state)
+
         # Call transition method
         if (from_state != to_state) and hasattr(self, transition_method):
             getattr(self, transition_method)(from_state)
@@ -79,3 +223,43 @@ class RhasspyActor(Actor):
         if self._transitions and (self._parent is not None):
             self.send(self._parent,
                       StateTransition(self._name, from_state, to_state))
+
+    # -------------------------------------------------------------------------
+
+    def send(self, targetAddr: ActorAddress, msg: Any) -> None:
+        my_address = self.myAddress
+        if isinstance(targetAddr, ColocatedAddress):
+            # Let the group deliver to the right member
+            msg = GroupMessage(targetAddr.member_id, msg, my_address)
+            targetAddr = targetAddr.group
+        elif isinstance(my_address, ColocatedAddress) \
+             and self.is_rhasspy_actor(targetAddr):
+            # Tell the receiver which member this came from
+            msg = GroupMessage(None, msg, my_address)
+
+        Actor.send(self, targetAddr, msg)
+
+    def is_rhasspy_actor(self, address: ActorAddress) -> bool:
+        '''True if address is our parent or one of the actors we were
+        configured with (so it knows how to unwrap GroupMessage).'''
+        if address == self._parent:
+            return True
+
+        config = getattr(self, 'config', {})
+        return any(address == value for value in config.values()
+                   if isinstance(value, ActorAddress))
+
+    # -------------------------------------------------------------------------
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        '''Times a block of code and reports it to the parent actor if the
+        current message is part of a trace.'''
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            if (self._trace_id is not None) and (self._parent is not None):
+                self.send(self._parent,
+                          TraceSpan(self._trace_id, name, start_time,
+                                    time.time(), actor=self._name))
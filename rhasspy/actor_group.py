@@ -0,0 +1,112 @@
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, List, Tuple, Type
+
+from thespian.actors import (Actor, ActorAddress, ActorExitRequest,
+                             ChildActorExited, WakeupMessage)
+
+from .actor import RhasspyActor, ColocatedAddress, GroupMessage
+
+# -----------------------------------------------------------------------------
+
+class HostActor:
+    def __init__(self, member_id:str, actor_class:Type[RhasspyActor]) -> None:
+        self.member_id = member_id
+        self.actor_class = actor_class
+
+# -----------------------------------------------------------------------------
+
+class ActorGroup(Actor):
+    '''Runs several Rhasspy actors inside of a single process.
+
+    Members are addressed with a ColocatedAddress. Messages between members
+    of the same group are passed by reference (no pickling or sockets).
+    Everything else goes through the actor system as usual.'''
+    def __init__(self) -> None:
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.members:Dict[str, RhasspyActor] = {}
+        self.children:List[Tuple[ActorAddress, str]] = []
+        self.local:deque = deque()
+        self.thread_id:Optional[int] = None
+
+    def receiveMessage(self, message: Any, sender: ActorAddress) -> None:
+        self.thread_id = threading.get_ident()
+
+        if isinstance(message, HostActor):
+            member = message.actor_class()
+            member._myRef = _MemberRef(self, ColocatedAddress(self.myAddress,
+                                                              message.member_id))
+            self.members[message.member_id] = member
+            self._logger.debug('Hosting %s as %s',
+                               message.actor_class.__name__, message.member_id)
+        elif isinstance(message, GroupMessage) and (message.member_id is not None):
+            self.dispatch(message.member_id, message.message,
+                          message.sender or sender)
+        elif isinstance(message, WakeupMessage):
+            # Member wakeups are tagged with the member id
+            member_id, payload = message.payload
+            self.dispatch(member_id, WakeupMessage(message.delayPeriod, payload), sender)
+        elif isinstance(message, ChildActorExited):
+            for child, member_id in self.children:
+                if child == message.childAddress:
+                    self.dispatch(member_id, message, sender)
+
+            self.children = [(child, member_id) for child, member_id in self.children
+                             if child != message.childAddress]
+        elif isinstance(message, ActorExitRequest):
+            for member_id in list(self.members.keys()):
+                self.dispatch(member_id, ActorExitRequest(), sender)
+
+        # Deliver messages that members sent to each other
+        while len(self.local) > 0:
+            self.dispatch(*self.local.popleft())
+
+    def dispatch(self, member_id:str, message:Any, sender:ActorAddress) -> None:
+        member = self.members.get(member_id, None)
+        if member is None:
+            self._logger.warning('No member %s for %s', member_id, message)
+            return
+
+        member.receiveMessage(message, sender)
+
+        if isinstance(message, ActorExitRequest):
+            del self.members[member_id]
+
+    def deliver_local(self, message:GroupMessage) -> bool:
+        '''Queues a message between members. Only possible from the group's
+        own thread (e.g., not from a PyAudio callback).'''
+        if threading.get_ident() != self.thread_id:
+            return False
+
+        self.local.append((message.member_id, message.message, message.sender))
+        return True
+
+# -----------------------------------------------------------------------------
+
+class _MemberRef:
+    '''Stands in for the actor system inside of a hosted member.'''
+    def __init__(self, group:ActorGroup, address:ColocatedAddress) -> None:
+        self.group = group
+        self.address = address
+        self.globalName = None
+
+    def actor_send(self, targetAddr: ActorAddress, msg: Any) -> None:
+        if isinstance(msg, GroupMessage) and (msg.member_id is not None) \
+           and (targetAddr == self.group.myAddress) \
+           and self.group.deliver_local(msg):
+            return
+
+        self.group.send(targetAddr, msg)
+
+    def createActor(self, actorClass: Any,
+                    targetActorRequirements: Any=None,
+                    globalName: Optional[str]=None,
+                    sourceHash: Any=None) -> ActorAddress:
+        child = self.group.createActor(actorClass, targetActorRequirements,
+                                       globalName, sourceHash)
+        self.group.children.append((child, self.address.member_id))
+        return child
+
+    def wakeupAfter(self, timePeriod: Any, payload: Any=None) -> None:
+        self.group.wakeupAfter(timePeriod, payload=(self.address.member_id, payload))
@@ -1,18 +1,21 @@
 import os
 import sys
+import time
 import logging
-from typing import List, Dict, Optional, Any, Callable, Tuple, Union
+from typing import List, Dict, Optional, Any, Callable, Tuple, Union, Iterator
 
 import pydash
-from thespian.actors import ActorSystem, ActorAddress
+from thespian.actors import ActorSystem, ActorAddress, ActorExitRequest
 
 # Internal imports
-from .actor import ConfigureEvent
+from .actor import (ConfigureEvent, GetActorMetrics, ActorMetricsReport,
+                    ColocatedAddress, GroupMessage)
 from .profiles import Profile
 from .audio_recorder import AudioData, StartRecordingToBuffer, StopRecordingToBuffer
 from .stt import WavTranscription
 from .intent import IntentRecognized
 from .intent_handler import IntentHandled
+from .streaming import StartAudioStream, AudioStreamStarted, EndAudioStream
 from .pronounce import WordPronunciation, WordPhonemes, WordSpoken
 from .dialogue import (DialogueManager, GetMicrophones, TestMicrophones,
                        ListenForCommand, ListenForWakeWord,
@@ -23,7 +26,9 @@ from .dialogue import (DialogueManager, GetMicrophones, TestMicrophones,
                        RecognizeIntent, HandleIntent,
                        ProfileTrainingComplete, ProfileTrainingFailed,
                        MqttPublish, GetVoiceCommand, VoiceCommand,
-                       GetActorStates)
+                       GetActorStates, GetActors, GetActorResources,
+                       GetActorLoadTimes, GetReadiness, GetTraces,
+                       TrainingStarted, GetTrainingJob)
 
 # -----------------------------------------------------------------------------
 
@@ -134,6 +139,54 @@ class RhasspyCore:
             assert isinstance(result, IntentHandled)
             return result
 
+    def stream_to_intent(self,
+                         read_chunk: Callable[[], Optional[bytes]],
+                         handle:bool=True,
+                         timeout:float=30,
+                         poll_sec:float=0.01) -> Iterator[Any]:
+        '''Streams raw audio (16-bit 16Khz mono) through voice activity
+        detection, speech to text, and intent recognition.
+
+        read_chunk should return an empty buffer when no audio is available
+        yet, and None when the stream has ended.
+
+        Yields PartialTranscription, WavTranscription, IntentRecognized,
+        and IntentHandled (if handle is True) as they become available.'''
+        assert self.actor_system is not None
+        with self.actor_system.private() as sys:
+            started = sys.ask(self.dialogue_manager,
+                              StartAudioStream(handle=handle), timeout)
+            assert isinstance(started, AudioStreamStarted)
+            session = started.session
+            streaming = True
+            finished = False
+
+            try:
+                while not finished:
+                    if streaming:
+                        chunk = read_chunk()
+                        if chunk is None:
+                            # Client is done sending audio
+                            sys.tell(session, EndAudioStream())
+                            streaming = False
+                        elif len(chunk) > 0:
+                            sys.tell(session, AudioData(chunk))
+
+                    result = sys.listen(poll_sec if streaming else timeout)
+                    if result is None:
+                        if not streaming:
+                            self._logger.warning('Timeout while streaming audio')
+                            break
+
+                        continue
+
+                    yield result
+                    finished = isinstance(result, IntentHandled) \
+                        or (isinstance(result, IntentRecognized) and not handle)
+            finally:
+                if not finished:
+                    sys.tell(session, ActorExitRequest())
+
     # -------------------------------------------------------------------------
 
     def start_recording_wav(self, buffer_name:str = '') -> None:
@@ -184,14 +237,25 @@ class RhasspyCore:
 
     # -------------------------------------------------------------------------
 
-    def train(self) -> Union[ProfileTrainingComplete, ProfileTrainingFailed]:
+    def train(self, background:bool=False) -> Union[ProfileTrainingComplete,
+                                                    ProfileTrainingFailed,
+                                                    TrainingStarted]:
+        '''Re-trains the profile. In the background, returns the job id
+        right away (see get_training_job).'''
         assert self.actor_system is not None
         with self.actor_system.private() as sys:
-            result = sys.ask(self.dialogue_manager, TrainProfile())
+            result = sys.ask(self.dialogue_manager, TrainProfile(background=background))
             assert isinstance(result, ProfileTrainingComplete) \
-                or isinstance(result, ProfileTrainingFailed)
+                or isinstance(result, ProfileTrainingFailed) \
+                or isinstance(result, TrainingStarted)
             return result
 
+    def get_training_job(self, job_id:Optional[str]=None) -> Any:
+        '''Gets the status of a training job (or all recent jobs if job_id is None).'''
+        assert self.actor_system is not None
+        with self.actor_system.private() as sys:
+            return sys.ask(self.dialogue_manager, GetTrainingJob(job_id))
+
     # -------------------------------------------------------------------------
 
     def mqtt_publish(self, topic: str, payload: bytes) -> None:
@@ -212,13 +276,83 @@ class RhasspyCore:
 
     # -------------------------------------------------------------------------
 
-    def get_actor_states(self) -> Dict[str, str]:
+    def get_actor_states(self, timeline:bool=False) -> Dict[str, Any]:
+        '''Gets actor name -> state. With timeline, also returns when each
+        actor was created/configured and its state transitions during startup.'''
         assert self.actor_system is not None
         with self.actor_system.private() as sys:
-            result = sys.ask(self.dialogue_manager, GetActorStates())
+            result = sys.ask(self.dialogue_manager, GetActorStates(timeline))
             assert isinstance(result, dict)
             return result
 
+    def get_actor_resources(self) -> Dict[str, Dict[str, Any]]:
+        '''Gets PID, memory (RSS/PSS/USS), and CPU time of each actor process.'''
+        assert self.actor_system is not None
+        with self.actor_system.private() as sys:
+            result = sys.ask(self.dialogue_manager, GetActorResources())
+            assert isinstance(result, dict)
+            return result
+
+    def get_readiness(self) -> Dict[str, Any]:
+        '''Gets overall readiness and the state of each actor's models.'''
+        assert self.actor_system is not None
+        with self.actor_system.private() as sys:
+            result = sys.ask(self.dialogue_manager, GetReadiness())
+            assert isinstance(result, dict)
+            return result
+
+    def get_actor_load_times(self) -> Dict[str, float]:
+        '''Gets seconds each actor took to be configured (load time).'''
+        assert self.actor_system is not None
+        with self.actor_system.private() as sys:
+            result = sys.ask(self.dialogue_manager, GetActorLoadTimes())
+            assert isinstance(result, dict)
+            return result
+
+    def get_actor_metrics(self, timeout:float=1) -> Dict[str, Dict[str, Any]]:
+        '''Gets message handling statistics from every actor (see metrics.enabled).'''
+        assert self.actor_system is not None
+        with self.actor_system.private() as sys:
+            actors = sys.ask(self.dialogue_manager, GetActors(), timeout)
+            assert isinstance(actors, dict)
+
+            # Some actors are registered under multiple names
+            targets:Dict[str, ActorAddress] = { 'dialogue': self.dialogue_manager }
+            for name, address in actors.items():
+                if address not in targets.values():
+                    targets[name] = address
+
+            # Ask everyone at once and collect what comes back in time
+            for name, address in targets.items():
+                if isinstance(address, ColocatedAddress):
+                    # Actor is hosted inside of a group
+                    sys.tell(address.group,
+                             GroupMessage(address.member_id, GetActorMetrics(name)))
+                else:
+                    sys.tell(address, GetActorMetrics(name))
+
+            metrics:Dict[str, Dict[str, Any]] = {}
+            waiting = set(targets.keys())
+            end_time = time.time() + timeout
+            while len(waiting) > 0:
+                result = sys.listen(max(0, end_time - time.time()))
+                if result is None:
+                    self._logger.warning(f'No metrics from {list(waiting)}')
+                    break
+                elif isinstance(result, ActorMetricsReport):
+                    waiting.discard(result.name)
+                    if result.metrics is not None:
+                        metrics[result.name] = result.metrics
+
+            return metrics
+
+    def get_traces(self, trace_id:Optional[str]=None) -> List[Dict[str, Any]]:
+        assert self.actor_system is not None
+        with self.actor_system.private() as sys:
+            result = sys.ask(self.dialogue_manager, GetTraces(trace_id))
+            assert isinstance(result, list)
+            return result
+
     # -------------------------------------------------------------------------
 
     def send_audio_data(self, data:AudioData) -> None:
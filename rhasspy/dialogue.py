@@ -1,23 +1,32 @@
+import os
 import json
+import time
 from datetime import timedelta
-from typing import Dict, Any, Optional, List, Type
+from typing import Dict, Any, Optional, List, Type, Set
 
 from thespian.actors import ActorAddress, ActorExitRequest, WakeupMessage, ChildActorExited
 
-from .actor import RhasspyActor, ConfigureEvent, Configured, StateTransition
+from .actor import (RhasspyActor, ConfigureEvent, Configured, StateTransition,
+                    TraceSpan, ColocatedAddress, WarmUp, ModelState)
 from .wake import ListenForWakeWord, StopListeningForWakeWord, WakeWordDetected, WakeWordNotDetected
 from .command_listener import ListenForCommand, VoiceCommand
 from .audio_recorder import StartRecordingToBuffer, StopRecordingToBuffer, AudioData
 from .audio_player import PlayWavFile, PlayWavData
 from .stt import TranscribeWav, WavTranscription
-from .stt_train import TrainSpeech, SpeechTrainingComplete, SpeechTrainingFailed
+from .stt_train import (TrainSpeech, SentencesGrouped, SpeechTrainingComplete,
+                        SpeechTrainingFailed)
 from .intent import RecognizeIntent, IntentRecognized
 from .intent_train import TrainIntent, IntentTrainingComplete
 from .intent_handler import HandleIntent, IntentHandled
 from .train import GenerateSentences, SentencesGenerated
 from .pronounce import GetWordPhonemes, SpeakWord, GetWordPronunciations
 from .mqtt import MqttPublish
-from .utils import buffer_to_wav
+from .streaming import StartAudioStream, StreamingSession
+from .actor_group import ActorGroup, HostActor
+from .tracing import Trace, TraceStore
+from .training import TrainingJob, TrainingProgress, CACHE_DIR
+from .profiles import Profile
+from .utils import buffer_to_wav, get_process_stats
 
 # -----------------------------------------------------------------------------
 
@@ -30,14 +39,28 @@ class TestMicrophones:
         self.system = system
 
 class TrainProfile:
-    def __init__(self, receiver:Optional[ActorAddress]=None) -> None:
+    def __init__(self, receiver:Optional[ActorAddress]=None,
+                 background:bool=False) -> None:
         self.receiver = receiver
+        self.background = background
+
+class TrainingStarted:
+    def __init__(self, job_id:str) -> None:
+        self.job_id = job_id
+
+class GetTrainingJob:
+    def __init__(self, job_id:Optional[str]=None) -> None:
+        self.job_id = job_id
 
 class ProfileTrainingFailed:
-    pass
+    def __init__(self, reason:str='',
+                 job:Optional[Dict[str, Any]]=None) -> None:
+        self.reason = reason
+        self.job = job
 
 class ProfileTrainingComplete:
-    pass
+    def __init__(self, job:Optional[Dict[str, Any]]=None) -> None:
+        self.job = job
 
 class Ready:
     def __init__(self, timeout:bool=False) -> None:
@@ -51,13 +74,47 @@ class GetVoiceCommand:
         self.timeout = timeout
 
 class GetActorStates:
+    def __init__(self, timeline:bool=False) -> None:
+        self.timeline = timeline
+
+class GetActors:
+    pass
+
+class GetActorResources:
     pass
 
+class GetActorLoadTimes:
+    pass
+
+class GetReadiness:
+    pass
+
+class GetTraces:
+    def __init__(self, trace_id:Optional[str]=None) -> None:
+        self.trace_id = trace_id
+
 # -----------------------------------------------------------------------------
 
 class DialogueManager(RhasspyActor):
     '''Manages the overall state of Rhasspy.'''
 
+    # States that are timed for each utterance
+    TRACED_STATES = ['awake', 'decoding', 'recognizing', 'handling']
+
+    # Actors that aren't created until they're needed
+    ON_DEMAND_ACTORS = ['sentence_generator', 'speech_trainer',
+                        'intent_trainer', 'word_pronouncer']
+
+    # Number of finished training jobs to remember
+    MAX_TRAINING_JOBS = 10
+
+    # Actors that need the address of other actors when they're configured
+    ACTOR_DEPENDENCIES = { 'speech_trainer': ['word_pronouncer'] }
+
+    def __init__(self) -> None:
+        RhasspyActor.__init__(self)
+        self.trace:Optional[Trace] = None
+
     def to_started(self, from_state:str) -> None:
         self.site_id:str = self.profile.get('mqtt.site_id', 'default')
         self.preload:bool = self.config.get('preload', False)
@@ -65,43 +122,62 @@ class DialogueManager(RhasspyActor):
         self.send_ready:bool = self.config.get('ready', False)
         self.wake_receiver:Optional[ActorAddress] = None
         self.intent_receiver:Optional[ActorAddress] = None
-        self.training_receiver:Optional[ActorAddress] = None
+        self.training_job:Optional[TrainingJob] = None
+
+        # job id -> job (most recent jobs only)
+        self.training_jobs:Dict[str, TrainingJob] = {}
         self.handle:bool = True
         self.actors: Dict[str, ActorAddress] = {}
         self.actor_states:Dict[str, str] = {}
+        self.actor_pids:Dict[str, int] = {}
+        self.over_budget:Set[str] = set()
 
-        self.transition('loading_mqtt')
+        # name -> seconds from ConfigureEvent to Configured
+        self.configure_times:Dict[str, float] = {}
+        self.load_times:Dict[str, float] = {}
 
-    def to_loading_mqtt(self, from_state:str) -> None:
-        self._logger.debug('Loading MQTT first')
+        # name -> model -> state (see WarmUp)
+        self.model_states:Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.warming_up:Set[str] = set()
 
-        # MQTT client *first*
-        from .mqtt import HermesMqtt
-        self.mqtt_class = HermesMqtt
-        self.mqtt:ActorAddress = self.createActor(self.mqtt_class)
-        self.actors['mqtt'] = self.mqtt
+        # Replacements for actors after training (see load_standby)
+        self.standby:Dict[str, ActorAddress] = {}
+        self.standby_waiting:Set[str] = set()
+        self.standby_models:Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self.standby_id:int = 0
 
-        self.send(self.mqtt, ConfigureEvent(self.profile,
-                                            preload=self.preload,
-                                            **self.actors))
+        # Startup timeline (see GetActorStates)
+        self.start_time = time.perf_counter()
+        self.timeline:List[Dict[str, Any]] = []
 
-        if self.timeout_sec is not None:
-            self._logger.debug(f'Loading...will time out after {self.timeout_sec} second(s)')
-            self.wakeupAfter(timedelta(seconds=self.timeout_sec))
+        # group name -> ActorGroup (see rhasspy.actor_groups)
+        self.groups:Dict[str, ActorAddress] = {}
+        self.num_members:int = 0
 
-    def in_loading_mqtt(self, message: Any, sender: ActorAddress) -> None:
-        if isinstance(message, Configured) and (sender == self.mqtt):
-            self.transition('loading')
-        elif isinstance(message, WakeupMessage):
-            self._logger.warning('MQTT actor did not load! Trying to keep going...')
-            self.transition('loading')
+        # Per-utterance timings
+        jsonl_path = self.profile.get('tracing.jsonl_file', '')
+        if len(jsonl_path) > 0:
+            jsonl_path = self.profile.write_path(jsonl_path)
+
+        self.traces = TraceStore(self.profile.get('tracing.max_traces', 100),
+                                 jsonl_path)
+
+        self.preload_shared_data()
+        self.add_timeline_event('dialogue', 'preloaded')
+        self.transition('loading')
 
     def to_loading(self, from_state:str) -> None:
-        # Load all of the other actors
+        # Load all actors at once
         self.load_actors()
 
+        if self.timeout_sec is not None:
+            self._logger.debug(f'Loading...will time out after {self.timeout_sec} second(s)')
+            self.wakeupAfter(timedelta(seconds=self.timeout_sec))
+
     def in_loading(self, message: Any, sender: ActorAddress) -> None:
         if isinstance(message, Configured):
+            self.record_configured(message, sender)
+
             # Remove sender
             sender_name = None
             for name, actor in self.wait_actors.items():
@@ -115,6 +191,7 @@ class DialogueManager(RhasspyActor):
 
             if len(self.wait_actors) == 0:
                 self._logger.info('Actors loaded')
+                self.add_timeline_event('dialogue', 'ready')
                 self.transition('ready')
 
                 # Inform all actors that we're ready
@@ -124,9 +201,13 @@ class DialogueManager(RhasspyActor):
                 # Inform parent actor that we're ready
                 if self.send_ready:
                     self.send(self._parent, Ready())
+
+                self.warm_up_actors(list(self.actors.keys()))
+                self.schedule_memory_check()
         elif isinstance(message, WakeupMessage):
             wait_names = list(self.wait_actors.keys())
             self._logger.warning(f'Actor timeout! Still waiting on {wait_names} Loading anyway...')
+            self.add_timeline_event('dialogue', 'ready')
             self.transition('ready')
 
             # Inform all actors that we're ready
@@ -137,6 +218,9 @@ class DialogueManager(RhasspyActor):
             if self.send_ready:
                 self.send(self._parent, Ready(timeout=True))
 
+            self.warm_up_actors(list(self.actors.keys()))
+            self.schedule_memory_check()
+
         elif isinstance(message, StateTransition):
             self.handle_transition(message, sender)
 
@@ -193,7 +277,8 @@ class DialogueManager(RhasspyActor):
 
             # speech -> text
             wav_data = buffer_to_wav(message.data)
-            self.send(self.decoder, TranscribeWav(wav_data, handle=message.handle))
+            self.send(self.decoder, TranscribeWav(wav_data, handle=message.handle,
+                                                  trace_id=self.trace_id))
             self.transition('decoding')
         else:
             self.handle_any(message, sender)
@@ -212,13 +297,15 @@ class DialogueManager(RhasspyActor):
                 'siteId': self.site_id,
                 'text': message.text,
                 'likelihood': 1,
-                'seconds': 0
+                'seconds': self.trace.elapsed('decoding') if self.trace else 0
             }).encode()
 
             self.send(self.mqtt, MqttPublish('hermes/asr/textCaptured', payload))
 
             # Pass to intent recognizer
-            self.send(self.recognizer, RecognizeIntent(message.text, handle=message.handle))
+            self.send(self.recognizer, RecognizeIntent(message.text,
+                                                       handle=message.handle,
+                                                       trace_id=self.trace_id))
             self.transition('recognizing')
         else:
             self.handle_any(message, sender)
@@ -229,7 +316,8 @@ class DialogueManager(RhasspyActor):
             self._logger.debug(message.intent)
             if message.handle:
                 # Forward to Home Assistant
-                self.send(self.handler, HandleIntent(message.intent))
+                self.send(self.handler, HandleIntent(message.intent,
+                                                     trace_id=self.trace_id))
 
                 # Forward to MQTT (hermes)
                 self.send(self.mqtt, message)
@@ -256,93 +344,133 @@ class DialogueManager(RhasspyActor):
     # Training
     # -------------------------------------------------------------------------
 
-    def in_training_sentences(self, message: Any, sender: ActorAddress) -> None:
-        if isinstance(message, SentencesGenerated):
-            tagged_sentences = message.tagged_sentences
-
-            # Write tagged sentences to Markdown file
-            tagged_path = self.profile.write_path(
-                self.profile.get('training.tagged_sentences'))
-
-            with open(tagged_path, 'w') as tagged_file:
-                for intent, intent_sents in tagged_sentences.items():
-                    print('# intent:%s' % intent, file=tagged_file)
-                    for sentence in intent_sents:
-                        print('- %s' % sentence, file=tagged_file)
-                    print('', file=tagged_file)
-
-            self._logger.debug('Wrote tagged sentences to %s' % tagged_path)
-
-            # Train speech system
-            self.transition('training_speech')
-            self.send(self.speech_trainer,
-                      TrainSpeech(message.tagged_sentences))
-        else:
-            self.handle_forward(message, sender)
-
-    def in_training_speech(self, message: Any, sender: ActorAddress) -> None:
-        if isinstance(message, SpeechTrainingComplete):
-            self.transition('training_intent')
+    def start_training(self, message: TrainProfile, sender: ActorAddress) -> None:
+        '''Starts a training job in the background. Requests keep being handled
+        by the current actors until the re-trained ones are swapped in.'''
+        if self.training_job is not None:
+            self.send(message.receiver or sender,
+                      ProfileTrainingFailed('Training is already in progress'))
+            return
+
+        receiver = None if message.background else (message.receiver or sender)
+        job = TrainingJob(self.profile, receiver)
+        self.training_job = job
+        self.training_jobs[job.id] = job
+        while len(self.training_jobs) > DialogueManager.MAX_TRAINING_JOBS:
+            del self.training_jobs[next(iter(self.training_jobs))]
+
+        self._logger.info(f'Starting training job {job.id}')
+        if message.background:
+            self.send(message.receiver or sender, TrainingStarted(job.id))
+
+        # Trainers use a snapshot of the profile that writes into a staging
+        # directory. They load while sentences are generated.
+        self.get_actor('word_pronouncer')
+        for name in ['sentence_generator', 'speech_trainer', 'intent_trainer']:
+            actor = self.actors.get(name, None) or self.create_named_actor(name)
+            self.configure_actor(name, actor, profile=job.profile)
+
+        job.update_stage('sentences')
+        job.start_branch('speech')
+        self.send(self.sentence_generator, GenerateSentences())
+
+        # Don't wait forever if a trainer dies or a message is lost
+        timeout_sec = self.profile.get('training.timeout_sec', 0)
+        if timeout_sec > 0:
+            self.wakeupAfter(timedelta(seconds=timeout_sec),
+                             payload=('training_timeout', job.id))
+
+    def training_timed_out(self) -> None:
+        '''Fails the current training job. Its trainers are replaced, so
+        anything they still send can't be mistaken for the next job's.'''
+        timeout_sec = self.profile.get('training.timeout_sec', 0)
+        for name in ['sentence_generator', 'speech_trainer', 'intent_trainer']:
+            actor = self.actors.pop(name, None)
+            if actor is not None:
+                self.send(actor, ActorExitRequest())
+
+        self.finish_training(f'Training timed out after {timeout_sec} second(s)')
+
+    def handle_training(self, message: Any, sender: ActorAddress) -> None:
+        job = self.training_job
+        if job is None:
+            self._logger.warning(f'No training job for {message}')
+            return
+
+        if isinstance(message, TrainingProgress):
+            job.update_stage(message.stage, message.items, message.total,
+                             message.seconds, message.finished)
+        elif isinstance(message, SentencesGenerated):
+            job.update_stage('sentences', message.corpus.num_sentences,
+                             finished=True)
+
+            # Train speech system.
+            # Sentences are passed by reference (files in the staging directory).
+            self.send(self.speech_trainer, TrainSpeech(message.corpus))
+        elif isinstance(message, SentencesGrouped):
+            # Train intent recognizer while the speech trainer finishes
+            # (dictionary, pronunciations, language model).
+            job.update_stage('intent', total=message.corpus.num_sentences)
+            job.start_branch('intent')
             self.send(self.intent_trainer,
-                      TrainIntent(message.tagged_sentences,
-                                  message.sentences_by_intent))
+                      TrainIntent(message.corpus, message.sentences_path))
+        elif isinstance(message, SpeechTrainingComplete):
+            self.branch_finished(job, 'speech')
         elif isinstance(message, SpeechTrainingFailed):
-            self.transition('ready')
-            self.send(self.training_receiver, ProfileTrainingFailed())
+            # Keep the list of unknown words so they can be fixed (and their
+            # guessed pronunciations)
+            job.commit([self.profile.get('speech_to_text.pocketsphinx.unknown_words',
+                                         'unknown_words.txt'),
+                        os.path.join(CACHE_DIR, 'g2p.json')])
+
+            self.branch_finished(job, 'speech',
+                                 message.reason or 'Speech training failed')
+        elif isinstance(message, IntentTrainingComplete):
+            intent_stage = job.stages.get('intent', {})
+            job.update_stage('intent', intent_stage.get('total') or 0, finished=True)
+            self.branch_finished(job, 'intent')
+
+    def branch_finished(self, job:TrainingJob, branch:str, error:str='') -> None:
+        '''Commits the job once speech and intent training have both finished.'''
+        if not job.finish_branch(branch, error):
+            return
+
+        if len(job.branch_errors) > 0:
+            self.finish_training(job.branch_errors[0])
         else:
-            self.handle_forward(message, sender)
-
-    def in_training_intent(self, message: Any, sender: ActorAddress) -> None:
-        if isinstance(message, IntentTrainingComplete):
-            self._logger.debug('Reloading actors')
-
-            # Wake listener
-            self.send(self.wake, ActorExitRequest())
-            self.wake = self.createActor(self.wake_class)
-            self.actors['wake'] = self.wake
+            self._logger.info('Training complete')
+            for path in job.commit():
+                self._logger.debug(f'Updated {path}')
 
-            # Speech decoder
-            self.send(self.decoder, ActorExitRequest())
-            self.decoder = self.createActor(self.decoder_class)
-            self.actors['decoder'] = self.decoder
+            # New actors will share the re-trained data
+            self.preload_shared_data()
 
-            # Intent recognizer
-            self.send(self.recognizer, ActorExitRequest())
-            self.recognizer = self.createActor(self.recognizer_class)
-            self.actors['recognizer'] = self.recognizer
+            # Current actors keep handling requests until the new ones are
+            # loaded.
+            job.update_stage('reload', total=3)
+            self.load_standby(['wake', 'decoder', 'recognizer'])
 
-            # Configure actors
-            self.wait_actors: Dict[ActorAddress, str] = {
-                'wake': self.wake,
-                'decoder': self.decoder,
-                'recognizer': self.recognizer
-            }
+    def finish_training(self, error:str='') -> None:
+        job = self.training_job
+        if job is None:
+            return
 
-            for name, actor in self.wait_actors.items():
-                if actor in [self.mqtt]:
-                    continue # skip
+        self.training_job = None
+        if (len(error) == 0) and ('reload' in job.stages):
+            job.update_stage('reload', job.stages['reload']['total'], finished=True)
 
-                self.send(actor, ConfigureEvent(self.profile,
-                                                preload=self.preload,
-                                                **self.actors))
+        job.finish(error)
 
-            self._logger.info('Training complete')
-            self.transition('training_loading')
-
-    def in_training_loading(self, message: Any, sender: ActorAddress) -> None:
-        if isinstance(message, Configured):
-            self.wait_actors = {
-                name: actor for name, actor in self.wait_actors.items()
-                if actor != sender
-            }
-
-            if len(self.wait_actors) == 0:
-                self._logger.info('Actors reloaded')
-                self.transition('ready')
-                self.send(self.training_receiver,
-                          ProfileTrainingComplete())
+        if len(error) > 0:
+            self._logger.error(f'Training job {job.id} failed: {error}')
         else:
-            self.handle_forward(message, sender)
+            self._logger.info(f'Training job {job.id} finished in {job.end_time - job.start_time:0.2f} second(s)')
+
+        if job.receiver is not None:
+            if len(error) > 0:
+                self.send(job.receiver, ProfileTrainingFailed(error, job.json()))
+            else:
+                self.send(job.receiver, ProfileTrainingComplete(job.json()))
 
     # -------------------------------------------------------------------------
 
@@ -363,6 +491,14 @@ class DialogueManager(RhasspyActor):
         elif isinstance(message, RecognizeIntent):
             # text -> intent
             self.send(self.recognizer, RecognizeIntent(message.text, sender, message.handle))
+        elif isinstance(message, StartAudioStream):
+            # raw audio -> VAD -> text -> intent
+            session = self.createActor(StreamingSession)
+            self.send(session, ConfigureEvent(self.profile,
+                                              receiver=message.receiver or sender,
+                                              handle=message.handle,
+                                              transitions=False,
+                                              **self.actors))
         elif isinstance(message, HandleIntent):
             # intent -> action
             self.send(self.handler, HandleIntent(message.intent, sender))
@@ -371,24 +507,27 @@ class DialogueManager(RhasspyActor):
             self.send(self.mqtt, IntentRecognized(message.intent))
         elif isinstance(message, GetWordPhonemes):
             # eSpeak -> CMU
-            self.send(self.word_pronouncer,
+            self.send(self.get_actor('word_pronouncer'),
                       GetWordPhonemes(message.word, receiver=sender))
         elif isinstance(message, SpeakWord):
             # eSpeak -> WAV
-            self.send(self.word_pronouncer,
+            self.send(self.get_actor('word_pronouncer'),
                       SpeakWord(message.word, receiver=sender))
         elif isinstance(message, GetWordPronunciations):
             # word -> [CMU]
-            self.send(self.word_pronouncer,
+            self.send(self.get_actor('word_pronouncer'),
                       GetWordPronunciations(message.word,
                                             n=message.n,
                                             receiver=sender))
         elif isinstance(message, TrainProfile):
-            # Training
-            self.send(self.wake, StopListeningForWakeWord())
-            self.training_receiver = message.receiver or sender
-            self.transition('training_sentences')
-            self.send(self.sentence_generator, GenerateSentences())
+            # Training (in the background)
+            self.start_training(message, sender)
+        elif isinstance(message, GetTrainingJob):
+            if message.job_id is None:
+                self.send(sender, [job.json() for job in self.training_jobs.values()])
+            else:
+                job = self.training_jobs.get(message.job_id, None)
+                self.send(sender, job.json() if job is not None else None)
         elif isinstance(message, StartRecordingToBuffer):
             # Record WAV
             self.send(self.recorder, message)
@@ -401,20 +540,71 @@ class DialogueManager(RhasspyActor):
             # Track state of every actor
             self.handle_transition(message, sender)
         elif isinstance(message, GetActorStates):
-            self.send(sender, self.actor_states)
-        elif isinstance(message, WakeupMessage):
-            pass
+            if message.timeline:
+                self.send(sender, { 'states': dict(self.actor_states),
+                                    'timeline': list(self.timeline) })
+            else:
+                self.send(sender, self.actor_states)
+        elif isinstance(message, TraceSpan):
+            # Timing from another actor
+            self.traces.add_span(message)
+        elif isinstance(message, GetTraces):
+            self.send(sender, self.traces.get(message.trace_id))
         else:
             self.handle_forward(message, sender)
 
     def handle_transition(self, message:StateTransition, sender:ActorAddress) -> None:
         self.actor_states[message.name] = message.to_state
+        if self._state in ['started', 'loading']:
+            # Only keep transitions from startup
+            self.add_timeline_event(message.name, message.to_state)
+
         topic = 'rhasspy/%s/transition/%s' % (self.profile.name, message.name)
         payload = message.to_state.encode()
         self.send(self.mqtt, MqttPublish(topic, payload))
 
     def handle_forward(self, message: Any, sender: ActorAddress) -> None:
-        if isinstance(message, GetMicrophones):
+        if isinstance(message, GetActors):
+            # name -> address
+            self.send(sender, dict(self.actors))
+        elif isinstance(message, GetActorResources):
+            # name -> PID, memory, CPU
+            self.send(sender, self.get_actor_resources())
+        elif isinstance(message, GetActorLoadTimes):
+            # name -> seconds to configure
+            self.send(sender, dict(self.load_times))
+        elif isinstance(message, SentencesGenerated) \
+             or isinstance(message, SentencesGrouped) \
+             or isinstance(message, SpeechTrainingComplete) \
+             or isinstance(message, SpeechTrainingFailed) \
+             or isinstance(message, IntentTrainingComplete) \
+             or isinstance(message, TrainingProgress):
+            self.handle_training(message, sender)
+        elif isinstance(message, ModelState):
+            if sender in self.standby.values():
+                self.standby_model_state(message, sender)
+            else:
+                self.record_model_state(message, sender)
+        elif isinstance(message, GetReadiness):
+            self.send(sender, self.get_readiness())
+        elif isinstance(message, Configured):
+            if sender in self.standby.values():
+                self.standby_configured(message, sender)
+            else:
+                self.record_configured(message, sender)
+        elif isinstance(message, WakeupMessage):
+            if message.payload == 'check_memory':
+                self.check_memory_budget()
+                self.schedule_memory_check()
+            elif message.payload == ('standby_timeout', self.standby_id) \
+                 and (len(self.standby) > 0):
+                waiting = sorted(self.standby_waiting)
+                self._logger.warning(f'Timeout waiting for new {waiting}. Swapping anyway...')
+                self.swap_standby()
+            elif (self.training_job is not None) \
+                 and (message.payload == ('training_timeout', self.training_job.id)):
+                self.training_timed_out()
+        elif isinstance(message, GetMicrophones):
             # Get all microphones
             recorder_class = self.recorder_class
             if message.system is not None:
@@ -448,6 +638,249 @@ class DialogueManager(RhasspyActor):
                   or isinstance(message, ChildActorExited)):
             self._logger.warning('Unhandled message: %s' % message)
 
+    # -------------------------------------------------------------------------
+    # Resources
+    # -------------------------------------------------------------------------
+
+    def configure_actor(self, name:str, actor:ActorAddress,
+                        actors:Optional[Dict[str, ActorAddress]]=None,
+                        profile:Optional[Profile]=None) -> None:
+        self.configure_times[name] = time.perf_counter()
+        self.add_timeline_event(name, 'configure')
+        self.send(actor, ConfigureEvent(profile or self.profile,
+                                        preload=self.preload,
+                                        **(actors or self.actors)))
+
+    def record_configured(self, message: Configured, sender: ActorAddress) -> None:
+        '''Records PID and configure time of an actor.'''
+        for name, actor in self.actors.items():
+            if actor == sender:
+                self.actor_pids[name] = message.pid
+
+                start_time = self.configure_times.pop(name, None)
+                if start_time is not None:
+                    self.load_times[name] = time.perf_counter() - start_time
+                    self.add_timeline_event(name, 'configured')
+
+    # -------------------------------------------------------------------------
+    # Standby actors (reload after training)
+    # -------------------------------------------------------------------------
+
+    def load_standby(self, names:List[str]) -> None:
+        '''Creates new actors next to the current ones. They replace the
+        current actors once they're configured and warmed up (swap_standby).'''
+        for actor in self.standby.values():
+            # Replaced by an even newer standby
+            self.send(actor, ActorExitRequest())
+
+        self.standby_id += 1
+        self.standby = { name: self.create_actor(name, getattr(self, name + '_class'))
+                         for name in names }
+        self.standby_waiting = set(names)
+        self.standby_models = {}
+
+        # Configure with the addresses of the new actors
+        actors = dict(self.actors)
+        actors.update(self.standby)
+        for name, actor in self.standby.items():
+            self.configure_actor(name, actor, actors)
+
+        if self.timeout_sec is not None:
+            self.wakeupAfter(timedelta(seconds=self.timeout_sec),
+                             payload=('standby_timeout', self.standby_id))
+
+    def standby_configured(self, message: Configured, sender: ActorAddress) -> None:
+        for name, actor in self.standby.items():
+            if actor != sender:
+                continue
+
+            start_time = self.configure_times.pop(name, None)
+            if start_time is not None:
+                self.load_times[name] = time.perf_counter() - start_time
+                self.add_timeline_event(name, 'configured')
+
+            self.actor_pids[name] = message.pid
+
+            if self.profile.get('rhasspy.warm_up', True):
+                # Load models before taking over
+                self.send(actor, WarmUp())
+            else:
+                self.standby_ready(name)
+
+    def standby_model_state(self, message: ModelState, sender: ActorAddress) -> None:
+        for name, actor in self.standby.items():
+            if actor != sender:
+                continue
+
+            self.standby_models[name] = message.models
+            if all(model['state'] in ['loaded', 'failed']
+                   for model in message.models.values()):
+                self.add_timeline_event(name, 'warmed_up')
+                self.standby_ready(name)
+
+    def standby_ready(self, name:str) -> None:
+        self.standby_waiting.discard(name)
+        if self.training_job is not None:
+            self.training_job.update_stage('reload',
+                                           len(self.standby) - len(self.standby_waiting),
+                                           len(self.standby))
+        if len(self.standby_waiting) == 0:
+            self.swap_standby()
+
+    def swap_standby(self) -> None:
+        '''Switches to the standby actors and retires the old ones.'''
+        failed = [f'{name}.{model}'
+                  for name, models in self.standby_models.items()
+                  for model, state in models.items()
+                  if state['state'] == 'failed']
+
+        standby, self.standby = self.standby, {}
+        self.standby_waiting = set()
+
+        if len(failed) > 0:
+            # Keep the old actors (and models)
+            self._logger.error(f'Failed to load {failed}. Keeping current actors.')
+            for actor in standby.values():
+                self.send(actor, ActorExitRequest())
+
+            self.finish_training(f'Failed to load {failed}')
+            return
+
+        old_actors = { name: self.actors[name] for name in standby }
+        for name, actor in standby.items():
+            setattr(self, name, actor)
+            self.actors[name] = actor
+            self.model_states[name] = self.standby_models.get(name, {})
+
+        if ('wake' in standby) and (self._state == 'asleep'):
+            # Move wake word listening over
+            self.send(old_actors['wake'], StopListeningForWakeWord())
+            self.send(self.wake, ListenForWakeWord())
+
+        # Old actors finish whatever is already in their mailbox first
+        for actor in old_actors.values():
+            self.send(actor, ActorExitRequest())
+
+        self._logger.info('Actors reloaded')
+        self.finish_training()
+
+    # -------------------------------------------------------------------------
+
+    def warm_up_actors(self, names:List[str]) -> None:
+        '''Has actors load their models in the background (see rhasspy.warm_up).'''
+        if not self.profile.get('rhasspy.warm_up', True):
+            return
+
+        warmed_up:List[ActorAddress] = []
+        for name in names:
+            actor = self.actors.get(name, None)
+            if (actor is None) or (actor in warmed_up):
+                continue
+
+            self.model_states.pop(name, None)
+            self.warming_up.add(name)
+            self.send(actor, WarmUp())
+            warmed_up.append(actor)
+
+    def record_model_state(self, message:ModelState, sender:ActorAddress) -> None:
+        for name, actor in self.actors.items():
+            if (actor == sender) and (name in self.warming_up):
+                self.model_states[name] = message.models
+                done = all(model['state'] in ['loaded', 'failed']
+                           for model in message.models.values())
+
+                if done:
+                    self.warming_up.remove(name)
+                    self.add_timeline_event(name, 'warmed_up')
+
+    def get_readiness(self) -> Dict[str, Any]:
+        '''Overall readiness and the state of each actor's models.'''
+        failed = [f'{name}.{model}'
+                  for name, models in self.model_states.items()
+                  for model, state in models.items()
+                  if state['state'] == 'failed']
+
+        loading = self._state in ['started', 'loading']
+
+        return {
+            'ready': (not loading) and (len(self.warming_up) == 0) \
+                     and (len(failed) == 0),
+            'state': self._state,
+            'waiting': sorted(self.warming_up),
+            'failed': failed,
+            'models': dict(self.model_states),
+            'training': self.training_job.id if self.training_job is not None else None
+        }
+
+    def add_timeline_event(self, name:str, event:str) -> None:
+        self.timeline.append({ 'actor': name,
+                               'event': event,
+                               'seconds': time.perf_counter() - self.start_time })
+
+    def get_actor_resources(self) -> Dict[str, Dict[str, Any]]:
+        '''Reads PID, memory, and CPU time of each actor process.'''
+        pids = dict(self.actor_pids)
+        pids['dialogue'] = os.getpid()
+
+        resources:Dict[str, Dict[str, Any]] = {}
+        for name, pid in pids.items():
+            stats = get_process_stats(pid)
+            if stats is not None:
+                resources[name] = stats
+
+        return resources
+
+    def schedule_memory_check(self) -> None:
+        if self.profile.get('rhasspy.memory_budget_mb', 0):
+            check_sec = self.profile.get('rhasspy.memory_check_sec', 60)
+            self.wakeupAfter(timedelta(seconds=check_sec), payload='check_memory')
+
+    def check_memory_budget(self) -> None:
+        '''Warns when an actor process goes over its memory budget.'''
+        budget_mb = self.profile.get('rhasspy.memory_budget_mb', 0)
+        for name, stats in self.get_actor_resources().items():
+            # Either one budget for all actors or name -> budget
+            actor_budget_mb = budget_mb.get(name, 0) if isinstance(budget_mb, dict) \
+                else budget_mb
+
+            rss_mb = stats['rss_bytes'] / (1024 * 1024)
+            if (actor_budget_mb > 0) and (rss_mb > actor_budget_mb):
+                if name not in self.over_budget:
+                    self._logger.warning('%s (pid=%s) is over its memory budget: %0.1f MB > %s MB',
+                                         name, stats['pid'], rss_mb, actor_budget_mb)
+                    self.over_budget.add(name)
+            elif name in self.over_budget:
+                self._logger.info('%s is back under its memory budget (%0.1f MB)',
+                                  name, rss_mb)
+                self.over_budget.remove(name)
+
+    # -------------------------------------------------------------------------
+    # Tracing
+    # -------------------------------------------------------------------------
+
+    def transition(self, to_state: str) -> None:
+        # Time each state of the utterance
+        if self.trace is not None:
+            self.trace.end_span(self._state)
+            if (to_state not in DialogueManager.TRACED_STATES) \
+               or (to_state == 'awake'):
+                self.traces.finish(self.trace)
+                self.trace = None
+
+        if to_state == 'awake':
+            # New utterance
+            self.trace = Trace()
+            self.traces.add(self.trace)
+
+        if self.trace is not None:
+            self.trace.start_span(to_state)
+
+        RhasspyActor.transition(self, to_state)
+
+    @property
+    def trace_id(self) -> Optional[str]:
+        return self.trace.trace_id if self.trace is not None else None
+
     # -------------------------------------------------------------------------
     # Utilities
     # -------------------------------------------------------------------------
@@ -455,98 +888,180 @@ class DialogueManager(RhasspyActor):
     def load_actors(self) -> None:
         self._logger.debug('Loading actors')
 
+        # MQTT client
+        from .mqtt import HermesMqtt
+        self.mqtt_class = HermesMqtt
+        self.mqtt:ActorAddress = self.create_actor('mqtt', self.mqtt_class)
+        self.actors['mqtt'] = self.mqtt
+
         # Microphone
         mic_system = self.profile.get('microphone.system', 'dummy')
         self.recorder_class = DialogueManager.get_microphone_class(mic_system)
-        self.recorder:ActorAddress = self.createActor(self.recorder_class)
+        self.recorder:ActorAddress = self.create_actor('recorder', self.recorder_class)
         self.actors['recorder'] = self.recorder
 
         # Audio player
         player_system = self.profile.get('sounds.system', 'dummy')
         self.player_class = DialogueManager.get_sound_class(player_system)
-        self.player:ActorAddress = self.createActor(self.player_class)
+        self.player:ActorAddress = self.create_actor('player', self.player_class)
         self.actors['player'] = self.player
 
         # Wake listener
         wake_system = self.profile.get('wake.system', 'dummy')
         self.wake_class = DialogueManager.get_wake_class(wake_system)
-        self.wake:ActorAddress = self.createActor(self.wake_class)
+        self.wake:ActorAddress = self.create_actor('wake', self.wake_class)
         self.actors['wake'] = self.wake
 
         # Command listener
         command_system = self.profile.get('command.system', 'dummy')
         self.command_class = DialogueManager.get_command_class(command_system)
-        self.command:ActorAddress = self.createActor(self.command_class)
+        self.command:ActorAddress = self.create_actor('command', self.command_class)
         self.actors['command'] = self.command
 
         # Speech decoder
         decoder_system = self.profile.get('speech_to_text.system', 'dummy')
         self.decoder_class = DialogueManager.get_decoder_class(decoder_system)
-        self.decoder:ActorAddress = self.createActor(self.decoder_class)
+        self.decoder:ActorAddress = self.create_actor('decoder', self.decoder_class)
         self.actors['decoder'] = self.decoder
 
         # Intent recognizer
         recognizer_system = self.profile.get('intent.system', 'dummy')
         self.recognizer_class = DialogueManager.get_recognizer_class(recognizer_system)
-        self.recognizer:ActorAddress = self.createActor(self.recognizer_class)
+        self.recognizer:ActorAddress = self.create_actor('recognizer', self.recognizer_class)
         self.actors['recognizer'] = self.recognizer
 
         # Intent handler
         handler_system = self.profile.get('handle.system', 'dummy')
         self.handler_class = DialogueManager.get_intent_handler_class(handler_system)
-        self.handler:ActorAddress = self.createActor(self.handler_class)
+        self.handler:ActorAddress = self.create_actor('handler', self.handler_class)
         self.actors['handler'] = self.handler
 
         self.hass_handler:ActorAddress = self.handler
         if handler_system != 'hass':
             # Create a separate actor just for home assistant
             from .intent_handler import HomeAssistantIntentHandler
-            self.hass_handler = self.createActor(HomeAssistantIntentHandler)
+            self.hass_handler = self.create_actor('hass_handler',
+                                                 HomeAssistantIntentHandler)
 
         self.actors['hass_handler'] = self.hass_handler
 
         # Sentence generator
         from .train import JsgfSentenceGenerator
         self.sentence_generator_class = JsgfSentenceGenerator
-        self.sentence_generator:ActorAddress = self.createActor(self.sentence_generator_class)
-        self.actors['sentence_generator'] = self.sentence_generator
 
         # Speech trainer
         speech_trainer_system = self.profile.get('training.speech_to_text.system', 'auto')
         self.speech_trainer_class = DialogueManager.get_speech_trainer_class(
             speech_trainer_system, decoder_system)
 
-        self.speech_trainer:ActorAddress = self.createActor(self.speech_trainer_class)
-        self.actors['speech_trainer'] = self.speech_trainer
-
         # Intent trainer
         intent_trainer_system = self.profile.get('training.intent.system', 'auto')
         self.intent_trainer_class = DialogueManager.get_intent_trainer_class(
             intent_trainer_system, recognizer_system)
 
-        self.intent_trainer:ActorAddress = self.createActor(self.intent_trainer_class)
-        self.actors['intent_trainer'] = self.intent_trainer
-
         # Word pronouncer
         from .pronounce import PhonetisaurusPronounce
         self.word_pronouncer_class = PhonetisaurusPronounce
-        self.word_pronouncer:ActorAddress = self.createActor(self.word_pronouncer_class)
-        self.actors['word_pronouncer'] = self.word_pronouncer
 
-        # Configure actors
+        # Training and pronunciation actors are only created when first used,
+        # unless they're missing from rhasspy.on_demand_actors.
+        on_demand = self.profile.get('rhasspy.on_demand_actors',
+                                     DialogueManager.ON_DEMAND_ACTORS)
+
+        for name in DialogueManager.ON_DEMAND_ACTORS:
+            if name not in on_demand:
+                for dep_name in DialogueManager.ACTOR_DEPENDENCIES.get(name, []) + [name]:
+                    if dep_name not in self.actors:
+                        self.create_named_actor(dep_name)
+
+        # Configure all actors in parallel (including MQTT).
+        # Messages they send each other before they're configured are held
+        # until then.
         self.wait_actors:Dict[str, ActorAddress] = {}
         for name, actor in self.actors.items():
-            if actor in [self.mqtt]:
-                continue # skip
+            if (name == 'hass_handler') and (actor == self.handler):
+                continue # same actor
 
-            self.send(actor, ConfigureEvent(self.profile,
-                                            preload=self.preload,
-                                            **self.actors))
+            self.configure_actor(name, actor)
             self.wait_actors[name] = actor
 
         actor_names = list(self.wait_actors.keys())
         self._logger.debug(f'Actors created. Waiting for {actor_names} to start.')
 
+    def create_named_actor(self, name:str) -> ActorAddress:
+        '''Creates an actor from its class attribute (e.g., speech_trainer_class).'''
+        actor = self.create_actor(name, getattr(self, name + '_class'))
+        setattr(self, name, actor)
+        self.actors[name] = actor
+
+        return actor
+
+    def get_actor(self, name:str) -> ActorAddress:
+        '''Gets an actor's address, creating and configuring it first if it
+        was deferred (see rhasspy.on_demand_actors).'''
+        actor = self.actors.get(name, None)
+        if actor is None:
+            for dep_name in DialogueManager.ACTOR_DEPENDENCIES.get(name, []):
+                self.get_actor(dep_name)
+
+            self._logger.debug(f'Creating {name} on demand')
+            actor = self.create_named_actor(name)
+            self.configure_actor(name, actor)
+
+        return actor
+
+    def preload_shared_data(self) -> None:
+        '''Loads large read-only data (base dictionary, etc.) before actors
+        are forked so they can share it copy-on-write.'''
+        if self.profile.get('rhasspy.preload_shared_data', True):
+            from . import shared
+            for path in shared.preload(self.profile):
+                self._logger.debug(f'Preloaded {path}')
+
+    def get_actor_groups(self) -> Dict[str, List[str]]:
+        '''Group name -> names of actors that share a process.'''
+        actor_groups = dict(self.profile.get('rhasspy.actor_groups', {}))
+
+        if self.profile.get('speech_to_text.pocketsphinx.shared_decoder', False) \
+           and (self.profile.get('wake.system') == 'pocketsphinx') \
+           and (self.profile.get('speech_to_text.system') == 'pocketsphinx'):
+            # Wake listener and decoder need to be in the same process
+            together = any(('wake' in names) and ('decoder' in names)
+                           for names in actor_groups.values())
+
+            if not together:
+                grouped = [name for names in actor_groups.values() for name in names]
+                if ('wake' in grouped) or ('decoder' in grouped):
+                    self._logger.warning('wake and decoder are in different actor groups. Pocketsphinx decoder will not be shared.')
+                else:
+                    actor_groups['pocketsphinx'] = ['wake', 'decoder']
+
+        return actor_groups
+
+    def create_actor(self, name:str, actor_class:Type[RhasspyActor]) -> ActorAddress:
+        '''Creates an actor in its own process, or inside of a shared process
+        if it's in one of the groups from rhasspy.actor_groups.'''
+        self.add_timeline_event(name, 'created')
+
+        for group_name, member_names in self.get_actor_groups().items():
+            if name not in member_names:
+                continue
+
+            group = self.groups.get(group_name, None)
+            if group is None:
+                group = self.createActor(ActorGroup)
+                self.groups[group_name] = group
+                self._logger.debug(f'Created actor group {group_name}')
+
+            # Member ids are never reused (actors are re-created after training)
+            self.num_members += 1
+            member_id = f'{name}-{self.num_members}'
+            self.send(group, HostActor(member_id, actor_class))
+
+            return ColocatedAddress(group, member_id)
+
+        return self.createActor(actor_class)
+
     # -------------------------------------------------------------------------
 
     @classmethod
@@ -0,0 +1,229 @@
+import re
+from typing import List, Optional, Tuple
+
+# -----------------------------------------------------------------------------
+# Expression trees for the simplified JSGF used in sentences.ini.
+#
+# Rules are parsed straight from the text of each ini section instead of
+# being written to .gram files and parsed with pyjsgf. Trees have the same
+# shape as pyjsgf's, so sentences are generated the same way.
+# -----------------------------------------------------------------------------
+
+class Expression:
+    def __init__(self, children:Optional[List['Expression']]=None,
+                 tag:str='') -> None:
+        self.children = children or []
+        self.tag = tag
+
+    def compile(self) -> str:
+        raise NotImplementedError()
+
+    def _compile_tag(self, text:str) -> str:
+        if self.tag:
+            return '%s {%s}' % (text, self.tag)
+
+        return text
+
+class Literal(Expression):
+    '''One or more words (a b c)'''
+    def __init__(self, text:str, tag:str='') -> None:
+        Expression.__init__(self, tag=tag)
+
+        # Not case sensitive (same as pyjsgf)
+        self.text = text.lower()
+
+    def compile(self) -> str:
+        return self._compile_tag(self.text)
+
+class Sequence(Expression):
+    '''Expressions one after another (a (b | c) [d])'''
+    def compile(self) -> str:
+        return self._compile_tag(' '.join(c.compile() for c in self.children))
+
+class Alternatives(Expression):
+    '''One of several expressions (a | b | c)'''
+    def compile(self) -> str:
+        return self._compile_tag('|'.join(c.compile() for c in self.children))
+
+class Group(Expression):
+    '''Required grouping ((a))'''
+    def compile(self) -> str:
+        return self._compile_tag('(%s)' % ' '.join(c.compile() for c in self.children))
+
+class OptionalGroup(Expression):
+    '''Optional grouping ([a])'''
+    def __init__(self, child:Expression, tag:str='') -> None:
+        Expression.__init__(self, [child], tag)
+        self.child = child
+
+    def compile(self) -> str:
+        return self._compile_tag('[%s]' % self.child.compile())
+
+class RuleRef(Expression):
+    '''Reference to a rule (<rule> or <Grammar.rule>)'''
+    def __init__(self, name:str, tag:str='') -> None:
+        Expression.__init__(self, tag=tag)
+        self.name = name
+
+    def compile(self) -> str:
+        return self._compile_tag('<%s>' % self.name)
+
+class Rule:
+    def __init__(self, name:str, expansion:Expression, public:bool=False) -> None:
+        self.name = name
+        self.expansion = expansion
+        self.public = public
+
+class Grammar:
+    '''Rules from one section of sentences.ini'''
+    def __init__(self, name:str, rules:List[Rule]) -> None:
+        self.name = name
+        self.rules = rules
+
+# -----------------------------------------------------------------------------
+# Parser
+# -----------------------------------------------------------------------------
+
+# Words, tags ({...}), rule references (<...>), and special characters
+_TOKEN_PATTERN = re.compile(r'\s*(?:(\{[^}]*\})|(<[^<>\s]+>)|([()\[\]|;=*+/])|([^\s()\[\]{}<>|;=*+/]+))')
+
+def parse_grammar(name:str, rules:List[str]) -> Grammar:
+    '''Parses JSGF rules (<name> = expansion;) from a sentences.ini section.'''
+    return Grammar(name, [parse_rule(rule) for rule in rules])
+
+def parse_rule(text:str) -> Rule:
+    '''Parses a single JSGF rule ([public] <name> = expansion;).'''
+    # Sentences that start with an optional word are escaped in ini files (\[)
+    text = re.sub(r'\\\[', '[', text)
+
+    parser = _Parser(text)
+    public = False
+    if parser.peek() == 'public':
+        parser.next()
+        public = True
+
+    ref = parser.next()
+    if not (ref.startswith('<') and ref.endswith('>')):
+        parser.error('Expected rule name')
+
+    parser.expect('=')
+    expansion = parser.parse_expansion()
+    parser.expect(';')
+    if parser.peek() is not None:
+        parser.error('Unexpected text after rule')
+
+    return Rule(ref[1:-1], expansion, public)
+
+class _Parser:
+    def __init__(self, text:str) -> None:
+        self.text = text
+        self.tokens:List[Tuple[str, int]] = []
+
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = _TOKEN_PATTERN.match(text, pos)
+            if (match is None) or (match.end() == pos):
+                raise ValueError('Invalid JSGF at %s: %s' % (pos, self.text))
+
+            self.tokens.append((match.group(match.lastindex), match.start(match.lastindex)))
+            pos = match.end()
+
+        self.index = 0
+
+    def peek(self) -> Optional[str]:
+        if self.index < len(self.tokens):
+            return self.tokens[self.index][0]
+
+        return None
+
+    def next(self) -> str:
+        token = self.peek()
+        if token is None:
+            self.error('Unexpected end')
+
+        self.index += 1
+        return token
+
+    def expect(self, token:str) -> None:
+        if self.next() != token:
+            self.index -= 1
+            self.error(f'Expected {token}')
+
+    def error(self, message:str) -> None:
+        pos = self.tokens[self.index][1] if self.index < len(self.tokens) else len(self.text)
+        raise ValueError('%s at %s: %s' % (message, pos, self.text))
+
+    # -------------------------------------------------------------------------
+
+    def parse_expansion(self) -> Expression:
+        '''a | b | c'''
+        alternatives = [self.parse_sequence()]
+        while self.peek() == '|':
+            self.next()
+            alternatives.append(self.parse_sequence())
+
+        if len(alternatives) == 1:
+            return alternatives[0]
+
+        return Alternatives(alternatives)
+
+    def parse_sequence(self) -> Expression:
+        '''a (b) [c] <d>'''
+        items:List[Expression] = []
+        words:List[str] = []
+
+        while True:
+            token = self.peek()
+            if (token is None) or (token in ['|', ')', ']', ';']):
+                break
+
+            if token in ['*', '+', '/', '=']:
+                self.error(f'Unsupported JSGF ({token})')
+
+            self.next()
+            if token.startswith('{'):
+                # Tag the preceding item (consecutive words are one item)
+                if len(words) > 0:
+                    items.append(Literal(' '.join(words)))
+                    words = []
+
+                if len(items) == 0:
+                    self.error('Tag without expression')
+
+                tag = token[1:-1].strip()
+                if items[-1].tag:
+                    # Additional tags wrap the item in a group
+                    items[-1] = Group([items[-1]], tag)
+                else:
+                    items[-1].tag = tag
+
+                continue
+
+            if token in ['(', '[']:
+                close = ')' if token == '(' else ']'
+                expansion = self.parse_expansion()
+                self.expect(close)
+                item:Expression = Group([expansion]) if token == '(' \
+                    else OptionalGroup(expansion)
+            elif token.startswith('<'):
+                item = RuleRef(token[1:-1])
+            else:
+                words.append(token)
+                continue
+
+            if len(words) > 0:
+                items.append(Literal(' '.join(words)))
+                words = []
+
+            items.append(item)
+
+        if len(words) > 0:
+            items.append(Literal(' '.join(words)))
+
+        if len(items) == 0:
+            self.error('Empty expression')
+        elif len(items) == 1:
+            return items[0]
+
+        return Sequence(items)
@@ -5,13 +5,14 @@ import json
 import logging
 import subprocess
 from urllib.parse import urljoin
-from typing import Dict, Any, Optional, Tuple, List
+from typing import Dict, Any, Optional, Tuple, List, Callable
 
 from thespian.actors import ActorAddress
 
 from .actor import RhasspyActor
 from .profiles import Profile
 from .utils import empty_intent
+from . import shared
 
 # -----------------------------------------------------------------------------
 # Events
@@ -20,10 +21,12 @@ from .utils import empty_intent
 class RecognizeIntent:
     def __init__(self, text: str,
                  receiver:Optional[ActorAddress]=None,
-                 handle:bool=True):
+                 handle:bool=True,
+                 trace_id:Optional[str]=None):
         self.text = text
         self.receiver = receiver
         self.handle = handle
+        self.trace_id = trace_id
 
 class IntentRecognized:
     def __init__(self,
@@ -89,7 +92,9 @@ class FuzzyWuzzyRecognizer(RhasspyActor):
         self.examples: Optional[Dict[str, Any]] = None
 
     def to_started(self, from_state:str) -> None:
-        self.load_examples()
+        if self.config.get('preload', False):
+            self.load_examples()
+
         self.transition('loaded')
 
     def in_loaded(self, message: Any, sender: ActorAddress) -> None:
@@ -147,6 +152,9 @@ class FuzzyWuzzyRecognizer(RhasspyActor):
 
     # -------------------------------------------------------------------------
 
+    def get_models(self) -> Dict[str, Callable[[], None]]:
+        return { 'examples': self.load_examples }
+
     def load_examples(self) -> None:
         if self.examples is None:
             '''Load JSON file with intent examples if not already cached'''
@@ -154,9 +162,8 @@ class FuzzyWuzzyRecognizer(RhasspyActor):
                 self.profile.get('intent.fuzzywuzzy.examples_json'))
 
             if os.path.exists(examples_path):
-                with open(examples_path, 'r') as examples_file:
-                    self.examples = json.load(examples_file)
-
+                # Shared with other actors (don't modify)
+                self.examples = shared.intent_examples(examples_path)
                 self._logger.debug('Loaded examples from %s' % examples_path)
 
 
@@ -212,7 +219,9 @@ class AdaptIntentRecognizer(RhasspyActor):
         self.engine = None
 
     def to_started(self, from_state:str) -> None:
-        self.load_engine()
+        if self.config.get('preload', False):
+            self.load_engine()
+
         self.transition('loaded')
 
     def in_loaded(self, message: Any, sender: ActorAddress) -> None:
@@ -262,6 +271,9 @@ class AdaptIntentRecognizer(RhasspyActor):
 
     # -------------------------------------------------------------------------
 
+    def get_models(self) -> Dict[str, Callable[[], None]]:
+        return { 'engine': self.load_engine }
+
     def load_engine(self) -> None:
         '''Configure Adapt engine if not already cached'''
         if self.engine is None:
@@ -17,9 +17,11 @@ from .profiles import Profile
 class HandleIntent:
     def __init__(self,
                  intent: Dict[str, Any],
-                 receiver:Optional[ActorAddress]=None) -> None:
+                 receiver:Optional[ActorAddress]=None,
+                 trace_id:Optional[str]=None) -> None:
         self.intent = intent
         self.receiver = receiver
+        self.trace_id = trace_id
 
 class IntentHandled:
     def __init__(self, intent: Dict[str, Any]) -> None:
@@ -149,7 +151,9 @@ class HomeAssistantIntentHandler(RhasspyActor):
         if self.pem_file is not None:
             kwargs['verify'] = self.pem_file
 
-        response = requests.post(post_url, **kwargs)
+        with self.span('hass_post'):
+            response = requests.post(post_url, **kwargs)
+
         self._logger.debug('POSTed intent to %s with headers=%s' % (post_url, headers))
         response.raise_for_status()
 
@@ -6,23 +6,26 @@ import subprocess
 import re
 from urllib.parse import urljoin
 from collections import defaultdict, Counter
-from typing import Dict, List, Set, Any, Optional
+from typing import Dict, List, Set, Any, Optional, Mapping
 
 from thespian.actors import ActorAddress
 
 from .actor import RhasspyActor
-from .stt_train import TrainingSentence
+from .train import SentenceCorpus
+from .utils import SentenceStore, IntentSentences
+from .training import TrainingCache, content_hash, file_hash, tokenizer_settings
 
 # -----------------------------------------------------------------------------
 # Events
 # -----------------------------------------------------------------------------
 
 class TrainIntent:
-    def __init__(self, tagged_sentences: Dict[str, List[str]],
-                 sentences_by_intent: Dict[str, List[TrainingSentence]],
+    '''Training sentences are in a file (see SentenceStore.load)'''
+    def __init__(self, corpus: SentenceCorpus,
+                 sentences_path: str,
                  receiver:Optional[ActorAddress]=None):
-        self.tagged_sentences = tagged_sentences
-        self.sentences_by_intent = sentences_by_intent
+        self.corpus = corpus
+        self.sentences_path = sentences_path
         self.receiver = receiver
 
 class IntentTrainingComplete:
@@ -46,20 +49,42 @@ class FuzzyWuzzyIntentTrainer(RhasspyActor):
     '''Save examples to JSON for fuzzy string matching later.'''
     def in_started(self, message: Any, sender: ActorAddress) -> None:
         if isinstance(message, TrainIntent):
-            self.train(message.tagged_sentences,
-                       message.sentences_by_intent)
+            self.train(message.corpus,
+                       SentenceStore.load(message.sentences_path))
 
             self.send(message.receiver or sender,
                       IntentTrainingComplete())
 
     def train(self,
-              tagged_sentences: Dict[str, List[str]],
-              sentences_by_intent: Dict[str, List[TrainingSentence]]) -> None:
+              corpus: SentenceCorpus,
+              sentences_by_intent: SentenceStore) -> None:
 
         examples_path = self.profile.write_path(
             self.profile.get('intent.fuzzywuzzy.examples_json'))
 
-        examples = self._make_examples(sentences_by_intent)
+        # Re-use examples of intents whose sentences haven't changed
+        cache = TrainingCache(self.profile, 'fuzzywuzzy')
+        settings = tokenizer_settings(self.profile)
+        intent_keys = { intent_name: content_hash(corpus.keys.get(intent_name, ''),
+                                                  settings)
+                        for intent_name in sentences_by_intent }
+
+        examples: Dict[str, Any] = {}
+        changed_sentences: Dict[str, IntentSentences] = {}
+        for intent_name, intent_sents in sentences_by_intent.items():
+            cached_examples = cache.get(intent_name, intent_keys[intent_name])
+            if cached_examples is None:
+                changed_sentences[intent_name] = intent_sents
+            else:
+                examples[intent_name] = cached_examples
+
+        if len(changed_sentences) > 0:
+            for intent_name, intent_examples in self._make_examples(changed_sentences).items():
+                examples[intent_name] = intent_examples
+                cache.put(intent_name, intent_keys[intent_name], intent_examples)
+
+        cache.save()
+
         with open(examples_path, 'w') as examples_file:
             json.dump(examples, examples_file, indent=4)
 
@@ -67,7 +92,7 @@ class FuzzyWuzzyIntentTrainer(RhasspyActor):
 
     # -------------------------------------------------------------------------
 
-    def _make_examples(self, sentences_by_intent: Dict[str, List[TrainingSentence]]) -> Dict[str, Any]:
+    def _make_examples(self, sentences_by_intent: Mapping[str, IntentSentences]) -> Dict[str, Any]:
         '''Write intent examples to a JSON file.'''
         from fuzzywuzzy import process
 
@@ -95,8 +120,8 @@ class RasaIntentTrainer(RhasspyActor):
     '''Uses rasaNLU HTTP API to train a recognizer.'''
     def in_started(self, message: Any, sender: ActorAddress) -> None:
         if isinstance(message, TrainIntent):
-            self.train(message.tagged_sentences,
-                       message.sentences_by_intent)
+            self.train(message.corpus,
+                       SentenceStore.load(message.sentences_path))
 
             self.send(message.receiver or sender,
                       IntentTrainingComplete())
@@ -104,8 +129,8 @@ class RasaIntentTrainer(RhasspyActor):
     # -------------------------------------------------------------------------
 
     def train(self,
-              tagged_sentences: Dict[str, List[str]],
-              sentences_by_intent: Dict[str, List[TrainingSentence]]) -> None:
+              corpus: SentenceCorpus,
+              sentences_by_intent: SentenceStore) -> None:
 
         import requests
 
@@ -121,10 +146,10 @@ class RasaIntentTrainer(RhasspyActor):
             rasa_config.get('examples_markdown', 'intent_examples.md'))
 
         with open(examples_md_path, 'w') as examples_md_file:
-            for intent_name, intent_sents in tagged_sentences.items():
+            for intent_name in corpus.intent_names():
                 # Rasa Markdown training format
                 print('## intent:%s' % intent_name, file=examples_md_file)
-                for sentence in intent_sents:
+                for sentence in corpus.tagged_sentences(intent_name):
                     print('-', sentence, file=examples_md_file)
 
                 print('', file=examples_md_file)
@@ -172,16 +197,16 @@ class AdaptIntentTrainer(RhasspyActor):
     '''Configure a Mycroft Adapt engine.'''
     def in_started(self, message: Any, sender: ActorAddress) -> None:
         if isinstance(message, TrainIntent):
-            self.train(message.tagged_sentences,
-                       message.sentences_by_intent)
+            self.train(message.corpus,
+                       SentenceStore.load(message.sentences_path))
 
             self.send(message.receiver or sender,
                       IntentTrainingComplete())
 
     # -------------------------------------------------------------------------
 
-    def train(self, tagged_sentences: Dict[str, List[str]],
-              sentences_by_intent: Dict[str, List[TrainingSentence]]) -> None:
+    def train(self, corpus: SentenceCorpus,
+              sentences_by_intent: SentenceStore) -> None:
 
         # Load "stop" words (common words that are excluded from training)
         stop_words: Set[str] = set()
@@ -195,7 +220,22 @@ class AdaptIntentTrainer(RhasspyActor):
         entities: Dict[str, Set[str]] = {}
         intents: Dict[str, Dict[str, Any]] = {}
 
+        # Re-use configuration of intents whose sentences haven't changed
+        cache = TrainingCache(self.profile, 'adapt')
+        settings = [tokenizer_settings(self.profile), file_hash(stop_words_path)]
+
         for intent_name, intent_sents in sentences_by_intent.items():
+            intent_key = content_hash(corpus.keys.get(intent_name, ''), settings)
+            cached_config = cache.get(intent_name, intent_key)
+            if cached_config is not None:
+                intents[intent_name] = cached_config['intent']
+                entities.update({ name: set(values) for name, values
+                                  in cached_config['entities'].items() })
+                continue
+
+            # Entity names are prefixed with the intent name, so they're
+            # specific to this intent.
+            intent_entities: Dict[str, Set[str]] = {}
             intent:Dict[str, Any] = {
                 'name': intent_name,
                 'require': [],
@@ -220,10 +260,10 @@ class AdaptIntentTrainer(RhasspyActor):
                 for entity_name, entity_values in slot_entities.items():
                     # Prefix entity name with intent name
                     entity_name = '{0}.{1}'.format(intent_name, entity_name)
-                    if not entity_name in entities:
-                        entities[entity_name] = set()
+                    if not entity_name in intent_entities:
+                        intent_entities[entity_name] = set()
 
-                    entities[entity_name].update(entity_values)
+                    intent_entities[entity_name].update(entity_values)
                     entity_counts[entity_name] += 1
 
                     # Split entity values by whitespace
@@ -254,13 +294,13 @@ class AdaptIntentTrainer(RhasspyActor):
             if len(required_words) > 0:
                 # Create entity for required keywords
                 entity_name = '{0}RequiredKeyword'.format(intent_name)
-                entities[entity_name] = required_words
+                intent_entities[entity_name] = required_words
                 intent['require'].append(entity_name)
 
             if len(optional_words) > 0:
                 # Create entity for required keywords
                 entity_name = '{0}OptionalKeyword'.format(intent_name)
-                entities[entity_name] = optional_words
+                intent_entities[entity_name] = optional_words
                 intent['optionally'].append(entity_name)
 
             # Add required/optional entities
@@ -274,7 +314,13 @@ class AdaptIntentTrainer(RhasspyActor):
                     intent['optionally'].append(name)
 
             intents[intent_name] = intent
+            entities.update(intent_entities)
+            cache.put(intent_name, intent_key,
+                      { 'intent': intent,
+                        'entities': { name: sorted(values)
+                                      for name, values in intent_entities.items() } })
 
+        cache.save()
         # ---------------------------------------------------------------------
 
         # Write configuration file
@@ -309,11 +355,11 @@ class CommandIntentTrainer(RhasspyActor):
 
     def in_started(self, message: Any, sender: ActorAddress) -> None:
         if isinstance(message, TrainIntent):
-            self.train(message.sentences_by_intent)
+            self.train(SentenceStore.load(message.sentences_path))
             self.send(message.receiver or sender,
                       IntentTrainingComplete())
 
-    def train(self, sentences_by_intent: Dict[str, List[TrainingSentence]]) -> None:
+    def train(self, sentences_by_intent: SentenceStore) -> None:
         try:
             self._logger.debug(self.command)
 
@@ -329,7 +375,7 @@ class CommandIntentTrainer(RhasspyActor):
 
     # -------------------------------------------------------------------------
 
-    def _make_examples(self, sentences_by_intent: Dict[str, List[TrainingSentence]]) -> Dict[str, Any]:
+    def _make_examples(self, sentences_by_intent: Mapping[str, IntentSentences]) -> Dict[str, Any]:
         '''Write intent examples to a JSON file.'''
         from fuzzywuzzy import process
 
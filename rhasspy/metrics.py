@@ -0,0 +1,146 @@
+import time
+from collections import deque
+from typing import Dict, List, Any, Tuple
+
+# -----------------------------------------------------------------------------
+
+class ActorMetrics:
+    '''Message handling and state statistics for a single actor.'''
+    def __init__(self, history_size:int=100) -> None:
+        # message type -> [count, total seconds, max seconds]
+        self.messages:Dict[str, List[float]] = {}
+
+        # message type -> count
+        self.errors:Dict[str, int] = {}
+
+        # (from state, to state) -> count
+        self.transitions:Dict[Tuple[str, str], int] = {}
+
+        # state -> total seconds spent in state
+        self.state_seconds:Dict[str, float] = {}
+
+        self.history:deque = deque(maxlen=history_size)
+        self.state:str = ''
+        self.state_start:float = time.time()
+
+    def record_message(self, message_type:str, seconds:float) -> None:
+        stats = self.messages.get(message_type, None)
+        if stats is None:
+            self.messages[message_type] = [1, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def record_error(self, message_type:str) -> None:
+        self.errors[message_type] = self.errors.get(message_type, 0) + 1
+
+    def record_transition(self, from_state:str, to_state:str) -> None:
+        now = time.time()
+        dwell_sec = now - self.state_start
+        self.state_seconds[from_state] = self.state_seconds.get(from_state, 0) + dwell_sec
+
+        key = (from_state, to_state)
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        self.history.append({
+            'time': now,
+            'from_state': from_state,
+            'to_state': to_state,
+            'dwell_sec': dwell_sec
+        })
+
+        self.state = to_state
+        self.state_start = now
+
+    def json(self) -> Dict[str, Any]:
+        # Include time spent in the current state so far
+        state_seconds = dict(self.state_seconds)
+        state_seconds[self.state] = state_seconds.get(self.state, 0) \
+            + (time.time() - self.state_start)
+
+        return {
+            'state': self.state,
+            'messages': {
+                name: { 'count': stats[0], 'total_sec': stats[1], 'max_sec': stats[2] }
+                for name, stats in self.messages.items()
+            },
+            'errors': dict(self.errors),
+            'transitions': [
+                { 'from_state': from_state, 'to_state': to_state, 'count': count }
+                for (from_state, to_state), count in self.transitions.items()
+            ],
+            'state_seconds': state_seconds,
+            'history': list(self.history)
+        }
+
+# -----------------------------------------------------------------------------
+
+def to_prometheus(metrics:Dict[str, Dict[str, Any]]) -> str:
+    '''Renders actor metrics (actor name -> ActorMetrics JSON) in the
+    Prometheus text exposition format.'''
+    lines:List[str] = []
+
+    def family(name:str, metric_type:str, help_text:str) -> None:
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+
+    def sample(name:str, labels:Dict[str, str], value:float) -> None:
+        label_str = ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels.items())
+        lines.append('%s{%s} %s' % (name, label_str, value))
+
+    family('rhasspy_actor_messages_total', 'counter',
+           'Number of messages handled by each actor')
+    for actor, actor_metrics in metrics.items():
+        for message, stats in actor_metrics['messages'].items():
+            sample('rhasspy_actor_messages_total',
+                   { 'actor': actor, 'message': message }, stats['count'])
+
+    family('rhasspy_actor_message_seconds', 'summary',
+           'Time spent handling messages')
+    for actor, actor_metrics in metrics.items():
+        for message, stats in actor_metrics['messages'].items():
+            labels = { 'actor': actor, 'message': message }
+            sample('rhasspy_actor_message_seconds_sum', labels, stats['total_sec'])
+            sample('rhasspy_actor_message_seconds_count', labels, stats['count'])
+
+    family('rhasspy_actor_message_seconds_max', 'gauge',
+           'Longest time spent handling a single message')
+    for actor, actor_metrics in metrics.items():
+        for message, stats in actor_metrics['messages'].items():
+            sample('rhasspy_actor_message_seconds_max',
+                   { 'actor': actor, 'message': message }, stats['max_sec'])
+
+    family('rhasspy_actor_errors_total', 'counter',
+           'Number of messages whose handler raised an exception')
+    for actor, actor_metrics in metrics.items():
+        for message, count in actor_metrics['errors'].items():
+            sample('rhasspy_actor_errors_total',
+                   { 'actor': actor, 'message': message }, count)
+
+    family('rhasspy_actor_transitions_total', 'counter',
+           'Number of state transitions')
+    for actor, actor_metrics in metrics.items():
+        for transition in actor_metrics['transitions']:
+            sample('rhasspy_actor_transitions_total',
+                   { 'actor': actor,
+                     'from_state': transition['from_state'],
+                     'to_state': transition['to_state'] },
+                   transition['count'])
+
+    family('rhasspy_actor_state_seconds_total', 'counter',
+           'Total time spent in each state')
+    for actor, actor_metrics in metrics.items():
+        for state, seconds in actor_metrics['state_seconds'].items():
+            sample('rhasspy_actor_state_seconds_total',
+                   { 'actor': actor, 'state': state }, seconds)
+
+    family('rhasspy_actor_state', 'gauge',
+           'Current state of each actor')
+    for actor, actor_metrics in metrics.items():
+        sample('rhasspy_actor_state',
+               { 'actor': actor, 'state': actor_metrics['state'] }, 1)
+
+    return '\n'.join(lines) + '\n'
+
+def _escape(value:str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,216 @@
+import math
+from array import array
+from operator import itemgetter
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple, TextIO
+
+from .utils import SentenceStore
+
+# -----------------------------------------------------------------------------
+# ARPA language models estimated from training sentences.
+#
+# Uses interpolated, modified Kneser-Ney smoothing with the same discounts
+# and backoff weights as mitlm's estimate-ngram, so models are the same as
+# the ones it writes for the same sentences.
+# -----------------------------------------------------------------------------
+
+# n-gram (tuple of word ids) -> count
+NgramCounts = Dict[Tuple[int, ...], int]
+
+# Sentences are counted in chunks to bound memory
+CHUNK_SENTENCES = 65536
+
+def count_ngrams(sentences_by_intent:SentenceStore,
+                 weights:Dict[str, int],
+                 order:int=3) -> List[NgramCounts]:
+    '''Counts the n-grams of all training sentences. Each sentence counts as
+    many times as the weight of its intent (default 1). Returns counts of
+    each order (index 0 has unigrams). Ids len(words) and len(words) + 1 are
+    <s> and </s>.'''
+    store = sentences_by_intent
+    bos = len(store.words)
+    eos = bos + 1
+    padding = array('I', [bos] * (order - 1))
+
+    # Intents with the same weight are counted together
+    weight_ranges:Dict[int, List[Tuple[int, int]]] = defaultdict(list)
+    for intent_name, (start, end) in store.intents.items():
+        weight_ranges[weights.get(intent_name, 1)].append((start, end))
+
+    # Counts of all windows in <s> <s> a b </s> <s> <s> c </s> ...
+    # Windows that start in one sentence and end in the next are dropped.
+    windows:NgramCounts = {}
+    for weight, ranges in weight_ranges.items():
+        window_counts:Counter = Counter()
+        for start, end in ranges:
+            for chunk_start in range(start, end, CHUNK_SENTENCES):
+                tokens = array('I')
+                for index in range(chunk_start, min(end, chunk_start + CHUNK_SENTENCES)):
+                    tokens.extend(padding)
+                    tokens.extend(store.token_ids[store.token_offsets[index]:
+                                                  store.token_offsets[index + 1]])
+                    tokens.append(eos)
+
+                window_counts.update(zip(*(tokens[i:] for i in range(order))))
+
+        for window, count in window_counts.items():
+            if eos not in window[:-1]:
+                windows[window] = windows.get(window, 0) + (count * weight)
+
+    # Each shorter n-gram ends exactly one window, so its count is the sum
+    # of the counts of windows that end with it. N-grams with more than
+    # one <s> are only padding.
+    counts:List[NgramCounts] = [{} for _ in range(order)]
+    for n in range(order, 0, -1):
+        if n < order:
+            suffix_windows:NgramCounts = {}
+            for window, count in windows.items():
+                suffix = window[1:]
+                suffix_windows[suffix] = suffix_windows.get(suffix, 0) + count
+
+            windows = suffix_windows
+
+        if n > 1:
+            counts[n - 1] = { ngram: count for ngram, count in windows.items()
+                              if ngram[1] != bos }
+        else:
+            counts[0] = { ngram: count for ngram, count in windows.items()
+                          if ngram[0] != bos }
+
+    return counts
+
+def estimate_kneser_ney(counts:List[NgramCounts]) -> Tuple[List[Dict[Tuple[int, ...], float]],
+                                                          List[Dict[Tuple[int, ...], float]]]:
+    '''Estimates interpolated probabilities and backoff weights from n-gram
+    counts (see count_ngrams). Returns probabilities and backoff weights of
+    each order. Backoff weights are missing for n-grams with no extensions.'''
+    order = len(counts)
+    probs:List[Dict[Tuple[int, ...], float]] = []
+    bows:List[Dict[Tuple[int, ...], float]] = [{} for _ in range(order)]
+
+    for n in range(1, order + 1):
+        if n < order:
+            # Number of different words before each n-gram, or its count if
+            # it has no left context (starts with <s>).
+            left_counts = Counter(map(itemgetter(slice(1, None)), counts[n]))
+            eff_counts = { ngram: left_counts.get(ngram, count)
+                           for ngram, count in counts[n - 1].items() }
+        else:
+            eff_counts = counts[n - 1]
+
+        # Discounts from counts of counts
+        count_counts = Counter(eff_counts.values())
+        num_counts = [count_counts[count] for count in range(5)]
+
+        if (num_counts[1] == 0) and (num_counts[2] == 0):
+            y = 1.0
+        else:
+            y = num_counts[1] / (num_counts[1] + 2 * num_counts[2])
+
+        discounts = [0.0]
+        for i in range(1, 4):
+            if num_counts[i] == 0:
+                discount = float(i)
+            else:
+                discount = i - (i + 1) * y * num_counts[i + 1] / num_counts[i]
+
+            discounts.append(min(max(discount, 0.0), float(i)))
+
+        # Totals of each history
+        hist_counts:Dict[Tuple[int, ...], int] = {}
+        hist_discounts:Dict[Tuple[int, ...], float] = {}
+        for ngram, count in eff_counts.items():
+            hist = ngram[:-1]
+            hist_counts[hist] = hist_counts.get(hist, 0) + count
+            hist_discounts[hist] = hist_discounts.get(hist, 0.0) + discounts[min(count, 3)]
+
+        inv_hist_counts = { hist: 1.0 / count for hist, count in hist_counts.items() }
+        hist_bows = { hist: hist_discounts[hist] * inv_count
+                      for hist, inv_count in inv_hist_counts.items() }
+
+        if n > 1:
+            bows[n - 2] = hist_bows
+            lower_probs = probs[n - 2]
+        else:
+            uniform_prob = 1.0 / len(eff_counts)
+
+        order_probs:Dict[Tuple[int, ...], float] = {}
+        for ngram, count in eff_counts.items():
+            hist = ngram[:-1]
+            lower_prob = lower_probs[ngram[1:]] if n > 1 else uniform_prob
+            order_probs[ngram] = ((count - discounts[min(count, 3)]) * inv_hist_counts[hist]) \
+                + (lower_prob * hist_bows[hist])
+
+        probs.append(order_probs)
+
+    return probs, bows
+
+def write_arpa(arpa_file:TextIO,
+               words:List[str],
+               probs:List[Dict[Tuple[int, ...], float]],
+               bows:List[Dict[Tuple[int, ...], float]]) -> None:
+    '''Writes an ARPA language model (see estimate_kneser_ney), with n-grams
+    in the same order as mitlm.'''
+    bos = len(words)
+    eos = bos + 1
+    words = words + ['<s>', '</s>']
+
+    # Words are sorted after <s> and </s>, which share the first position
+    ranks = [0] * len(words)
+    for rank, word_id in enumerate(sorted(range(bos), key=lambda i: words[i]), start=1):
+        ranks[word_id] = rank
+
+    def sort_key(ngram:Tuple[int, ...]) -> Tuple[int, ...]:
+        return tuple(map(ranks.__getitem__, ngram))
+
+    def log_prob(prob:float) -> str:
+        return '%.6f' % math.log10(prob) if prob > 0 else '-99'
+
+    order = len(probs)
+
+    # <s> is a unigram with no probability
+    num_ngrams = [len(order_probs) for order_probs in probs]
+    num_ngrams[0] += 1
+
+    print('', file=arpa_file)
+    print('\\data\\', file=arpa_file)
+    for n, num in enumerate(num_ngrams, start=1):
+        print(f'ngram {n}={num}', file=arpa_file)
+
+    for n in range(1, order + 1):
+        print('', file=arpa_file)
+        print(f'\\{n}-grams:', file=arpa_file)
+
+        order_probs = probs[n - 1]
+        order_bows = bows[n - 1] if n < order else {}
+
+        ngrams = sorted(order_probs, key=sort_key)
+        if n == 1:
+            ngrams = [(eos,), (bos,)] + [ngram for ngram in ngrams if ngram != (eos,)]
+
+        lines = []
+        for ngram in ngrams:
+            text = ' '.join(map(words.__getitem__, ngram))
+            prob = '-99' if ngram == (bos,) else log_prob(order_probs[ngram])
+
+            bow = order_bows.get(ngram, 1.0)
+            if bow != 1.0:
+                lines.append(f'{prob}\t{text}\t{log_prob(bow)}\n')
+            else:
+                lines.append(f'{prob}\t{text}\n')
+
+        arpa_file.writelines(lines)
+
+    print('', file=arpa_file)
+    print('\\end\\', file=arpa_file)
+
+def write_language_model(sentences_by_intent:SentenceStore,
+                         weights:Dict[str, int],
+                         arpa_path:str,
+                         order:int=3) -> None:
+    '''Estimates an ARPA language model from training sentences (see count_ngrams).'''
+    counts = count_ngrams(sentences_by_intent, weights, order)
+    probs, bows = estimate_kneser_ney(counts)
+
+    with open(arpa_path, 'w') as arpa_file:
+        write_arpa(arpa_file, sentences_by_intent.words, probs, bows)
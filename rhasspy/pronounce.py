@@ -4,12 +4,13 @@ import re
 import logging
 import subprocess
 import tempfile
-from typing import Dict, Tuple, List, Optional, Any
+from typing import Dict, Tuple, List, Optional, Any, Mapping, Sequence
 
 from thespian.actors import ActorAddress
 
 from .actor import RhasspyActor
-from .utils import read_dict, load_phoneme_map
+from .utils import read_dict
+from . import shared
 from .profiles import Profile
 
 # -----------------------------------------------------------------------------
@@ -127,7 +128,7 @@ class PhonetisaurusPronounce(RhasspyActor):
         map_path = self.profile.read_path(
             self.profile.get('text_to_speech.espeak.phoneme_map'))
 
-        phoneme_map = load_phoneme_map(map_path)
+        phoneme_map = shared.phoneme_map(map_path)
 
         # Convert from Sphinx to espeak phonemes
         espeak_str = "[['%s]]" % ''.join(phoneme_map.get(p, p)
@@ -150,13 +151,15 @@ class PhonetisaurusPronounce(RhasspyActor):
         custom_path = self.profile.read_path(
             self.profile.get('speech_to_text.pocketsphinx.custom_words'))
 
-        word_dict: Dict[str, List[str]] = {}
-        for word_dict_path in [base_dictionary_path, custom_path]:
-            if os.path.exists(word_dict_path):
-                with open(word_dict_path, 'r') as dictionary_file:
-                    read_dict(dictionary_file, word_dict)
+        # Base dictionary is shared with other actors
+        base_dict = shared.base_dictionary(base_dictionary_path)
 
-        in_dictionary, pronunciations = self._lookup_word(word, word_dict, n)
+        custom_dict: Dict[str, List[str]] = {}
+        if os.path.exists(custom_path):
+            with open(custom_path, 'r') as dictionary_file:
+                read_dict(dictionary_file, custom_dict)
+
+        in_dictionary, pronunciations = self._lookup_word(word, [base_dict, custom_dict], n)
 
         # Get phonemes from eSpeak
         espeak_command = ['espeak', '-q', '-x']
@@ -176,7 +179,7 @@ class PhonetisaurusPronounce(RhasspyActor):
 
     def _lookup_word(self,
                      word: str,
-                     word_dict: Dict[str, List[str]],
+                     word_dicts: List[Mapping[str, Sequence[str]]],
                      n:int=5) -> Tuple[bool, List[str]]:
         '''Look up or guess word pronunciations.'''
 
@@ -189,7 +192,10 @@ class PhonetisaurusPronounce(RhasspyActor):
         else:
             word = word.lower()
 
-        pronounces = list(word_dict.get(word, []))
+        pronounces:List[str] = []
+        for word_dict in word_dicts:
+            pronounces.extend(word_dict.get(word, []))
+
         in_dictionary = (len(pronounces) > 0)
         if not in_dictionary:
             # Guess pronunciation
@@ -0,0 +1,96 @@
+import os
+import gc
+import json
+import logging
+from typing import Dict, Tuple, Any, Callable, Optional, Mapping, List
+
+from .profiles import Profile
+from .utils import read_dict, load_phoneme_map
+
+# -----------------------------------------------------------------------------
+# Large read-only data shared by several actors.
+#
+# The dialogue manager loads everything here before it creates any actors.
+# Actor processes are forked from it, so they share the same memory pages
+# (copy-on-write) instead of each loading their own copy.
+# -----------------------------------------------------------------------------
+
+logger = logging.getLogger('shared')
+
+# (kind, path) -> (modification time, data)
+_cache:Dict[Tuple[str, str], Tuple[float, Any]] = {}
+
+def _load(kind:str, path:str, loader:Callable[[str], Any]) -> Optional[Any]:
+    '''Loads a file once per process. Reloads if the file was modified.'''
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    key = (kind, path)
+    cached = _cache.get(key, None)
+    if (cached is not None) and (cached[0] == mtime):
+        return cached[1]
+
+    logger.debug('Loading %s from %s', kind, path)
+    data = loader(path)
+    _cache[key] = (mtime, data)
+
+    return data
+
+# -----------------------------------------------------------------------------
+
+def base_dictionary(path:str) -> Mapping[str, Tuple[str, ...]]:
+    '''CMU dictionary (word -> pronunciations). Do not modify.'''
+    def loader(path:str) -> Dict[str, Tuple[str, ...]]:
+        with open(path, 'r') as dictionary_file:
+            word_dict = read_dict(dictionary_file)
+
+        return { word: tuple(pronounces) for word, pronounces in word_dict.items() }
+
+    return _load('base_dictionary', path, loader) or {}
+
+def phoneme_map(path:str) -> Mapping[str, str]:
+    '''Sphinx -> eSpeak phonemes. Do not modify.'''
+    return _load('phoneme_map', path, load_phoneme_map) or {}
+
+def intent_examples(path:str) -> Optional[Dict[str, Any]]:
+    '''Intent examples JSON for fuzzywuzzy. Do not modify.'''
+    def loader(path:str) -> Dict[str, Any]:
+        with open(path, 'r') as examples_file:
+            return json.load(examples_file)
+
+    return _load('intent_examples', path, loader)
+
+# -----------------------------------------------------------------------------
+
+def preload(profile:Profile) -> List[str]:
+    '''Loads shared data for a profile before actors are forked.
+    Returns the paths that were loaded.'''
+    base_dictionary_path = profile.read_path(
+        profile.get('speech_to_text.pocketsphinx.base_dictionary',
+                    'base_dictionary.txt'))
+
+    phoneme_map_path = profile.read_path(
+        profile.get('text_to_speech.espeak.phoneme_map', 'espeak_phonemes.txt'))
+
+    examples_path = profile.read_path(
+        profile.get('intent.fuzzywuzzy.examples_json', 'intent_examples.json'))
+
+    loaded = []
+    if base_dictionary(base_dictionary_path):
+        loaded.append(base_dictionary_path)
+
+    if phoneme_map(phoneme_map_path):
+        loaded.append(phoneme_map_path)
+
+    if intent_examples(examples_path):
+        loaded.append(examples_path)
+
+    if hasattr(gc, 'freeze'):
+        # Keep the garbage collector from touching (and copying) these pages
+        # in the child processes (Python 3.7+).
+        gc.collect()
+        gc.freeze()
+
+    return loaded
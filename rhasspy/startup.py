@@ -0,0 +1,131 @@
+import sys
+import time
+import importlib.abc
+from typing import Dict, List, Any, Optional, Tuple
+
+# -----------------------------------------------------------------------------
+# Startup profiler (--profile-startup)
+#
+# Must not import anything from rhasspy, since it's installed before the rest
+# of the package is imported.
+# -----------------------------------------------------------------------------
+
+class StartupProfiler:
+    '''Times module imports and startup steps.'''
+    def __init__(self) -> None:
+        self.start_time = time.perf_counter()
+
+        # module name -> seconds (excluding nested imports)
+        self.import_times:Dict[str, float] = {}
+
+        # Modules being imported right now: [name, start time, nested time]
+        self._stack:List[List[Any]] = []
+
+        # (step name, seconds since start)
+        self.steps:List[Tuple[str, float]] = []
+
+        self._finder = _ImportTimer(self)
+
+    def install(self) -> None:
+        sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self) -> None:
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+
+    def step(self, name:str) -> None:
+        '''Records the time a startup step finished.'''
+        self.steps.append((name, time.perf_counter() - self.start_time))
+
+    # -------------------------------------------------------------------------
+
+    def begin_import(self, name:str) -> None:
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def end_import(self) -> None:
+        name, start_time, nested_sec = self._stack.pop()
+        total_sec = time.perf_counter() - start_time
+        self.import_times[name] = total_sec - nested_sec
+
+        if len(self._stack) > 0:
+            self._stack[-1][2] += total_sec
+
+    # -------------------------------------------------------------------------
+
+    def report(self,
+               actor_times:Optional[Dict[str, float]]=None,
+               top:int=20) -> str:
+        lines = []
+        total_import_sec = sum(self.import_times.values())
+        lines.append('Imports: %d module(s) in %0.3f second(s)' %
+                     (len(self.import_times), total_import_sec))
+
+        # Slowest modules
+        for name, seconds in sorted(self.import_times.items(),
+                                    key=lambda kv: kv[1], reverse=True)[:top]:
+            lines.append('  %8.3f  %s' % (seconds, name))
+
+        # Slowest top-level packages (all submodules together)
+        packages:Dict[str, float] = {}
+        for name, seconds in self.import_times.items():
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0) + seconds
+
+        lines.append('Imports by package:')
+        for name, seconds in sorted(packages.items(),
+                                    key=lambda kv: kv[1], reverse=True)[:top]:
+            lines.append('  %8.3f  %s' % (seconds, name))
+
+        if actor_times:
+            lines.append('Actor configure times:')
+            for name, seconds in sorted(actor_times.items(),
+                                        key=lambda kv: kv[1], reverse=True):
+                lines.append('  %8.3f  %s' % (seconds, name))
+
+        if len(self.steps) > 0:
+            lines.append('Startup steps (seconds since start):')
+            for name, seconds in self.steps:
+                lines.append('  %8.3f  %s' % (seconds, name))
+
+        return '\n'.join(lines)
+
+# -----------------------------------------------------------------------------
+
+class _ImportTimer(importlib.abc.MetaPathFinder):
+    '''Wraps the loader of every newly imported module to time it.'''
+    def __init__(self, profiler:StartupProfiler) -> None:
+        self.profiler = profiler
+
+    def find_spec(self, fullname:str, path:Any, target:Any=None) -> Any:
+        # Ask the real finders
+        for finder in sys.meta_path:
+            if (finder is self) or not hasattr(finder, 'find_spec'):
+                continue
+
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if (spec.loader is not None) and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader, self.profiler)
+
+                return spec
+
+        return None
+
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader:Any, profiler:StartupProfiler) -> None:
+        self.loader = loader
+        self.profiler = profiler
+
+    def create_module(self, spec:Any) -> Any:
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module:Any) -> None:
+        self.profiler.begin_import(module.__name__)
+        try:
+            self.loader.exec_module(module)
+        finally:
+            self.profiler.end_import()
+
+    def __getattr__(self, name:str) -> Any:
+        # get_data, get_resource_reader, is_package, etc.
+        return getattr(self.loader, name)
@@ -0,0 +1,170 @@
+import json
+from typing import Any, Optional, List
+
+from thespian.actors import ActorAddress, ActorExitRequest
+
+from .actor import RhasspyActor, ConfigureEvent, Configured
+from .audio_recorder import AudioData, StartStreaming, StopStreaming
+from .command_listener import ListenForCommand, VoiceCommand
+from .stt import (TranscribeWav, WavTranscription, StartTranscribing,
+                  StopTranscribing, PartialTranscription, TranscribingFailed)
+from .intent import RecognizeIntent, IntentRecognized
+from .intent_handler import HandleIntent, IntentHandled
+from .mqtt import MqttPublish
+from .utils import buffer_to_wav
+
+# -----------------------------------------------------------------------------
+
+class StartAudioStream:
+    def __init__(self,
+                 receiver:Optional[ActorAddress]=None,
+                 handle:bool=True) -> None:
+        self.receiver = receiver
+        self.handle = handle
+
+class AudioStreamStarted:
+    def __init__(self, session: ActorAddress) -> None:
+        self.session = session
+
+class EndAudioStream:
+    pass
+
+# -----------------------------------------------------------------------------
+
+class StreamingSession(RhasspyActor):
+    '''Runs a single stream of raw audio (16-bit 16Khz mono) through voice
+    activity detection, speech to text, and intent recognition.'''
+    def __init__(self) -> None:
+        RhasspyActor.__init__(self)
+        self.audio:bytes = bytes()
+        self.pending:List[AudioData] = []
+        self.vad_streaming:bool = False
+        self.decoder_streaming:bool = False
+
+    def to_started(self, from_state:str) -> None:
+        self.receiver:ActorAddress = self.config['receiver']
+        self.handle:bool = self.config.get('handle', True)
+        self.decoder:ActorAddress = self.config['decoder']
+        self.recognizer:ActorAddress = self.config['recognizer']
+        self.handler:ActorAddress = self.config['handler']
+        self.mqtt:ActorAddress = self.config['mqtt']
+        self.site_id:str = self.profile.get('mqtt.site_id', 'default')
+
+        # Only pocketsphinx can decode incrementally. Other systems get the
+        # whole voice command at the end.
+        decoder_system = self.profile.get('speech_to_text.system', 'dummy')
+        if decoder_system == 'pocketsphinx':
+            self.send(self.decoder, StartTranscribing(self.myAddress, handle=self.handle))
+            self.decoder_streaming = True
+
+        # Private voice activity detector that gets its audio from us
+        from .command_listener import WebrtcvadCommandListener
+        self.command = self.createActor(WebrtcvadCommandListener)
+        self.send(self.command, ConfigureEvent(self.profile,
+                                               recorder=self.myAddress,
+                                               transitions=False))
+
+        self.transition('listening')
+
+    def in_listening(self, message: Any, sender: ActorAddress) -> None:
+        if isinstance(message, Configured):
+            # Voice activity detector is ready
+            self.send(self.command, ListenForCommand(self.myAddress, handle=self.handle))
+            self.send(self.receiver, AudioStreamStarted(self.myAddress))
+        elif isinstance(message, StartStreaming):
+            self.vad_streaming = True
+
+            # Catch up on audio that arrived early
+            for data in self.pending:
+                self.send(self.command, data)
+
+            self.pending = []
+        elif isinstance(message, StopStreaming):
+            self.vad_streaming = False
+        elif isinstance(message, AudioData):
+            self.audio += message.data
+
+            if self.decoder_streaming:
+                self.send(self.decoder, message)
+
+            if self.vad_streaming:
+                self.send(self.command, message)
+            else:
+                self.pending.append(message)
+        elif isinstance(message, PartialTranscription):
+            self.send(self.receiver, message)
+        elif isinstance(message, TranscribingFailed):
+            # Decode the whole voice command at the end instead
+            self._logger.warn('Streaming decoder failed: %s', message.reason)
+            self.decoder_streaming = False
+        elif isinstance(message, VoiceCommand):
+            # End of voice command (or timeout)
+            self.decode(message.data)
+        elif isinstance(message, EndAudioStream):
+            # Client stopped streaming before the end of the command
+            self.send(self.command, ActorExitRequest())
+            self.decode(self.audio)
+
+    def decode(self, data: bytes) -> None:
+        if self.decoder_streaming:
+            self.send(self.decoder, StopTranscribing())
+            self.decoder_streaming = False
+        else:
+            self.send(self.decoder,
+                      TranscribeWav(buffer_to_wav(data), self.myAddress,
+                                    handle=self.handle))
+
+        self.transition('decoding')
+
+    def in_decoding(self, message: Any, sender: ActorAddress) -> None:
+        if isinstance(message, PartialTranscription):
+            self.send(self.receiver, message)
+        elif isinstance(message, TranscribingFailed):
+            # Stream was over before the decoder failed to start it
+            self._logger.warn('Streaming decoder failed: %s', message.reason)
+            self.send(self.decoder,
+                      TranscribeWav(buffer_to_wav(self.audio), self.myAddress,
+                                    handle=self.handle))
+        elif isinstance(message, WavTranscription):
+            self.send(self.receiver, message)
+
+            # Send to MQTT
+            payload = json.dumps({
+                'siteId': self.site_id,
+                'text': message.text,
+                'likelihood': 1,
+                'seconds': 0
+            }).encode()
+
+            self.send(self.mqtt, MqttPublish('hermes/asr/textCaptured', payload))
+
+            # Pass to intent recognizer
+            self.send(self.recognizer,
+                      RecognizeIntent(message.text, self.myAddress, handle=self.handle))
+
+            self.transition('recognizing')
+
+    def in_recognizing(self, message: Any, sender: ActorAddress) -> None:
+        if isinstance(message, IntentRecognized):
+            self.send(self.receiver, message)
+            if self.handle:
+                # Forward to Home Assistant
+                self.send(self.handler, HandleIntent(message.intent, self.myAddress))
+
+                # Forward to MQTT (hermes)
+                self.send(self.mqtt, message)
+
+                self.transition('handling')
+            else:
+                self.send(self.myAddress, ActorExitRequest())
+
+    def in_handling(self, message: Any, sender: ActorAddress) -> None:
+        if isinstance(message, IntentHandled):
+            self.send(self.receiver, message)
+            self.send(self.myAddress, ActorExitRequest())
+
+    def to_stopped(self, from_state:str) -> None:
+        if self.decoder_streaming:
+            # Don't leave the decoder in the middle of an utterance
+            self.send(self.decoder, StopTranscribing())
+            self.decoder_streaming = False
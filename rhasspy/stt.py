@@ -6,12 +6,13 @@ import logging
 import tempfile
 import subprocess
 from urllib.parse import urljoin
-from typing import Any, Optional
+from typing import Any, Optional, List, Dict, Tuple, Callable
 
 from thespian.actors import ActorAddress
 
 from .actor import RhasspyActor
 from .profiles import Profile
+from .audio_recorder import AudioData
 from .utils import convert_wav
 
 # -----------------------------------------------------------------------------
@@ -20,16 +21,38 @@ class TranscribeWav:
     def __init__(self,
                  wav_data: bytes,
                  receiver:Optional[ActorAddress]=None,
-                 handle:bool=True) -> None:
+                 handle:bool=True,
+                 trace_id:Optional[str]=None) -> None:
         self.wav_data = wav_data
         self.receiver = receiver
         self.handle = handle
+        self.trace_id = trace_id
 
 class WavTranscription:
     def __init__(self, text: str, handle:bool=True) -> None:
         self.text = text
         self.handle = handle
 
+class StartTranscribing:
+    def __init__(self,
+                 receiver:Optional[ActorAddress]=None,
+                 handle:bool=True) -> None:
+        self.receiver = receiver
+        self.handle = handle
+
+class StopTranscribing:
+    pass
+
+class TranscribingFailed:
+    '''Sent instead of PartialTranscription/WavTranscription when a stream
+    can't be decoded incrementally.'''
+    def __init__(self, reason:str='') -> None:
+        self.reason = reason
+
+class PartialTranscription:
+    def __init__(self, text: str) -> None:
+        self.text = text
+
 # -----------------------------------------------------------------------------
 
 class DummyDecoder(RhasspyActor):
@@ -49,6 +72,11 @@ class PocketsphinxDecoder(RhasspyActor):
     def __init__(self) -> None:
         RhasspyActor.__init__(self)
         self.decoder = None
+        self.stream_owner:Optional[ActorAddress] = None
+        self.stream_receiver:Optional[ActorAddress] = None
+        self.stream_handle:bool = True
+        self.partial_text:str = ''
+        self.pending:List[Any] = []
 
     def to_started(self, from_state:str) -> None:
         self.preload = self.config.get('preload', False)
@@ -73,34 +101,105 @@ class PocketsphinxDecoder(RhasspyActor):
                 # Send empty transcription back
                 self.send(message.receiver or sender,
                           WavTranscription('', handle=message.handle))
+        elif isinstance(message, StartTranscribing):
+            # Audio and the end of the stream must come from the same sender
+            self.stream_owner = sender
+            self.stream_receiver = message.receiver or sender
+            self.stream_handle = message.handle
+            self.partial_text = ''
+            try:
+                self.load_decoder()
+                self.decoder.start_utt()
+                self.transition('streaming')
+            except Exception as e:
+                self._logger.exception('start transcribing')
+                self.stream_owner = None
+
+                # Receiver has to transcribe the whole stream another way
+                self.send(self.stream_receiver, TranscribingFailed(str(e)))
+
+    def in_streaming(self, message: Any, sender: ActorAddress) -> None:
+        if isinstance(message, (AudioData, StopTranscribing)) \
+           and (sender != self.stream_owner):
+            # Part of a different stream
+            self._logger.warn('Ignoring %s from %s (streaming for %s)',
+                              message.__class__.__name__, sender, self.stream_owner)
+        elif isinstance(message, AudioData):
+            # Decode incrementally and report partial results
+            self.decoder.process_raw(message.data, False, False)
+            text = self.get_hypothesis()
+            if text != self.partial_text:
+                self.partial_text = text
+                self.send(self.stream_receiver, PartialTranscription(text))
+        elif isinstance(message, StopTranscribing):
+            self.decoder.end_utt()
+            self.send(self.stream_receiver,
+                      WavTranscription(self.get_hypothesis(),
+                                       handle=self.stream_handle))
+
+            self.stream_owner = None
+            self.transition('loaded')
+
+            # Handle requests that came in during the stream. A queued
+            # stream starts a new utterance, and the rest wait for it.
+            pending = self.pending
+            self.pending = []
+            for pending_message, pending_sender in pending:
+                if self._state == 'loaded':
+                    self.in_loaded(pending_message, pending_sender)
+                else:
+                    self.pending.append((pending_message, pending_sender))
+        elif isinstance(message, (TranscribeWav, StartTranscribing)):
+            # Only one utterance at a time
+            self.pending.append((message, sender))
 
     # -------------------------------------------------------------------------
 
+    def get_models(self) -> Dict[str, Callable[[], None]]:
+        return { 'decoder': self.load_decoder }
+
     def load_decoder(self) -> None:
         if self.decoder is None:
-            # Load decoder
-            import pocketsphinx
-            ps_config = self.profile.get('speech_to_text.pocketsphinx')
-
-            # Load decoder settings
-            hmm_path = self.profile.read_path(ps_config['acoustic_model'])
-            dict_path = self.profile.read_path(ps_config['dictionary'])
-            lm_path = self.profile.read_path(ps_config['language_model'])
-
-            self._logger.info('Loading decoder with hmm=%s, dict=%s, lm=%s' % (hmm_path, dict_path, lm_path))
+            with self.span('decoder_load'):
+                if self.profile.get('speech_to_text.pocketsphinx.shared_decoder', False):
+                    # Same decoder as the wake listener (language model search)
+                    shared = SharedPocketsphinx.get(self.profile)
+                    self.decoder = shared.search(SharedPocketsphinx.LM_SEARCH)
+                    return
+
+                # Load decoder
+                import pocketsphinx
+                ps_config = self.profile.get('speech_to_text.pocketsphinx')
+
+                # Load decoder settings
+                hmm_path = self.profile.read_path(ps_config['acoustic_model'])
+                dict_path = self.profile.read_path(ps_config['dictionary'])
+
+                decoder_config = pocketsphinx.Decoder.default_config()
+                decoder_config.set_string('-hmm', hmm_path)
+                decoder_config.set_string('-dict', dict_path)
+
+                if ps_config.get('search', 'lm') == 'jsgf':
+                    # Grammar compiled from sentences.ini
+                    grammar_path = self.profile.read_path(ps_config['grammar'])
+                    self._logger.info('Loading decoder with hmm=%s, dict=%s, jsgf=%s' % (hmm_path, dict_path, grammar_path))
+                    decoder_config.set_string('-jsgf', grammar_path)
+
+                    # Noise fillers otherwise replace words of the grammar
+                    decoder_config.set_boolean('-fsgusefiller', False)
+                else:
+                    lm_path = self.profile.read_path(ps_config['language_model'])
+                    self._logger.info('Loading decoder with hmm=%s, dict=%s, lm=%s' % (hmm_path, dict_path, lm_path))
+                    decoder_config.set_string('-lm', lm_path)
 
-            decoder_config = pocketsphinx.Decoder.default_config()
-            decoder_config.set_string('-hmm', hmm_path)
-            decoder_config.set_string('-dict', dict_path)
-            decoder_config.set_string('-lm', lm_path)
-            decoder_config.set_string('-logfn', '/dev/null')
+                decoder_config.set_string('-logfn', '/dev/null')
 
-            mllr_path = self.profile.read_path(ps_config['mllr_matrix'])
-            if os.path.exists(mllr_path):
-                self._logger.debug('Using tuned MLLR matrix for acoustic model: %s' % mllr_path)
-                decoder_config.set_string('-mllr', mllr_path)
+                mllr_path = self.profile.read_path(ps_config['mllr_matrix'])
+                if os.path.exists(mllr_path):
+                    self._logger.debug('Using tuned MLLR matrix for acoustic model: %s' % mllr_path)
+                    decoder_config.set_string('-mllr', mllr_path)
 
-            self.decoder = pocketsphinx.Decoder(decoder_config)
+                self.decoder = pocketsphinx.Decoder(decoder_config)
 
     def transcribe_wav(self, wav_data: bytes) -> str:
         # Ensure 16-bit 16Khz mono
@@ -114,27 +213,169 @@ class PocketsphinxDecoder(RhasspyActor):
                 if (rate != 16000) or (width != 2) or (channels != 1):
                     self._logger.info('Need to convert to 16-bit 16Khz mono.')
                     # Use converted data
-                    audio_data = convert_wav(wav_data)
+                    with self.span('sox_convert'):
+                        audio_data = convert_wav(wav_data)
                 else:
                     # Use original data
                     audio_data = wav_file.readframes(wav_file.getnframes())
 
         # Process data as an entire utterance
         start_time = time.time()
-        self.decoder.start_utt()
-        self.decoder.process_raw(audio_data, False, True)
-        self.decoder.end_utt()
+        with self.span('decode'):
+            self.decoder.start_utt()
+            self.decoder.process_raw(audio_data, False, True)
+            self.decoder.end_utt()
+
         end_time = time.time()
 
         self._logger.debug('Decoded WAV in %s second(s)' % (end_time - start_time))
 
-        if self.decoder.hyp() is not None:
+        return self.get_hypothesis()
+
+    def get_hypothesis(self) -> str:
+        assert self.decoder is not None
+        hyp = self.decoder.hyp()
+        if hyp is not None:
             # Return best transcription
-            return self.decoder.hyp().hypstr
+            return hyp.hypstr
 
         # No transcription
         return ''
 
+# -----------------------------------------------------------------------------
+# Pocketsphinx decoder shared by wake listener and speech to text
+# -----------------------------------------------------------------------------
+
+class SharedPocketsphinx:
+    '''A single pocketsphinx decoder (one copy of the acoustic model) with a
+    keyphrase search for the wake word and a language model (or grammar)
+    search for speech to text. The wake listener and speech decoder must be in
+    the same process (see rhasspy.actor_groups) to actually share it.'''
+
+    WAKE_SEARCH = 'wake'
+    LM_SEARCH = 'lm'
+
+    # profile name -> (file signature, decoder)
+    _decoders:Dict[str, Tuple[Any, 'SharedPocketsphinx']] = {}
+
+    @classmethod
+    def get(cls, profile: Profile) -> 'SharedPocketsphinx':
+        '''Gets the decoder for a profile, loading it if needed (or if the
+        dictionary/language model changed after training).'''
+        ps_config = profile.get('speech_to_text.pocketsphinx')
+        paths = [profile.read_path(ps_config[key])
+                 for key in ['acoustic_model', 'dictionary', 'language_model', 'grammar']]
+
+        signature = [(path, os.path.getmtime(path)) for path in paths
+                     if os.path.exists(path)]
+
+        cached = cls._decoders.get(profile.name, None)
+        if (cached is not None) and (cached[0] == signature):
+            return cached[1]
+
+        shared = SharedPocketsphinx(profile)
+        cls._decoders[profile.name] = (signature, shared)
+
+        return shared
+
+    def __init__(self, profile: Profile) -> None:
+        import pocketsphinx
+        self._logger = logging.getLogger(self.__class__.__name__)
+        ps_config = profile.get('speech_to_text.pocketsphinx')
+
+        hmm_path = profile.read_path(ps_config['acoustic_model'])
+        dict_path = profile.read_path(ps_config['dictionary'])
+        self._logger.info('Loading shared decoder with hmm=%s, dict=%s' % (hmm_path, dict_path))
+
+        decoder_config = pocketsphinx.Decoder.default_config()
+        decoder_config.set_string('-hmm', hmm_path)
+        decoder_config.set_string('-dict', dict_path)
+        decoder_config.set_string('-logfn', '/dev/null')
+        decoder_config.set_float('-kws_threshold',
+                                 float(profile.get('wake.pocketsphinx.threshold', 1e-40)))
+
+        use_grammar = ps_config.get('search', 'lm') == 'jsgf'
+        if use_grammar:
+            # Noise fillers otherwise replace words of the grammar
+            decoder_config.set_boolean('-fsgusefiller', False)
+
+        mllr_path = profile.read_path(ps_config['mllr_matrix'])
+        if os.path.exists(mllr_path):
+            self._logger.debug('Using tuned MLLR matrix for acoustic model: %s' % mllr_path)
+            decoder_config.set_string('-mllr', mllr_path)
+
+        self.decoder = pocketsphinx.Decoder(decoder_config)
+
+        if use_grammar:
+            # Grammar compiled from sentences.ini
+            grammar_path = profile.read_path(ps_config['grammar'])
+            self._logger.debug('Using grammar search: %s' % grammar_path)
+            self.decoder.set_jsgf_file(SharedPocketsphinx.LM_SEARCH, grammar_path)
+        else:
+            lm_path = profile.read_path(ps_config['language_model'])
+            self._logger.debug('Using language model search: %s' % lm_path)
+            self.decoder.set_lm_file(SharedPocketsphinx.LM_SEARCH, lm_path)
+
+        keyphrase = profile.get('wake.pocketsphinx.keyphrase', '')
+        if len(keyphrase) > 0:
+            self.decoder.set_keyphrase(SharedPocketsphinx.WAKE_SEARCH, keyphrase)
+
+        self.current_search:Optional[str] = None
+
+        # Search that owns the current utterance (None if no utterance)
+        self.utterance:Optional['PocketsphinxSearch'] = None
+
+        # Search that ran the last utterance (for hyp)
+        self.last_utterance:Optional['PocketsphinxSearch'] = None
+
+    def search(self, name: str) -> 'PocketsphinxSearch':
+        return PocketsphinxSearch(self, name)
+
+    def start_utt(self, search: 'PocketsphinxSearch') -> None:
+        if self.utterance is not None:
+            # Interrupt other search (e.g., wake word while transcribing)
+            self._logger.debug('Interrupting %s search', self.utterance.name)
+            self.decoder.end_utt()
+
+        if self.current_search != search.name:
+            self.decoder.set_search(search.name)
+            self.current_search = search.name
+
+        self.decoder.start_utt()
+        self.utterance = search
+        self.last_utterance = search
+
+    def end_utt(self, search: 'PocketsphinxSearch') -> None:
+        if self.utterance is search:
+            self.decoder.end_utt()
+            self.utterance = None
+
+class PocketsphinxSearch:
+    '''Looks like a pocketsphinx.Decoder, but switches the shared decoder
+    to a named search before each utterance.'''
+    def __init__(self, shared: SharedPocketsphinx, name: str) -> None:
+        self.shared = shared
+        self.name = name
+
+    def start_utt(self) -> None:
+        self.shared.start_utt(self)
+
+    def process_raw(self, data: bytes, no_search: bool, full_utt: bool) -> None:
+        if self.shared.utterance is not self:
+            # Another search took over in the middle of our utterance
+            self.shared.start_utt(self)
+
+        self.shared.decoder.process_raw(data, no_search, full_utt)
+
+    def end_utt(self) -> None:
+        self.shared.end_utt(self)
+
+    def hyp(self) -> Any:
+        if self.shared.last_utterance is not self:
+            return None
+
+        return self.shared.decoder.hyp()
+
 # -----------------------------------------------------------------------------
 # HTTP based decoder on remote Rhasspy server
 # -----------------------------------------------------------------------------
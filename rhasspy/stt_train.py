@@ -5,36 +5,98 @@ import subprocess
 import logging
 import shutil
 import json
-from collections import defaultdict
-from typing import Dict, List, Any, Tuple, Set, Optional
+import time
+import concurrent.futures
+from datetime import timedelta
+from typing import Dict, List, Any, Tuple, Set, Optional, Union
 
-from thespian.actors import ActorAddress
+from thespian.actors import ActorAddress, WakeupMessage
 
 from .actor import RhasspyActor
 from .profiles import Profile
 from .pronounce import GetWordPronunciations, WordPronunciation
-from .utils import (read_dict, lcm, group_sentences_by_intent,
-                    sanitize_sentence, TrainingSentence)
+from . import shared
+from .train import SentenceCorpus, write_sentences_jsgf
+from .training import (TrainingProgress, TrainingCache, training_stage,
+                       content_hash, file_hash, tokenizer_settings, CORPUS_DIR,
+                       training_workers, submit_task)
+from .ngram import write_language_model
+from .utils import (read_dict, lcm, make_training_sentences, sanitize_sentence,
+                    SentenceStore)
+
+# -----------------------------------------------------------------------------
+
+def group_sentences(profile:Profile,
+                    corpus: SentenceCorpus,
+                    *sanitize_args) -> SentenceStore:
+    '''Like group_sentences_by_intent, but re-uses the training sentences of
+    intents whose sentences and tokenizer settings haven't changed.'''
+    cache = TrainingCache(profile, 'grouping')
+    settings = tokenizer_settings(profile)
+
+    sentences_by_intent = SentenceStore()
+    for intent_name in corpus.intent_names():
+        intent_key = content_hash(corpus.keys[intent_name], settings)
+        cached_sents = cache.get(intent_name, intent_key)
+        if cached_sents is None:
+            make_training_sentences(sentences_by_intent, intent_name,
+                                    corpus.sentence_spans(intent_name),
+                                    *sanitize_args)
+
+            if cache.enabled:
+                cache.put(intent_name, intent_key,
+                          [s.json() for s in sentences_by_intent[intent_name]])
+        else:
+            sentences_by_intent.add_intent(intent_name)
+            for sentence_dict in cached_sents:
+                sentences_by_intent.add_json(sentence_dict)
+
+    cache.save()
+
+    return sentences_by_intent
+
+def estimate_language_model(sentences_path:str,
+                            weights:Dict[str, int],
+                            lm_path:str,
+                            order:int) -> None:
+    '''Writes an ARPA language model for saved training sentences (see
+    save_sentences). Runs in the training worker pool.'''
+    write_language_model(SentenceStore.load(sentences_path),
+                         weights, lm_path, order)
+
+def save_sentences(profile:Profile, sentences_by_intent:SentenceStore) -> str:
+    '''Writes training sentences for the next stages (see SentenceStore.load).
+    Returns the path of the file.'''
+    sentences_path = profile.write_path(CORPUS_DIR, 'sentences_by_intent')
+    sentences_by_intent.save(sentences_path)
+
+    return sentences_path
 
 # -----------------------------------------------------------------------------
 
 class TrainSpeech:
     def __init__(self,
-                 tagged_sentences: Dict[str, List[str]],
+                 corpus: SentenceCorpus,
                  receiver:Optional[ActorAddress]=None) -> None:
-        self.tagged_sentences = tagged_sentences
+        self.corpus = corpus
         self.receiver = receiver
 
-class SpeechTrainingComplete:
+class SentencesGrouped:
+    '''Sent by speech trainers as soon as training sentences are in a file
+    (see SentenceStore.load), before the rest of speech training.'''
     def __init__(self,
-                 tagged_sentences: Dict[str, List[str]],
-                 sentences_by_intent: Dict[str, List[TrainingSentence]]) -> None:
-        self.tagged_sentences = tagged_sentences
-        self.sentences_by_intent = sentences_by_intent
+                 corpus: SentenceCorpus,
+                 sentences_path: str) -> None:
+        self.corpus = corpus
+        self.sentences_path = sentences_path
 
-class SpeechTrainingFailed:
+class SpeechTrainingComplete:
     pass
 
+class SpeechTrainingFailed:
+    def __init__(self, reason:str='') -> None:
+        self.reason = reason
+
 # -----------------------------------------------------------------------------
 
 class DummySpeechTrainer(RhasspyActor):
@@ -48,17 +110,23 @@ class DummySpeechTrainer(RhasspyActor):
 
     def in_started(self, message: Any, sender: ActorAddress) -> None:
         if isinstance(message, TrainSpeech):
-            self.send(message.receiver or sender,
-                      SpeechTrainingComplete(message.tagged_sentences,
-                                             self.train(message.tagged_sentences)))
+            receiver = message.receiver or sender
+            with training_stage(self, receiver, 'grouping') as progress:
+                sentences_by_intent = self.train(message.corpus)
+                sentences_path = save_sentences(self.profile, sentences_by_intent)
+                progress.items = sentences_by_intent.num_sentences
+
+            self.send(receiver, SentencesGrouped(message.corpus, sentences_path))
+            self.send(receiver, SpeechTrainingComplete())
 
     # -------------------------------------------------------------------------
 
-    def train(self, tagged_sentences: Dict[str, List[str]]) -> Dict[str, List[TrainingSentence]]:
-        return group_sentences_by_intent(tagged_sentences,
-                                         self.sentence_casing,
-                                         self.replace_patterns,
-                                         self.split_pattern)
+    def train(self, corpus: SentenceCorpus) -> SentenceStore:
+        return group_sentences(self.profile,
+                               corpus,
+                               self.sentence_casing,
+                               self.replace_patterns,
+                               self.split_pattern)
 
 # -----------------------------------------------------------------------------
 # Speech system trainer for Pocketsphinx.
@@ -67,12 +135,18 @@ class DummySpeechTrainer(RhasspyActor):
 
 class PocketsphinxSpeechTrainer(RhasspyActor):
     '''Trains an ARPA language model using opengrm.'''
+
+    # Seconds between checks of the language model process
+    POLL_SEC = 0.1
+
     def to_started(self, from_state:str) -> None:
         self.word_pronouncer:ActorAddress = self.config['word_pronouncer']
-        self.tagged_sentences:Dict[str, List[str]] = {}
+        self.corpus:Optional[SentenceCorpus] = None
         self.unknown_words:Dict[str, Optional[WordPronunciation]] = {}
         self.waiting_words:List[str] = []
         self.receiver:Optional[ActorAddress] = None
+        self.lm_task:Optional[Union[subprocess.Popen, concurrent.futures.Future]] = None
+        self.grammar_words:Set[str] = set()
         self.sentence_casing = self.profile.get('training.sentences.case', None)
         self.dictionary_upper:bool = \
             self.profile.get('speech_to_text.dictionary_upper', False)
@@ -91,21 +165,50 @@ class PocketsphinxSpeechTrainer(RhasspyActor):
     def in_started(self, message: Any, sender: ActorAddress) -> None:
         if isinstance(message, TrainSpeech):
             self.receiver = message.receiver or sender
-            self.tagged_sentences = message.tagged_sentences
-            self.transition('writing_dictionary')
+            self.corpus = message.corpus
+            try:
+                self.transition('writing_dictionary')
+            except Exception as e:
+                self.training_failed(e)
 
     def to_writing_dictionary(self, from_state:str) -> None:
-        self.sentences_by_intent = group_sentences_by_intent(
-            self.tagged_sentences,
-            self.sentence_casing,
-            self.replace_patterns,
-            self.split_pattern)
-
-        self.unknown_words = {
-            word: None
-            for word in self.write_dictionary(self.tagged_sentences,
-                                              self.sentences_by_intent)
-        }
+        with training_stage(self, self.receiver, 'grouping') as progress:
+            self.sentences_by_intent = group_sentences(
+                self.profile,
+                self.corpus,
+                self.sentence_casing,
+                self.replace_patterns,
+                self.split_pattern)
+
+            self.sentences_path = save_sentences(self.profile, self.sentences_by_intent)
+            progress.items = self.sentences_by_intent.num_sentences
+
+        # Intent training only needs the training sentences
+        self.send(self.receiver, SentencesGrouped(self.corpus, self.sentences_path))
+
+        # Words of the grammar also go into the dictionary
+        self.grammar_words = set()
+        if self.profile.get('speech_to_text.pocketsphinx.search', 'lm') == 'jsgf':
+            with training_stage(self, self.receiver, 'grammar') as progress:
+                grammar_path = self.profile.write_path(
+                    self.profile.get('speech_to_text.pocketsphinx.grammar',
+                                     'grammar.jsgf'))
+
+                self.grammar_words = write_sentences_jsgf(self.profile,
+                                                          grammar_path,
+                                                          self.sentence_casing,
+                                                          self.replace_patterns,
+                                                          self.split_pattern)
+
+                progress.items = len(self.grammar_words)
+
+        with training_stage(self, self.receiver, 'dictionary') as progress:
+            self.unknown_words = {
+                word: None
+                for word in self.write_dictionary(self.sentences_by_intent)
+            }
+
+            progress.items = self.words_written
 
         has_unknown_words = len(self.unknown_words) > 0
 
@@ -119,96 +222,189 @@ class PocketsphinxSpeechTrainer(RhasspyActor):
             if os.path.exists(unknown_path):
                 os.unlink(unknown_path)
 
-        # Proceed or guess pronunciations
         if self.guess_unknown and has_unknown_words:
+            # Pronunciations are guessed by the word pronouncer while
+            # sentences and the language model are written here.
             self.transition('unknown_words')
         else:
-            self.transition('writing_sentences')
+            self.write_sentences_and_model()
+            self.transition('writing_language_model')
 
     def to_unknown_words(self, from_state:str) -> None:
-        self.waiting_words = list(self.unknown_words.keys())
+        self.g2p_start_time = time.perf_counter()
+        self.send(self.receiver,
+                  TrainingProgress('g2p', total=len(self.unknown_words)))
+
+        # Re-use guessed pronunciations
+        self.g2p_cache = TrainingCache(self.profile, 'g2p')
+        g2p_settings = [
+            file_hash(self.profile.read_path(self.profile.get('speech_to_text.g2p_model'))),
+            self.profile.get('speech_to_text.g2p_upper', False)
+        ]
+
+        self.word_keys = { word: content_hash(word, g2p_settings)
+                           for word in self.unknown_words }
+
+        self.waiting_words = []
         for word in self.unknown_words:
+            cached = self.g2p_cache.get(word, self.word_keys[word])
+            if cached is None:
+                self.waiting_words.append(word)
+            else:
+                self.unknown_words[word] = WordPronunciation(
+                    word, cached['pronunciations'], False, cached['phonemes'])
+
+        if len(self.waiting_words) == 0:
+            if not self.fail_on_unknown:
+                self.write_sentences_and_model()
+
+            self.unknown_words_guessed()
+            return
+
+        for word in self.waiting_words:
             self.send(self.word_pronouncer,
                       GetWordPronunciations(word, n=1))
 
+        # Training fails anyway when unknown words aren't allowed
+        if not self.fail_on_unknown:
+            self.write_sentences_and_model()
+
     def in_unknown_words(self, message: Any, sender: ActorAddress) -> None:
         if isinstance(message, WordPronunciation):
-            self.waiting_words.remove(message.word)
-            self.unknown_words[message.word] = message
-            if len(self.waiting_words) == 0:
-                self.write_unknown_words(self.unknown_words)
-
-                if self.fail_on_unknown:
-                    # Fail when unknown words are present
-                    self.send(self.receiver, SpeechTrainingFailed())
-                    self.transition('started')
-                else:
-                    # Add guessed pronunciations to main dictionary
-                    unknown_path = self.profile.read_path(
-                        self.profile.get('speech_to_text.pocketsphinx.unknown_words'))
+            try:
+                self.word_guessed(message)
+            except Exception as e:
+                self.training_failed(e)
+
+    def word_guessed(self, message: WordPronunciation) -> None:
+        '''Records a guessed pronunciation. Goes on with training once all
+        unknown words are guessed.'''
+        self.waiting_words.remove(message.word)
+        self.unknown_words[message.word] = message
+        self.g2p_cache.put(message.word, self.word_keys[message.word],
+                           { 'pronunciations': message.pronunciations,
+                             'phonemes': message.phonemes })
+
+        if len(self.waiting_words) == 0:
+            self.unknown_words_guessed()
+        else:
+            num_guessed = len(self.unknown_words) - len(self.waiting_words)
+            self.send(self.receiver,
+                      TrainingProgress('g2p', num_guessed, len(self.unknown_words),
+                                       seconds=time.perf_counter() - self.g2p_start_time))
+
+    def unknown_words_guessed(self) -> None:
+        self.g2p_cache.save()
+        self.send(self.receiver,
+                  TrainingProgress('g2p', len(self.unknown_words), len(self.unknown_words),
+                                   seconds=time.perf_counter() - self.g2p_start_time,
+                                   finished=True))
+
+        self.write_unknown_words(self.unknown_words)
+
+        if self.fail_on_unknown:
+            # Fail when unknown words are present
+            self.send(self.receiver,
+                      SpeechTrainingFailed('Unknown words: %s' %
+                                           ', '.join(sorted(self.unknown_words))))
+            self.transition('started')
+        else:
+            # Add guessed pronunciations to main dictionary
+            unknown_path = self.profile.read_path(
+                self.profile.get('speech_to_text.pocketsphinx.unknown_words'))
+
+            if os.path.exists(unknown_path):
+                dictionary_path = self.profile.write_path(
+                    self.profile.get('speech_to_text.pocketsphinx.dictionary',
+                                    'dictionary.txt'))
 
-                    if os.path.exists(unknown_path):
-                        dictionary_path = self.profile.write_path(
-                            self.profile.get('speech_to_text.pocketsphinx.dictionary',
-                                            'dictionary.txt'))
+                with open(dictionary_path, 'a') as dictionary_file:
+                    with open(unknown_path, 'r') as unknown_file:
+                        self._logger.debug('Adding unknown word pronunciations to user dictionary')
+                        dictionary_file.write(unknown_file.read())
 
-                        with open(dictionary_path, 'a') as dictionary_file:
-                            with open(unknown_path, 'r') as unknown_file:
-                                self._logger.debug('Adding unknown word pronunciations to user dictionary')
-                                dictionary_file.write(unknown_file.read())
+            # Proceed with training
+            self.transition('writing_language_model')
 
-                    # Proceed with training
-                    self.transition('writing_sentences')
+    def write_sentences_and_model(self) -> None:
+        '''Writes the sentence file and starts building the language model
+        in the background (see to_writing_language_model).'''
+        with training_stage(self, self.receiver, 'sentence_file') as progress:
+            progress.items = self.write_sentences(self.sentences_by_intent)
 
-    def to_writing_sentences(self, from_state:str) -> None:
-        self.write_sentences(self.sentences_by_intent)
-        self.transition('writing_language_model')
+        self.lm_start_time = time.perf_counter()
+        self.send(self.receiver, TrainingProgress('language_model'))
+        self.lm_task = self.start_language_model()
 
     def to_writing_language_model(self, from_state:str) -> None:
-        self.write_language_model()
+        self.check_language_model()
+
+    def in_writing_language_model(self, message: Any, sender: ActorAddress) -> None:
+        if isinstance(message, WakeupMessage):
+            try:
+                self.check_language_model()
+            except Exception as e:
+                self.training_failed(e)
+
+    def check_language_model(self) -> None:
+        '''Finishes training if the language model is done. Otherwise,
+        checks again later. The actor keeps handling messages in between,
+        so messages it sent (e.g., SentencesGrouped) are delivered.'''
+        if isinstance(self.lm_task, subprocess.Popen):
+            running = self.lm_task.poll() is None
+        else:
+            running = (self.lm_task is not None) and not self.lm_task.done()
+
+        if running:
+            self.wakeupAfter(timedelta(seconds=PocketsphinxSpeechTrainer.POLL_SEC))
+            return
+
+        self.finish_language_model(self.lm_task)
+        self.lm_task = None
+        self.send(self.receiver,
+                  TrainingProgress('language_model',
+                                   seconds=time.perf_counter() - self.lm_start_time,
+                                   finished=True))
+
+        self.send(self.receiver, SpeechTrainingComplete())
+        self.transition('started')
+
+    def training_failed(self, error: Exception) -> None:
+        '''Reports an error from any stage and waits for the next run.'''
+        self._logger.exception('train')
+
+        if isinstance(self.lm_task, subprocess.Popen):
+            self.lm_task.kill()
+            self.lm_task.wait()
+        elif self.lm_task is not None:
+            self.lm_task.cancel()
+
+        self.lm_task = None
         self.send(self.receiver,
-                  SpeechTrainingComplete(self.tagged_sentences,
-                                         self.sentences_by_intent))
+                  SpeechTrainingFailed(f'Speech training failed: {error}'))
         self.transition('started')
 
     # -------------------------------------------------------------------------
 
-    def write_dictionary(self, tagged_sentences: Dict[str, List[str]],
-                         sentences_by_intent: Dict[str, List[TrainingSentence]]) -> Set[str]:
+    def write_dictionary(self, sentences_by_intent: SentenceStore) -> Set[str]:
         '''Writes all required words to a CMU dictionary.
         Unknown words have their pronunciations guessed and written to a separate dictionary.
         Fails if any unknown words are found.'''
 
         words_needed: Set[str] = set()
 
-        # Extract entities from tagged sentences
-        for intent_name, intent_sents in sentences_by_intent.items():
-            for intent_sent in intent_sents:
-                # Collect all used words
-                for word in intent_sent.tokens:
-                    # Dictionary uses upper-case letters
-                    if self.dictionary_upper:
-                        word = word.upper()
-                    else:
-                        word = word.lower()
-
-                    words_needed.add(word)
-
-        # Load base and custom dictionaries
-        base_dictionary_path = self.profile.read_path(
-            self.profile.get('speech_to_text.pocketsphinx.base_dictionary',
-                             'base_dictionary.txt'))
+        # Collect all used words (interned by the sentence store)
+        for word in sentences_by_intent.words:
+            # Dictionary uses upper-case letters
+            if self.dictionary_upper:
+                word = word.upper()
+            else:
+                word = word.lower()
 
-        custom_path = self.profile.read_path(
-            self.profile.get('speech_to_text.pocketsphinx.custom_words',
-                             'custom_words.txt'))
+            words_needed.add(word)
 
-        word_dict: Dict[str, List[str]] = {}
-        for word_dict_path in [base_dictionary_path, custom_path]:
-            if os.path.exists(word_dict_path):
-                self._logger.debug(f'Loading dictionary from {word_dict_path}')
-                with open(word_dict_path, 'r') as dictionary_file:
-                    read_dict(dictionary_file, word_dict)
+        # Grammar words already have the case of the dictionary
+        words_needed.update(self.grammar_words)
 
         # Add words from wake word if using pocketsphinx
         if self.profile.get('wake.system') == 'pocketsphinx':
@@ -229,18 +425,52 @@ class PocketsphinxSpeechTrainer(RhasspyActor):
 
                     words_needed.add(word)
 
-        # Write out dictionary with only the necessary words (speeds up loading)
+        # Load base and custom dictionaries
+        base_dictionary_path = self.profile.read_path(
+            self.profile.get('speech_to_text.pocketsphinx.base_dictionary',
+                             'base_dictionary.txt'))
+
+        custom_path = self.profile.read_path(
+            self.profile.get('speech_to_text.pocketsphinx.custom_words',
+                             'custom_words.txt'))
+
         dictionary_path = self.profile.write_path(
             self.profile.get('speech_to_text.pocketsphinx.dictionary',
                              'dictionary.txt'))
 
+        # Re-use dictionary if the same words are needed from the same dictionaries
+        cache = TrainingCache(self.profile, 'dictionary')
+        dictionary_key = content_hash(sorted(words_needed),
+                                      file_hash(base_dictionary_path),
+                                      file_hash(custom_path))
+
+        cached = cache.get_file('dictionary', dictionary_key, dictionary_path)
+        if cached is not None:
+            cache.save()
+            self.words_written = cached['words_written']
+            self._logger.debug('Re-used dictionary with %s word(s)' % self.words_written)
+            return set(cached['unknown_words'])
+
+        # Base dictionary is shared with other actors
+        base_dict = shared.base_dictionary(base_dictionary_path)
+
+        custom_dict: Dict[str, List[str]] = {}
+        if os.path.exists(custom_path):
+            self._logger.debug(f'Loading dictionary from {custom_path}')
+            with open(custom_path, 'r') as dictionary_file:
+                read_dict(dictionary_file, custom_dict)
+
+        # Write out dictionary with only the necessary words (speeds up loading)
         words_written = 0
+        known_words: Set[str] = set()
         with open(dictionary_path, 'w') as dictionary_file:
             for word in sorted(words_needed):
-                if not word in word_dict:
+                pronounces = list(base_dict.get(word, [])) + custom_dict.get(word, [])
+                if len(pronounces) == 0:
                     continue
 
-                for i, pronounce in enumerate(word_dict[word]):
+                known_words.add(word)
+                for i, pronounce in enumerate(pronounces):
                     if i < 1:
                         print(word, pronounce, file=dictionary_file)
                     else:
@@ -249,9 +479,16 @@ class PocketsphinxSpeechTrainer(RhasspyActor):
                 words_written += 1
 
         self._logger.debug('Wrote %s word(s) to %s' % (words_written, dictionary_path))
+        self.words_written = words_written
 
         # Check for unknown words
-        return words_needed - word_dict.keys()
+        unknown_words = words_needed - known_words
+        cache.put_file('dictionary', dictionary_key, dictionary_path,
+                       { 'words_written': words_written,
+                         'unknown_words': sorted(unknown_words) })
+        cache.save()
+
+        return unknown_words
 
     # -------------------------------------------------------------------------
 
@@ -275,11 +512,9 @@ class PocketsphinxSpeechTrainer(RhasspyActor):
 
     # -------------------------------------------------------------------------
 
-    def write_sentences(self, sentences_by_intent: Dict[str, List[TrainingSentence]]) -> None:
-        '''Writes all raw sentences to a text file.
-        Optionally balances (repeats) sentences so all intents have the same number.'''
-
-        # Repeat sentences so that all intents will contain the same number
+    def intent_weights(self, sentences_by_intent: SentenceStore) -> Dict[str, int]:
+        '''Number of times each sentence of an intent is repeated, so that
+        all intents have the same number (if balance_by_intent is set).'''
         balance_sentences = self.profile.get('training.sentences.balance_by_intent', True)
         if balance_sentences:
             # Use least common multiple
@@ -288,6 +523,17 @@ class PocketsphinxSpeechTrainer(RhasspyActor):
         else:
             lcm_sentences = 0  # no repeats
 
+        return { intent_name: max(1, lcm_sentences // max(1, len(intent_sents)))
+                 for intent_name, intent_sents in sentences_by_intent.items() }
+
+    def write_sentences(self, sentences_by_intent: SentenceStore) -> int:
+        '''Writes all raw sentences to a text file.
+        Optionally balances (repeats) sentences so all intents have the same number.
+        Returns the number of sentences written.'''
+
+        # Repeat sentences so that all intents will contain the same number
+        weights = self.intent_weights(sentences_by_intent)
+
         # Write sentences to text file
         sentences_text_path = self.profile.write_path(
             self.profile.get('speech_to_text.sentences_text'))
@@ -301,12 +547,13 @@ class PocketsphinxSpeechTrainer(RhasspyActor):
                 # Cache sentences and weights
                 sentences_to_write = []
                 for intent_name, intent_sents in sentences_by_intent.items():
-                    num_repeats = max(1, lcm_sentences // len(intent_sents))
-                    for intent_sent in intent_sents:
-                        sentences_to_write.append((num_repeats, intent_sent.sentence))
+                    num_repeats = weights[intent_name]
+                    for sentence in intent_sents.texts():
+                        sentences_to_write.append((num_repeats, sentence))
 
                 # Do sort
                 sentences_to_write = sorted(sentences_to_write, key=lambda x: x[1])
+                num_sentences = len(sentences_to_write)
                 for num_repeats, sentence in sentences_to_write:
                     if write_weights:
                         print(num_repeats, sentence, file=sentences_text_file)
@@ -314,37 +561,82 @@ class PocketsphinxSpeechTrainer(RhasspyActor):
                         print(sentence, file=sentences_text_file)
             else:
                 for intent_name, intent_sents in sentences_by_intent.items():
-                    for intent_sent in intent_sents:
+                    for sentence in intent_sents.texts():
                         if write_weights:
-                            num_repeats = max(1, lcm_sentences // len(intent_sents))
-                            print(num_repeats, intent_sent.sentence, file=sentences_text_file)
+                            num_repeats = weights[intent_name]
+                            print(num_repeats, sentence, file=sentences_text_file)
                         else:
-                            print(intent_sent.sentence, file=sentences_text_file)
+                            print(sentence, file=sentences_text_file)
 
                         num_sentences = num_sentences + 1
 
         self._logger.debug('Wrote %s sentence(s) to %s' % (num_sentences, sentences_text_path))
 
+        return num_sentences
+
     # -------------------------------------------------------------------------
 
-    def write_language_model(self) -> None:
-        '''Generates an ARPA language model using mitlm'''
+    def start_language_model(self) -> Optional[Union[subprocess.Popen, concurrent.futures.Future]]:
+        '''Starts generating an ARPA language model, either in the training
+        worker pool or with mitlm. Returns the running task (None if the model
+        was re-used).'''
         sentences_text_path = self.profile.read_path(
             self.profile.get('speech_to_text.sentences_text'))
 
-        # Extract file name only (will be made relative to container path)
-        sentences_text_path = sentences_text_path
-        working_dir = self.profile.write_dir()
         lm_dest_path = self.profile.write_path(
             self.profile.get('speech_to_text.pocketsphinx.language_model'))
 
-        # Use mitlm
-        subprocess.check_call(['estimate-ngram',
-                               '-o', '3',
-                               '-text', sentences_text_path,
-                               '-wl', lm_dest_path])
+        lm_system = self.profile.get('training.speech_to_text.language_model.system', 'builtin')
+        lm_order = int(self.profile.get('training.speech_to_text.language_model.order', 3))
+        weights = self.intent_weights(self.sentences_by_intent)
+
+        # Re-use language model if sentences haven't changed
+        cache = TrainingCache(self.profile, 'language_model')
+        if lm_system == 'mitlm':
+            lm_key = content_hash(file_hash(sentences_text_path), 'estimate-ngram', lm_order)
+        else:
+            lm_key = content_hash(file_hash(sentences_text_path), lm_system, lm_order,
+                                  weights, self.split_pattern)
+
+        if cache.get_file('language_model', lm_key, lm_dest_path) is not None:
+            cache.save()
+            self._logger.debug('Re-used language model at %s' % lm_dest_path)
+            return None
+
+        self.lm_cache = cache
+        self.lm_key = lm_key
+        self.lm_dest_path = lm_dest_path
+
+        if lm_system == 'mitlm':
+            command = ['estimate-ngram',
+                       '-o', str(lm_order),
+                       '-text', sentences_text_path,
+                       '-wl', lm_dest_path]
+
+            self._logger.debug(command)
+            return subprocess.Popen(command)
+
+        # Count n-grams of the training sentences directly (weights are
+        # applied to the counts instead of repeating sentences).
+        return submit_task(training_workers(self.profile),
+                           estimate_language_model,
+                           self.sentences_path, weights, lm_dest_path, lm_order)
+
+    def finish_language_model(self, task:Optional[Union[subprocess.Popen,
+                                                         concurrent.futures.Future]]) -> None:
+        '''Checks the result of a task from start_language_model.'''
+        if task is None:
+            return
+
+        if isinstance(task, subprocess.Popen):
+            if task.wait() != 0:
+                raise subprocess.CalledProcessError(task.returncode, task.args)
+        else:
+            task.result()
 
-        self._logger.debug('Wrote language model to %s' % lm_dest_path)
+        self._logger.debug('Wrote language model to %s' % self.lm_dest_path)
+        self.lm_cache.put_file('language_model', self.lm_key, self.lm_dest_path)
+        self.lm_cache.save()
 
 # -----------------------------------------------------------------------------
 # Command-line based speed trainer.
@@ -353,6 +645,9 @@ class PocketsphinxSpeechTrainer(RhasspyActor):
 class CommandSpeechTrainer(RhasspyActor):
     '''Trains a speech to text system via command line.'''
 
+    # Seconds between checks of the training command
+    POLL_SEC = 0.1
+
     def to_started(self, from_state:str) -> None:
         program = os.path.expandvars(self.profile.get('training.speech_to_text.command.program'))
         arguments = [os.path.expandvars(str(a))
@@ -368,24 +663,66 @@ class CommandSpeechTrainer(RhasspyActor):
 
     def in_started(self, message: Any, sender: ActorAddress) -> None:
         if isinstance(message, TrainSpeech):
+            self.receiver = message.receiver or sender
             try:
-                sentences_by_intent = self.train(message.tagged_sentences)
-                self.send(message.receiver or sender,
-                          SpeechTrainingComplete(message.tagged_sentences,
-                                                 sentences_by_intent))
+                with training_stage(self, self.receiver, 'grouping') as progress:
+                    self.sentences_by_intent = self.group(message.corpus)
+                    sentences_path = save_sentences(self.profile, self.sentences_by_intent)
+                    progress.items = self.sentences_by_intent.num_sentences
+
+                # Intent training runs alongside the command
+                self.send(self.receiver,
+                          SentencesGrouped(message.corpus, sentences_path))
+
+                self.start_time = time.perf_counter()
+                self.send(self.receiver, TrainingProgress('speech_command'))
+                self.process = self.train(self.sentences_by_intent)
+                self.transition('training')
             except:
                 self._logger.exception('train')
-                self.send(message.receiver or sender,
-                          SpeechTrainingFailed())
+                self.send(self.receiver,
+                          SpeechTrainingFailed('Training command failed'))
+
+    def to_training(self, from_state:str) -> None:
+        self.check_command()
+
+    def in_training(self, message: Any, sender: ActorAddress) -> None:
+        if isinstance(message, WakeupMessage):
+            self.check_command()
+
+    def check_command(self) -> None:
+        '''Finishes training if the command has exited. Otherwise, checks
+        again later.'''
+        if self.process.poll() is None:
+            self.wakeupAfter(timedelta(seconds=CommandSpeechTrainer.POLL_SEC))
+            return
+
+        if self.process.returncode == 0:
+            self.send(self.receiver,
+                      TrainingProgress('speech_command',
+                                       seconds=time.perf_counter() - self.start_time,
+                                       finished=True))
+
+            self.send(self.receiver, SpeechTrainingComplete())
+        else:
+            self._logger.error('Training command failed with exit code %s',
+                               self.process.returncode)
+            self.send(self.receiver,
+                      SpeechTrainingFailed('Training command failed'))
+
+        self.transition('started')
 
     # -------------------------------------------------------------------------
 
-    def train(self, tagged_sentences: Dict[str, List[str]]) -> Dict[str, List[TrainingSentence]]:
-        sentences_by_intent = group_sentences_by_intent(tagged_sentences,
-                                                        self.sentence_casing,
-                                                        self.replace_patterns,
-                                                        self.split_pattern)
+    def group(self, corpus: SentenceCorpus) -> SentenceStore:
+        return group_sentences(self.profile,
+                               corpus,
+                               self.sentence_casing,
+                               self.replace_patterns,
+                               self.split_pattern)
 
+    def train(self, sentences_by_intent: SentenceStore) -> subprocess.Popen:
+        '''Starts the training command with the sentences on stdin.'''
         self._logger.debug(self.command)
 
         # JSON -> STDIN
@@ -394,6 +731,8 @@ class CommandSpeechTrainer(RhasspyActor):
             for intent_name, sentences in sentences_by_intent.items()
         }).encode()
 
-        subprocess.run(self.command, input=input, check=True)
+        with tempfile.TemporaryFile() as input_file:
+            input_file.write(input)
+            input_file.seek(0)
 
-        return sentences_by_intent
+            return subprocess.Popen(self.command, stdin=input_file)
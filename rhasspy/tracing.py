@@ -0,0 +1,100 @@
+import json
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional
+
+from .actor import TraceSpan
+
+# -----------------------------------------------------------------------------
+
+class Trace:
+    '''Timings for a single utterance, from wake up to intent handling.'''
+    def __init__(self, trace_id:Optional[str]=None) -> None:
+        self.trace_id = trace_id or str(uuid.uuid4())
+        self.start_time = time.time()
+        self.end_time:Optional[float] = None
+        self.spans:List[Dict[str, Any]] = []
+        self._open_spans:Dict[str, float] = {}
+
+    def start_span(self, name:str) -> None:
+        self._open_spans[name] = time.time()
+
+    def end_span(self, name:str) -> None:
+        start_time = self._open_spans.pop(name, None)
+        if start_time is not None:
+            self.add_span(name, start_time, time.time())
+
+    def elapsed(self, name:str) -> float:
+        '''Seconds since an open span was started.'''
+        start_time = self._open_spans.get(name, None)
+        if start_time is None:
+            return 0
+
+        return time.time() - start_time
+
+    def add_span(self, name:str, start_time:float, end_time:float,
+                 actor:Optional[str]=None) -> None:
+        self.spans.append({
+            'name': name,
+            'actor': actor,
+            'start_sec': start_time - self.start_time,
+            'duration_sec': end_time - start_time
+        })
+
+    def finish(self) -> None:
+        for name in list(self._open_spans.keys()):
+            self.end_span(name)
+
+        self.end_time = time.time()
+
+    def json(self) -> Dict[str, Any]:
+        end_time = self.end_time or time.time()
+        return {
+            'trace_id': self.trace_id,
+            'start_time': self.start_time,
+            'duration_sec': end_time - self.start_time,
+            'finished': self.end_time is not None,
+            'spans': sorted(self.spans, key=lambda s: s['start_sec'])
+        }
+
+# -----------------------------------------------------------------------------
+
+class TraceStore:
+    '''Keeps the most recent traces in memory and optionally appends finished
+    traces to a JSONL file.'''
+    def __init__(self, max_traces:int=100, jsonl_path:Optional[str]=None) -> None:
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self.max_traces = max_traces
+        self.jsonl_path = jsonl_path
+        self.traces:Dict[str, Trace] = OrderedDict()
+
+    def add(self, trace:Trace) -> None:
+        self.traces[trace.trace_id] = trace
+        while len(self.traces) > self.max_traces:
+            self.traces.popitem(last=False)
+
+    def add_span(self, span:TraceSpan) -> None:
+        '''Adds a span reported by another actor.'''
+        trace = self.traces.get(span.trace_id, None)
+        if trace is not None:
+            trace.add_span(span.name, span.start_time, span.end_time, actor=span.actor)
+
+    def finish(self, trace:Trace) -> None:
+        trace.finish()
+
+        if self.jsonl_path:
+            try:
+                with open(self.jsonl_path, 'a') as jsonl_file:
+                    print(json.dumps(trace.json()), file=jsonl_file)
+            except Exception:
+                self._logger.exception('finish')
+
+    def get(self, trace_id:Optional[str]=None) -> List[Dict[str, Any]]:
+        '''Returns one trace by id or all traces, most recent first.'''
+        if trace_id is not None:
+            trace = self.traces.get(trace_id, None)
+            return [trace.json()] if trace is not None else []
+
+        return [trace.json() for trace in reversed(self.traces.values())]
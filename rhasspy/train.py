@@ -1,18 +1,25 @@
 import os
 import re
+import bisect
 import configparser
 import subprocess
+import random
 import itertools
 import logging
-import concurrent.futures
+import pickle
+import shutil
 from collections import defaultdict
-from typing import TextIO, Dict, List, Tuple, Any, Optional
+from typing import TextIO, Dict, List, Set, Tuple, Any, Optional, Iterator
 
 from thespian.actors import ActorAddress
-from jsgf import parser, expansions, rules
 
 from .actor import RhasspyActor
 from .profiles import Profile
+from .training import (TrainingCache, content_hash, training_workers,
+                       run_tasks, CORPUS_DIR)
+from .utils import SentenceSpans, sanitize_sentence
+from .ini_jsgf import Rule, Literal, Sequence, Alternatives, Group, \
+    OptionalGroup, RuleRef, parse_grammar
 
 # -----------------------------------------------------------------------------
 
@@ -22,9 +29,45 @@ class GenerateSentences:
         self.receiver = receiver
 
 class SentencesGenerated:
+    def __init__(self, corpus: 'SentenceCorpus') -> None:
+        self.corpus = corpus
+
+class SentenceCorpus:
+    '''Handle of the sentences generated for each intent.
+
+    Sentences stay in files (one sentence and its tag spans per line), so
+    messages that carry a corpus are small no matter how many sentences
+    there are.'''
     def __init__(self,
-                 tagged_sentences: Dict[str, List[str]]) -> None:
-        self.tagged_sentences = tagged_sentences
+                 paths: Dict[str, str],
+                 keys: Dict[str, str],
+                 counts: Dict[str, int]) -> None:
+        # intent -> sentences file
+        self.paths = paths
+
+        # intent -> hash of everything its sentences are generated from
+        self.keys = keys
+
+        # intent -> number of sentences
+        self.counts = counts
+
+    @property
+    def num_sentences(self) -> int:
+        return sum(self.counts.values())
+
+    def intent_names(self) -> List[str]:
+        return list(self.paths)
+
+    def sentence_spans(self, intent_name:str) -> Iterator[SentenceSpans]:
+        '''Sentences of an intent without tags (with tag spans)'''
+        with open(self.paths[intent_name], 'r') as sentences_file:
+            for line in sentences_file:
+                yield _parse_sentence_line(line)
+
+    def tagged_sentences(self, intent_name:str) -> Iterator[str]:
+        '''Sentences of an intent with tags ([text](tag))'''
+        for sentence, spans in self.sentence_spans(intent_name):
+            yield _tagged_text(sentence, spans)
 
 # -----------------------------------------------------------------------------
 # jsgf-gen based sentence generator
@@ -33,29 +76,22 @@ class SentencesGenerated:
 
 class JsgfSentenceGenerator(RhasspyActor):
     '''Uses jsgf-gen to generate sentences.'''
-    def to_started(self, from_state:str) -> None:
-        self.language = self.profile.get('language', 'en')
-
     def in_started(self, message: Any, sender: ActorAddress) -> None:
         if isinstance(message, GenerateSentences):
-            tagged_sentences = self.generate_sentences()
+            corpus = self.generate_sentences()
             self.send(message.receiver or sender,
-                      SentencesGenerated(tagged_sentences))
+                      SentencesGenerated(corpus))
 
     # -------------------------------------------------------------------------
 
-    def generate_sentences(self) -> Dict[str, List[str]]:
+    def generate_sentences(self) -> SentenceCorpus:
+        '''Generates the sentences of each intent into files.
+        Returns a handle to the files.'''
         ini_path = self.profile.read_path(
             self.profile.get('speech_to_text.sentences_ini'))
 
-        grammars_dir = self.profile.write_dir(
-            self.profile.get('speech_to_text.grammars_dir'))
-
         with open(ini_path, 'r') as ini_file:
-            grammar_paths = self._make_grammars(ini_file, grammars_dir)
-
-        # intent -> sentence templates
-        tagged_sentences: Dict[str, List[str]] = defaultdict(list)
+            grammar_rules = _grammar_rules(ini_file)
 
         # Ready slots values
         slots_dirs = self.profile.read_paths(
@@ -66,31 +102,158 @@ class JsgfSentenceGenerator(RhasspyActor):
         # colors -> [red, green, blue]
         slot_values = JsgfSentenceGenerator.load_slots(slots_dirs)
 
-        # Load all grammars
-        grammars = {}
-        for f_name in os.listdir(grammars_dir):
-            self._logger.debug(f'Parsing JSGF grammar {f_name}')
-            grammar = parser.parse_grammar_file(os.path.join(grammars_dir, f_name))
-            grammars[grammar.name] = grammar
+        # name -> JSGF rules (one per line)
+        grammar_texts = { name: '\n'.join(rules)
+                          for name, rules in grammar_rules.items() }
+
+        # Sections without sentences only have rules for other sections
+        intent_names = [name for name, rules in grammar_rules.items()
+                        if _has_sentences(rules)]
+
+        # Randomly sample intents with more sentences than this (0 for no limit)
+        max_per_intent = self.profile.get('training.sentences.max_per_intent', 0)
 
-        global_rule_map = { f'{grammar.name}.{rule.name}': rule
-                            for grammar in grammars.values()
-                            for rule in grammar.rules }
+        # Re-use sentences of intents whose grammars (and the grammars/slots
+        # they reference) haven't changed.
+        cache = TrainingCache(self.profile, 'sentences')
+        grammar_keys = {}
 
-        # Generate sentences concurrently
-        with concurrent.futures.ProcessPoolExecutor() as executor:
-            future_to_name = { executor.submit(_jsgf_generate, name, grammars, global_rule_map, slot_values) : name
-                               for name, grammar in grammars.items() }
+        # intent -> text file with one sentence and its tag spans per line
+        sentences_paths: Dict[str, str] = {}
 
-            # Add to the list as they get done
-            for future in concurrent.futures.as_completed(future_to_name):
-                name = future_to_name[future]
-                tagged_sentences[name] = future.result()
+        for name in intent_names:
+            dependencies = _grammar_dependencies(name, grammar_texts)
+            dependency_texts = [grammar_texts[dep_name] for dep_name in dependencies]
+            grammar_keys[name] = content_hash(
+                _SENTENCES_FORMAT,
+                dependency_texts,
+                { slot_name: sorted(values) for slot_name, values in slot_values.items()
+                  if any(f'-{slot_name}-' in text for text in dependency_texts) },
+                max_per_intent)
 
-        num_sentences = sum(len(s) for s in tagged_sentences.values())
-        self._logger.debug('Generated %s sentence(s) in %s intent(s)' % (num_sentences, len(tagged_sentences)))
+            cached_path = cache.get_path(name, grammar_keys[name])
+            if cached_path is not None:
+                sentences_paths[name] = cached_path
 
-        return tagged_sentences
+        changed_names = [name for name in intent_names
+                         if name not in sentences_paths]
+
+        # Sentences of changed intents are written next to the other
+        # training data of this run (not committed to the profile).
+        corpus_dir = self.profile.write_dir(CORPUS_DIR, 'sentences')
+
+        if len(changed_names) > 0:
+            # Parse changed grammars and the grammars they reference
+            parse_names = set()
+            for name in changed_names:
+                parse_names.update(_grammar_dependencies(name, grammar_texts))
+
+            parse_rules = { name: grammar_rules[name] for name in sorted(parse_names) }
+            grammars = {}
+            for name, rules in parse_rules.items():
+                self._logger.debug(f'Parsing JSGF rules of {name}')
+                grammars[name] = parse_grammar(name, rules)
+
+            global_rule_map = { f'{grammar.name}.{rule.name}': rule
+                                for grammar in grammars.values()
+                                for rule in grammar.rules }
+
+            # Workers load the rules once per training run instead of
+            # receiving the parsed grammars with every task.
+            state_key = content_hash(parse_rules, slot_values)
+            state_path = os.path.join(corpus_dir, 'grammars.pickle')
+            with open(state_path, 'wb') as state_file:
+                pickle.dump(state_key, state_file)
+                pickle.dump((parse_rules, slot_values), state_file)
+
+            # Tasks run in this process (one worker) re-use the parsed grammars
+            _set_worker_state(state_key, grammars, slot_values)
+
+            # Split intents into chunks of sentences with about the same
+            # number of expansions, so large intents are spread over workers.
+            workers = training_workers(self.profile)
+            branch_counts = {}
+            for name in changed_names:
+                branch_counts[name] = _jsgf_branch_counts(name, grammars,
+                                                          global_rule_map, slot_values)
+
+            num_expansions = sum(sum(counts) for counts in branch_counts.values())
+            chunk_size = max(_MIN_CHUNK_EXPANSIONS,
+                             num_expansions // (workers * _CHUNKS_PER_WORKER))
+
+            # (function, arguments, intent name, expansions)
+            tasks = []
+            intent_chunks: Dict[str, List[str]] = {}
+            for name in changed_names:
+                sentences_paths[name] = os.path.join(corpus_dir, name)
+                num_sentences = sum(branch_counts[name])
+                if (max_per_intent > 0) and (num_sentences > max_per_intent):
+                    self._logger.warning('Sampling %s of %s sentence(s) for %s',
+                                         max_per_intent, num_sentences, name)
+
+                    intent_chunks[name] = [sentences_paths[name]]
+                    tasks.append((_jsgf_sample_chunk,
+                                  (state_path, name, max_per_intent, sentences_paths[name]),
+                                  name, max_per_intent))
+                    continue
+
+                self._logger.debug('Generating %s sentence(s) for %s',
+                                   num_sentences, name)
+
+                chunks = _split_branches(branch_counts[name], chunk_size)
+                if len(chunks) == 1:
+                    intent_chunks[name] = [sentences_paths[name]]
+                else:
+                    intent_chunks[name] = ['%s.%s' % (sentences_paths[name], index)
+                                           for index in range(len(chunks))]
+
+                for (first, last), chunk_path in zip(chunks, intent_chunks[name]):
+                    tasks.append((_jsgf_write_chunk,
+                                  (state_path, name, first, last, chunk_path),
+                                  name, sum(branch_counts[name][first:last])))
+
+            # Largest chunks first
+            tasks = sorted(tasks, key=lambda task: task[3], reverse=True)
+
+            chunks_left = { name: len(chunk_paths)
+                            for name, chunk_paths in intent_chunks.items() }
+            sentences_written: Dict[str, int] = defaultdict(int)
+            for index, result in run_tasks(workers, [(task[0], task[1]) for task in tasks]):
+                name = tasks[index][2]
+                sentences_written[name] += result
+                chunks_left[name] -= 1
+                if chunks_left[name] == 0:
+                    _join_chunks(intent_chunks[name], sentences_paths[name])
+                    cache.put_file(name, grammar_keys[name], sentences_paths[name],
+                                   sentences_written[name])
+
+            _worker_state.clear()
+
+        cache.save()
+
+        # Write tagged sentences to Markdown file
+        tagged_path = self.profile.write_path(
+            self.profile.get('training.tagged_sentences'))
+
+        corpus = SentenceCorpus({ name: sentences_paths[name]
+                                  for name in sorted(sentences_paths) },
+                                grammar_keys, {})
+
+        with open(tagged_path, 'w') as tagged_file:
+            for name in corpus.intent_names():
+                print('# intent:%s' % name, file=tagged_file)
+                num_sentences = 0
+                for tagged_sentence in corpus.tagged_sentences(name):
+                    print('- %s' % tagged_sentence, file=tagged_file)
+                    num_sentences += 1
+
+                corpus.counts[name] = num_sentences
+                print('', file=tagged_file)
+
+        self._logger.debug('Wrote tagged sentences to %s' % tagged_path)
+        self._logger.debug('Generated %s sentence(s) in %s intent(s)' % (corpus.num_sentences, len(corpus.paths)))
+
+        return corpus
 
     # -------------------------------------------------------------------------
 
@@ -116,152 +279,779 @@ class JsgfSentenceGenerator(RhasspyActor):
             for name, values in slot_values.items()
         }
 
-    # -------------------------------------------------------------------------
+# -----------------------------------------------------------------------------
 
-    def _make_grammars(self, ini_file: TextIO, grammar_dir: str) -> Dict[str, str]:
-        '''Create JSGF grammars for each intent from sentence ini file.
-        Returns paths to all generated grammars (name -> path).'''
-        config = configparser.ConfigParser(
-            allow_no_value=True,
-            strict=False,
-            delimiters=['='])
-
-        config.optionxform = lambda x: str(x) # case sensitive
-        config.read_file(ini_file)
-
-        os.makedirs(grammar_dir, exist_ok=True)
-
-        # Process configuration sections
-        grammar_rules = {}
-
-        for sec_name in config.sections():
-            sentences: List[str] = []
-            rules: List[str] = []
-            for k, v in config[sec_name].items():
-                if v is None:
-                    # Collect non-valued keys as sentences
-                    sentences.append('({0})'.format(k.strip()))
-                else:
-                    # Collect key/value pairs as JSGF rules
-                    rule = '<{0}> = ({1});'.format(k, v)
-                    rules.append(rule)
-
-            if len(sentences) > 0:
-                # Combine all sentences into one big rule (same name as section)
-                sentences_rule = 'public <{0}> = ({1});'.format(sec_name, ' | '.join(sentences))
-                rules.insert(0, sentences_rule)
-
-            grammar_rules[sec_name] = rules
-
-        # Write JSGF grammars
-        grammar_paths = {}
-        for name, rules in grammar_rules.items():
-            grammar_path = os.path.join(grammar_dir, '{0}.gram'.format(name))
-
-            # Only overwrite grammar file if it contains rules or doesn't yet exist
-            if (len(rules) > 0) or not os.path.exists(grammar_path):
-                with open(grammar_path, 'w') as grammar_file:
-                    # JSGF header
-                    print(f'#JSGF V1.0 UTF-8 {self.language};', file=grammar_file)
-                    print('grammar {0};'.format(name), file=grammar_file)
-                    print('', file=grammar_file)
-
-                    # Grammar rules
-                    for rule in rules:
-                        # Handle special case where sentence starts with ini
-                        # reserved character '['. In this case, use '\[' to pass
-                        # it through to the JSGF grammar, where we deal with it
-                        # here.
-                        rule = re.sub(r'\\\[', '[', rule)
-                        print(rule, file=grammar_file)
-
-            grammar_paths[name] = grammar_path
-
-        return grammar_paths
+# Changes when the sentence files in the training cache change
+_SENTENCES_FORMAT = 2
+
+def _grammar_rules(ini_file: TextIO) -> Dict[str, List[str]]:
+    '''Converts the sections of a sentences ini file to JSGF rules (name -> rules).'''
+    config = configparser.ConfigParser(
+        allow_no_value=True,
+        strict=False,
+        delimiters=['='])
+
+    config.optionxform = lambda x: str(x) # case sensitive
+    config.read_file(ini_file)
+
+    grammar_rules = {}
+    for sec_name in config.sections():
+        sentences: List[str] = []
+        rules: List[str] = []
+        for k, v in config[sec_name].items():
+            if v is None:
+                # Collect non-valued keys as sentences
+                sentences.append('({0})'.format(k.strip()))
+            else:
+                # Collect key/value pairs as JSGF rules
+                rule = '<{0}> = ({1});'.format(k, v)
+                rules.append(rule)
+
+        if len(sentences) > 0:
+            # Combine all sentences into one big rule (same name as section)
+            sentences_rule = 'public <{0}> = ({1});'.format(sec_name, ' | '.join(sentences))
+            rules.insert(0, sentences_rule)
+
+        grammar_rules[sec_name] = rules
+
+    return grammar_rules
+
+def _has_sentences(rules:List[str]) -> bool:
+    '''True if a section's rules include its sentences (public rule).'''
+    return (len(rules) > 0) and rules[0].startswith('public ')
+
+def _grammar_dependencies(name:str, grammar_texts:Dict[str, str]) -> List[str]:
+    '''Returns name and the names of all grammars it references (<Other.rule>).'''
+    dependencies = [name]
+    index = 0
+    while index < len(dependencies):
+        text = grammar_texts.get(dependencies[index], '')
+        for ref_name in re.findall(r'<([^<>.\s]+)\.[^<>]+>', text):
+            if (ref_name in grammar_texts) and (ref_name not in dependencies):
+                dependencies.append(ref_name)
+
+        index += 1
+
+    return sorted(dependencies)
 
 # -----------------------------------------------------------------------------
 
-def _jsgf_generate(grammar_name, grammars, global_rule_map, slot_values) -> List[str]:
+def _grammar_rule_map(grammar_name, grammars, global_rule_map) -> Dict[str, Any]:
+    '''Rules that can be referenced from a grammar (local and global names).'''
     grammar = grammars[grammar_name]
     rule_map = { rule.name: rule for rule in grammar.rules }
     for name, rule in global_rule_map.items():
         rule_map[name] = rule
 
+    return rule_map
+
+def _jsgf_write(grammar_name, grammars, global_rule_map, slot_values,
+                sentences_path:str, expansions=None, branches=None) -> int:
+    '''Writes the sentences of a grammar to a text file (one sentence and its
+    tag spans per line). Returns the number of sentences written.'''
+    num_sentences = 0
+    with open(sentences_path, 'w') as sentences_file:
+        for sentence, spans in _jsgf_generate(grammar_name, grammars, global_rule_map,
+                                              slot_values, expansions, branches):
+            print(_sentence_line(sentence, spans), file=sentences_file)
+            num_sentences += 1
+
+    return num_sentences
+
+def _jsgf_generate(grammar_name, grammars, global_rule_map, slot_values,
+                   expansions=None, branches=None) -> Iterator[SentenceSpans]:
+    '''Generates the sentences of a grammar (text and tag spans) one at a time.
+    expansions has the pre-expanded rules for rule references (see _shared_expansions).
+    branches limits generation to a (first, last) range of _sentence_branches.'''
+    rule_map = _grammar_rule_map(grammar_name, grammars, global_rule_map)
+
     top_rule = rule_map[grammar_name]
+    if branches is None:
+        tagged_sentences = _make_tagged_sentences(top_rule, rule_map, shared=expansions)
+    else:
+        first, last = branches
+        tagged_sentences = itertools.chain.from_iterable(
+            _make_tagged_sentences(branch, rule_map, shared=expansions)
+            for branch in _sentence_branches(top_rule)[first:last])
 
     # Generate sentences
-    sentences = []
-    for sentence, tag in _make_tagged_sentences(top_rule, rule_map):
+    for sentence, tag, spans in tagged_sentences:
         # Check for template replacements ($name$)
         if '-' in sentence:
-            chunks = re.split(r'-([^-]+)-', sentence)
-            replacements = []
-            for i, chunk in enumerate(chunks):
-                if ((i % 2) != 0) and (chunk in slot_values):
-                    replacements.append(slot_values[chunk])
-                else:
-                    replacements.append([chunk])
-
-            # Create all combinations of replacements
-            for replacement in itertools.product(*replacements):
-                sentences.append(''.join(replacement))
+            yield from _replace_slots(sentence, spans, slot_values)
         else:
             # No replacements
-            sentences.append(sentence)
+            yield (sentence, spans)
+
+def _replace_slots(sentence:str, spans, slot_values) -> Iterator[SentenceSpans]:
+    '''Generates all combinations of slot values (-name-) in a sentence.
+    Tag spans are moved to match the replaced text.'''
+    chunks = re.split(r'-([^-]+)-', sentence)
+    replacements = []
+    chunk_starts = []  # in sentence
+    chunk_start = 0
+    for i, chunk in enumerate(chunks):
+        chunk_starts.append(chunk_start)
+        if (i % 2) != 0:
+            chunk_start += len(chunk) + 2  # dashes
+        else:
+            chunk_start += len(chunk)
+
+        if ((i % 2) != 0) and (chunk in slot_values):
+            replacements.append(slot_values[chunk])
+        else:
+            replacements.append([chunk])
+
+    # Create all combinations of replacements
+    for replacement in itertools.product(*replacements):
+        text = ''.join(replacement)
+        if len(spans) == 0:
+            yield (text, spans)
+            continue
+
+        # Start of each chunk in replaced text
+        new_starts = []
+        new_start = 0
+        for value in replacement:
+            new_starts.append(new_start)
+            new_start += len(value)
 
-    return sentences
+        def move(pos:int) -> int:
+            index = bisect.bisect_right(chunk_starts, pos) - 1
+            return new_starts[index] + min(pos - chunk_starts[index],
+                                           len(replacement[index]))
+
+        yield (text, [(move(start), move(end), span_tag)
+                      for start, end, span_tag in spans])
+
+def _sentence_line(sentence:str, spans) -> str:
+    '''Formats a sentence and its tag spans as tab-separated fields
+    (text, start, end, tag, start, end, tag, ...).'''
+    return '\t'.join([sentence] + ['%s\t%s\t%s' % span for span in spans])
+
+def _parse_sentence_line(line:str) -> SentenceSpans:
+    '''Parses a line written by _sentence_line.'''
+    fields = line.rstrip('\n').split('\t')
+    return fields[0], [(int(fields[i]), int(fields[i+1]), fields[i+2])
+                       for i in range(1, len(fields), 3)]
+
+def _tagged_text(sentence:str, spans) -> str:
+    '''Marks tagged spans in a sentence ([text](tag)).'''
+    if len(spans) == 0:
+        return sentence
+
+    # (position, closing before opening, outer spans open first/close last, text)
+    marks = []
+    for index, (start, end, tag) in enumerate(spans):
+        marks.append((start, 1, -end, -index, '['))
+        marks.append((end, 0, -start, index, f']({tag})'))
+
+    marks.sort()
+    chunks = []
+    pos = 0
+    for mark in marks:
+        chunks.append(sentence[pos:mark[0]])
+        chunks.append(mark[4])
+        pos = mark[0]
+
+    chunks.append(sentence[pos:])
+    return ''.join(chunks)
 
 # -----------------------------------------------------------------------------
 
-def _make_tagged_sentences(rule, rule_map, tag=None):
-    if isinstance(rule, rules.Rule):
+def _make_tagged_sentences(rule, rule_map, tag=None,
+                           shared=None) -> Iterator[Tuple[str, Optional[str], Any]]:
+    '''Generates (text, tag, tag spans) for every expansion of a JSGF rule.
+    Only the current combination is kept in memory, except for the rule
+    references in shared (name -> expansions), which are expanded once.'''
+    if isinstance(rule, Rule):
         # Unpack
-        return _make_tagged_sentences(rule.expansion, rule_map)
-    elif isinstance(rule, expansions.AlternativeSet):
+        yield from _make_tagged_sentences(rule.expansion, rule_map,
+                                          shared=shared)
+    elif isinstance(rule, Alternatives):
         # (a | b | c)
-        alt_strs = []
         for child in rule.children:
-            alt_strs.extend(_make_tagged_sentences(child, rule_map, rule.tag or tag))
-        return alt_strs
-    elif isinstance(rule, expansions.RequiredGrouping):
+            yield from _make_tagged_sentences(child, rule_map, rule.tag or tag, shared)
+    elif isinstance(rule, Group):
         # (abc)
-        group_strs = []
         for child in rule.children:
-            group_strs.extend(_make_tagged_sentences(child, rule_map, rule.tag or tag))
-        return group_strs
-    elif isinstance(rule, expansions.Literal):
+            yield from _make_tagged_sentences(child, rule_map, rule.tag or tag, shared)
+    elif isinstance(rule, Literal):
         # a
-        return [(rule.text, rule.tag or tag)]
-    elif isinstance(rule, expansions.OptionalGrouping):
+        yield (rule.text, rule.tag or tag, ())
+    elif isinstance(rule, OptionalGroup):
         # [a]
-        return [('', rule.tag or tag)] + _make_tagged_sentences(rule.child, rule_map, rule.tag or tag)
-    elif isinstance(rule, expansions.Sequence):
+        yield ('', rule.tag or tag, ())
+        yield from _make_tagged_sentences(rule.child, rule_map, rule.tag or tag, shared)
+    elif isinstance(rule, Sequence):
         # a b c
-        seq_strs = []
-        for child in rule.children:
-            seq_strs.append(_make_tagged_sentences(child, rule_map))
-
         # Do all combinations
-        sentences = []
-        for sent_tuple in itertools.product(*seq_strs):
-            sentence = []
-            for word, tag in sent_tuple:
-                if tag:
-                    word = f'[{word}]({tag})'
+        for sent_tuple in _sequence_product(rule.children, rule_map, shared):
+            sentence, spans = _join_words(sent_tuple)
+            if len(sentence) > 0:
+                yield (sentence, rule.tag, spans)
+
+    elif isinstance(rule, RuleRef):
+        # <OtherGrammar.otherRule>
+        if (shared is not None) and (rule.name in shared):
+            # Expanded once already
+            yield from shared[rule.name]
+        else:
+            yield from _make_tagged_sentences(rule_map[rule.name], rule_map,
+                                              shared=shared)
+    else:
+        # Unsupported
+        assert False, rule.__class__
 
-                word = word.strip()
-                if len(word) > 0:
-                    sentence.append(word)
+def _join_words(words) -> Tuple[str, Any]:
+    '''Joins (text, tag, tag spans) of words with spaces.
+    Returns the text and the spans of all tagged words.'''
+    sentence = []
+    spans = []
+    pos = 0
+    for word, tag, word_spans in words:
+        if not word:
+            # Empty words (and their tags) are dropped
+            continue
 
-            if len(sentence) > 0:
-                sentences.append((' '.join(sentence), rule.tag))
+        if pos > 0:
+            pos += 1  # space
+
+        if word_spans:
+            for start, end, span_tag in word_spans:
+                spans.append((pos + start, pos + end, span_tag))
+
+        end_pos = pos + len(word)
+        if tag:
+            spans.append((pos, end_pos, tag))
+
+        sentence.append(word)
+        pos = end_pos
+
+    return ' '.join(sentence), (tuple(spans) if spans else ())
+
+def _sequence_product(children, rule_map, shared=None,
+                      index:int=0) -> Iterator[List[Tuple[str, Optional[str], Any]]]:
+    '''Like itertools.product, but re-generates the expansions of later
+    children for each combination instead of keeping them all in memory.'''
+    if index >= len(children):
+        yield []
+        return
+
+    for word_tag in _make_tagged_sentences(children[index], rule_map, shared=shared):
+        for rest in _sequence_product(children, rule_map, shared, index + 1):
+            yield [word_tag] + rest
+
+# -----------------------------------------------------------------------------
+
+# -----------------------------------------------------------------------------
+# Generating sentences in training workers
+# -----------------------------------------------------------------------------
+
+# Chunks of sentences have at least this many expansions
+_MIN_CHUNK_EXPANSIONS = 10000
+
+# Chunks per worker (more chunks balance better, but have more overhead)
+_CHUNKS_PER_WORKER = 4
+
+# Parsed grammars of the current training run (per process).
+# key, grammars, rule_map, slot_values, and memo (see _shared_expansions).
+_worker_state: Dict[str, Any] = {}
+
+def _set_worker_state(state_key:str, grammars, slot_values) -> None:
+    _worker_state.clear()
+    _worker_state.update(
+        key=state_key,
+        grammars=grammars,
+        rule_map={ f'{grammar.name}.{rule.name}': rule
+                   for grammar in grammars.values()
+                   for rule in grammar.rules },
+        slot_values=slot_values,
+        memo={})
+
+def _load_worker_state(state_path:str) -> Dict[str, Any]:
+    '''Parses the grammars in a state file (once per training run).'''
+    with open(state_path, 'rb') as state_file:
+        state_key = pickle.load(state_file)
+        if _worker_state.get('key') != state_key:
+            grammar_rules, slot_values = pickle.load(state_file)
+            grammars = { name: parse_grammar(name, rules)
+                         for name, rules in grammar_rules.items() }
+
+            _set_worker_state(state_key, grammars, slot_values)
+
+    return _worker_state
+
+def _jsgf_write_chunk(state_path:str, grammar_name:str,
+                      first:int, last:int, sentences_path:str) -> int:
+    '''Writes the sentences of a range of branches of a grammar (see
+    _sentence_branches). Returns the number of sentences written.'''
+    state = _load_worker_state(state_path)
+    shared = _shared_expansions(grammar_name, state['grammars'], state['rule_map'],
+                                state['memo'])
+
+    return _jsgf_write(grammar_name, state['grammars'], state['rule_map'],
+                       state['slot_values'], sentences_path, shared, (first, last))
 
-        return sentences
+def _jsgf_sample_chunk(state_path:str, grammar_name:str,
+                       num_samples:int, sentences_path:str) -> int:
+    '''Same as _jsgf_sample_write with the grammars in a state file.'''
+    state = _load_worker_state(state_path)
+    return _jsgf_sample_write(grammar_name, state['grammars'], state['rule_map'],
+                              state['slot_values'], num_samples, sentences_path)
 
-    elif isinstance(rule, expansions.NamedRuleRef):
+def _sentence_branches(rule) -> List[Any]:
+    '''Top-level alternatives of a grammar's public rule (one per sentence).'''
+    expansion = rule.expansion
+    while isinstance(expansion, Group) and (len(expansion.children) == 1) \
+          and not expansion.tag:
+        expansion = expansion.children[0]
+
+    if isinstance(expansion, Alternatives) and not expansion.tag:
+        return expansion.children
+
+    return [expansion]
+
+def _jsgf_branch_counts(grammar_name, grammars, global_rule_map, slot_values) -> List[int]:
+    '''Number of sentences of each branch of a grammar (see _sentence_branches).'''
+    rule_map = _grammar_rule_map(grammar_name, grammars, global_rule_map)
+    if grammar_name not in rule_map:
+        return []
+
+    counts:Dict[int, Tuple[int, int]] = {}
+    return [_count_expansions(branch, rule_map, slot_values, counts)[0]
+            for branch in _sentence_branches(rule_map[grammar_name])]
+
+def _split_branches(branch_counts:List[int], chunk_size:int) -> List[Tuple[int, int]]:
+    '''Splits branches into (first, last) ranges with about chunk_size
+    expansions each. Always returns at least one range.'''
+    chunks = []
+    first = 0
+    num_expansions = 0
+    for index, count in enumerate(branch_counts):
+        num_expansions += count
+        if num_expansions >= chunk_size:
+            chunks.append((first, index + 1))
+            first = index + 1
+            num_expansions = 0
+
+    if (first < len(branch_counts)) or (len(chunks) == 0):
+        chunks.append((first, len(branch_counts)))
+
+    return chunks
+
+def _join_chunks(chunk_paths:List[str], sentences_path:str) -> None:
+    '''Concatenates (and deletes) the sentence files of chunks in order.'''
+    if chunk_paths == [sentences_path]:
+        return
+
+    with open(sentences_path, 'wb') as sentences_file:
+        for chunk_path in chunk_paths:
+            with open(chunk_path, 'rb') as chunk_file:
+                shutil.copyfileobj(chunk_file, sentences_file)
+
+            os.remove(chunk_path)
+
+# -----------------------------------------------------------------------------
+# Shared rule expansions
+# -----------------------------------------------------------------------------
+
+# Rules with more expansions than this are re-expanded when referenced
+# instead of being kept in memory.
+_MAX_SHARED_EXPANSIONS = 10000
+
+def _shared_expansions(grammar_name, grammars, global_rule_map,
+                       memo:Dict[str, List[Tuple[str, Optional[str], Any]]]) -> Dict[str, List[Tuple[str, Optional[str], Any]]]:
+    '''Expands every rule referenced by a grammar (name -> expansions).
+    Rules are keyed by a hash of their content (and the rules they reference)
+    in memo, so identical rules are only expanded once for all grammars.'''
+    rule_map = _grammar_rule_map(grammar_name, grammars, global_rule_map)
+    if grammar_name not in rule_map:
+        return {}
+
+    shared:Dict[str, List[Tuple[str, Optional[str], Any]]] = {}
+    rule_hashes:Dict[str, str] = {}
+    counts:Dict[int, Tuple[int, int]] = {}
+    visited:Set[str] = set()
+
+    # Referenced rules are expanded before the rules that reference them
+    def expand_refs(rule) -> None:
+        for ref_name in _rule_refs(rule):
+            if (ref_name in visited) or (ref_name not in rule_map):
+                continue
+
+            visited.add(ref_name)
+            ref_rule = rule_map[ref_name]
+            expand_refs(ref_rule.expansion)
+
+            # Before slot values are substituted
+            num_expansions = _count_expansions(ref_rule, rule_map, {}, counts)[0]
+            if num_expansions > _MAX_SHARED_EXPANSIONS:
+                continue
+
+            rule_hash = _rule_hash(ref_name, rule_map, rule_hashes)
+            if rule_hash not in memo:
+                memo[rule_hash] = list(_make_tagged_sentences(ref_rule, rule_map,
+                                                              shared=shared))
+
+            shared[ref_name] = memo[rule_hash]
+
+    expand_refs(rule_map[grammar_name].expansion)
+
+    return shared
+
+def _rule_refs(expansion) -> List[str]:
+    '''Names of the rules referenced in an expansion (<rule>).'''
+    if isinstance(expansion, RuleRef):
+        return [expansion.name]
+
+    names = []
+    for child in expansion.children:
+        names.extend(_rule_refs(child))
+
+    return names
+
+def _rule_hash(name:str, rule_map, rule_hashes:Dict[str, str]) -> str:
+    '''Hash of a rule's JSGF and the rules it references.'''
+    if name not in rule_hashes:
+        expansion = rule_map[name].expansion
+        rule_hashes[name] = content_hash(
+            expansion.compile(),
+            [_rule_hash(ref_name, rule_map, rule_hashes) if ref_name in rule_map else ref_name
+             for ref_name in _rule_refs(expansion)])
+
+    return rule_hashes[name]
+
+# -----------------------------------------------------------------------------
+# Counting and sampling expansions without generating all of them
+# -----------------------------------------------------------------------------
+
+def count_sentences(ini_file: TextIO,
+                    slot_values: Dict[str, List[str]]) -> Dict[str, int]:
+    '''Counts the sentences that each intent in a sentences ini file will
+    generate (same as _jsgf_generate) without generating them.'''
+    grammar_rules = _grammar_rules(ini_file)
+    grammars = { name: parse_grammar(name, rules)
+                 for name, rules in grammar_rules.items() if len(rules) > 0 }
+
+    global_rule_map = { f'{grammar.name}.{rule.name}': rule
+                        for grammar in grammars.values()
+                        for rule in grammar.rules }
+
+    return { name: _jsgf_count(name, grammars, global_rule_map, slot_values)
+             for name, rules in grammar_rules.items() if _has_sentences(rules) }
+
+def _jsgf_count(grammar_name, grammars, global_rule_map, slot_values) -> int:
+    rule_map = _grammar_rule_map(grammar_name, grammars, global_rule_map)
+
+    if grammar_name not in rule_map:
+        return 0  # no sentences
+
+    counts:Dict[int, Tuple[int, int]] = {}
+    return _count_expansions(rule_map[grammar_name], rule_map, slot_values, counts)[0]
+
+def _count_expansions(rule, rule_map, slot_values, counts) -> Tuple[int, int]:
+    '''Returns the number of expansions of a rule (same as _make_tagged_sentences,
+    with slot values substituted) and how many of them are empty.
+    Counts are memoized in counts.'''
+    count_key = id(rule)
+    if count_key in counts:
+        return counts[count_key]
+
+    if isinstance(rule, Rule):
+        result = _count_expansions(rule.expansion, rule_map, slot_values, counts)
+    elif isinstance(rule, Alternatives) \
+         or isinstance(rule, Group):
+        # (a | b | c) or (abc)
+        result = (0, 0)
+        for child in rule.children:
+            num_child, num_empty = _count_expansions(child, rule_map, slot_values,
+                                                     counts)
+            result = (result[0] + num_child, result[1] + num_empty)
+    elif isinstance(rule, Literal):
+        # a (times the number of values of each -slot-)
+        num_literal = 1
+        for i, chunk in enumerate(re.split(r'-([^-]+)-', rule.text)):
+            if ((i % 2) != 0) and (chunk in slot_values):
+                num_literal *= len(slot_values[chunk])
+
+        is_empty = len(rule.text.strip()) == 0
+        result = (num_literal, num_literal if is_empty else 0)
+    elif isinstance(rule, OptionalGroup):
+        # [a]
+        num_child, num_empty = _count_expansions(rule.child, rule_map, slot_values,
+                                                 counts)
+        result = (1 + num_child, num_empty + 1)
+    elif isinstance(rule, Sequence):
+        # a b c (all combinations, except where every word is empty)
+        num_combinations = 1
+        num_empty_combinations = 1
+        for child in rule.children:
+            num_child, num_empty = _count_expansions(child, rule_map, slot_values, counts)
+            num_combinations *= num_child
+            num_empty_combinations *= num_empty
+
+        result = (num_combinations - num_empty_combinations, 0)
+    elif isinstance(rule, RuleRef):
         # <OtherGrammar.otherRule>
-        return _make_tagged_sentences(rule_map[rule.name], rule_map)
+        result = _count_expansions(rule_map[rule.name], rule_map, slot_values, counts)
     else:
         # Unsupported
         assert False, rule.__class__
+
+    counts[count_key] = result
+    return result
+
+def _jsgf_sample_write(grammar_name, grammars, global_rule_map, slot_values,
+                       num_samples:int, sentences_path:str) -> int:
+    '''Writes (at most) num_samples unique sentences of a grammar to a text
+    file, chosen uniformly at random. Returns the number of sentences written.'''
+    rule_map = _grammar_rule_map(grammar_name, grammars, global_rule_map)
+
+    top_rule = rule_map[grammar_name]
+
+    # Same sentences every time for the same grammar
+    rng = random.Random(grammar_name)
+    slot_values = { name: sorted(values) for name, values in slot_values.items() }
+    counts:Dict[int, Tuple[int, int]] = {}
+
+    sentences:Set[Tuple[str, Any]] = set()
+    num_tries = 0
+    with open(sentences_path, 'w') as sentences_file:
+        while (len(sentences) < num_samples) and (num_tries < (10 * num_samples)):
+            sentence, tag, spans = _sample_expansion(top_rule, rule_map, slot_values,
+                                                     counts, rng)
+            num_tries += 1
+            if (sentence, spans) not in sentences:
+                sentences.add((sentence, spans))
+                print(_sentence_line(sentence, spans), file=sentences_file)
+
+    return len(sentences)
+
+def _sample_expansion(rule, rule_map, slot_values, counts, rng, tag=None) -> Tuple[str, Optional[str], Any]:
+    '''Chooses one expansion of a rule uniformly at random (same as
+    _make_tagged_sentences, with slot values substituted).'''
+    if isinstance(rule, Rule):
+        # Unpack
+        return _sample_expansion(rule.expansion, rule_map, slot_values, counts, rng)
+    elif isinstance(rule, Alternatives) \
+         or isinstance(rule, Group):
+        # (a | b | c) or (abc)
+        # Choose child weighted by its number of expansions
+        index = rng.randrange(_count_expansions(rule, rule_map, slot_values,
+                                                counts)[0])
+        for child in rule.children:
+            num_child = _count_expansions(child, rule_map, slot_values, counts)[0]
+            if index < num_child:
+                return _sample_expansion(child, rule_map, slot_values, counts, rng,
+                                         rule.tag or tag)
+
+            index -= num_child
+    elif isinstance(rule, Literal):
+        # a (with random slot values)
+        chunks = re.split(r'-([^-]+)-', rule.text)
+        for i, chunk in enumerate(chunks):
+            if ((i % 2) != 0) and (chunk in slot_values):
+                chunks[i] = rng.choice(slot_values[chunk])
+
+        return (''.join(chunks), rule.tag or tag, ())
+    elif isinstance(rule, OptionalGroup):
+        # [a]
+        num_child = _count_expansions(rule.child, rule_map, slot_values, counts)[0]
+        if rng.randrange(1 + num_child) == 0:
+            return ('', rule.tag or tag, ())
+
+        return _sample_expansion(rule.child, rule_map, slot_values, counts, rng,
+                                 rule.tag or tag)
+    elif isinstance(rule, Sequence):
+        # a b c
+        # Combinations where every word is empty aren't generated, so try again.
+        while True:
+            sentence, spans = _join_words([_sample_expansion(child, rule_map, slot_values,
+                                                             counts, rng)
+                                           for child in rule.children])
+            if len(sentence) > 0:
+                return (sentence, rule.tag, spans)
+    elif isinstance(rule, RuleRef):
+        # <OtherGrammar.otherRule>
+        return _sample_expansion(rule_map[rule.name], rule_map, slot_values, counts, rng)
+
+    # Unsupported
+    assert False, rule.__class__
+
 # -----------------------------------------------------------------------------
+# JSGF grammar for pocketsphinx
+#
+# Instead of a language model, pocketsphinx can search a grammar that only
+# accepts the sentences of sentences.ini (speech_to_text.pocketsphinx.search).
+# -----------------------------------------------------------------------------
+
+# Name of the public rule (sentences of all intents)
+_JSGF_TOP_RULE = 'sentences'
+
+def write_sentences_jsgf(profile:Profile, jsgf_path:str,
+                         sentence_casing:str,
+                         replace_patterns:List[Any],
+                         split_pattern:Any) -> Set[str]:
+    '''Compiles the grammars of sentences.ini into one JSGF grammar for
+    pocketsphinx, with slot values as rules. Words are cleaned up like the
+    words of training sentences (see sanitize_sentence). Returns the words of
+    the grammar.'''
+    ini_path = profile.read_path(profile.get('speech_to_text.sentences_ini'))
+    with open(ini_path, 'r') as ini_file:
+        grammar_rules = _grammar_rules(ini_file)
+
+    slot_values = JsgfSentenceGenerator.load_slots(
+        profile.read_paths(profile.get('speech_to_text.slots_dir')))
+
+    compiler = _JsgfCompiler(slot_values,
+                             sentence_casing, replace_patterns, split_pattern,
+                             profile.get('speech_to_text.dictionary_upper', False))
+
+    intent_names = [name for name, rules in grammar_rules.items()
+                    if _has_sentences(rules)]
+
+    rule_lines = []
+    for name, rules in grammar_rules.items():
+        grammar = parse_grammar(name, rules)
+        for rule in grammar.rules:
+            rule_lines.append('<%s> = %s;' % (compiler.rule_name(name, rule.name),
+                                              compiler.expression(rule.expansion, name)))
+
+    with open(jsgf_path, 'w') as jsgf_file:
+        print('#JSGF V1.0;', file=jsgf_file)
+        print('grammar %s;' % _JSGF_TOP_RULE, file=jsgf_file)
+        print('', file=jsgf_file)
+        print('public <%s> = (%s);' % (_JSGF_TOP_RULE,
+                                       ' | '.join('<%s>' % compiler.rule_name(name, name)
+                                                  for name in intent_names)),
+              file=jsgf_file)
+
+        for line in rule_lines:
+            print(line, file=jsgf_file)
+
+        for line in compiler.slot_lines():
+            print(line, file=jsgf_file)
+
+    return compiler.words
+
+class _JsgfCompiler:
+    '''Converts parsed rules of sentences.ini to JSGF that pocketsphinx can
+    load (no tags, no dotted rule names, and sanitized words).'''
+    def __init__(self, slot_values:Dict[str, List[str]],
+                 sentence_casing:str,
+                 replace_patterns:List[Any],
+                 split_pattern:Any,
+                 dictionary_upper:bool) -> None:
+        self.slot_values = slot_values
+        self.sentence_casing = sentence_casing
+        self.replace_patterns = [{ re.compile(pattern): repl
+                                   for pattern, repl in pattern_set.items() }
+                                 for pattern_set in replace_patterns]
+        self.split_pattern = re.compile(split_pattern)
+        self.dictionary_upper = dictionary_upper
+
+        # Grammar.rule (or -slot-) -> JSGF rule name
+        self.names:Dict[str, str] = {}
+        self.used_names:Set[str] = set([_JSGF_TOP_RULE])
+
+        # Slots referenced by rules
+        self.slots:List[str] = []
+
+        self.words:Set[str] = set()
+
+    def rule_name(self, grammar_name:str, rule_name:str) -> str:
+        if rule_name == grammar_name:
+            # Sentences of an intent
+            return self._jsgf_name(grammar_name, grammar_name)
+
+        return self._jsgf_name(f'{grammar_name}.{rule_name}', f'{grammar_name}_{rule_name}')
+
+    def _jsgf_name(self, name:str, readable_name:str) -> str:
+        jsgf_name = self.names.get(name)
+        if jsgf_name is None:
+            jsgf_name = re.sub(r'[^A-Za-z0-9_]', '_', readable_name)
+            while jsgf_name in self.used_names:
+                jsgf_name += '_'
+
+            self.names[name] = jsgf_name
+            self.used_names.add(jsgf_name)
+
+        return jsgf_name
+
+    def expression(self, expression:Any, grammar_name:str) -> str:
+        '''JSGF for an expression of a rule in a grammar (tags are dropped).'''
+        if isinstance(expression, Literal):
+            # Words with slot references (-name-)
+            items = []
+            chunks = re.split(r'-([^-]+)-', expression.text)
+            text = ''
+            for i, chunk in enumerate(chunks):
+                if ((i % 2) != 0) and (chunk in self.slot_values):
+                    items.extend(self._words(text))
+                    items.append('<%s>' % self._slot_name(chunk))
+                    text = ''
+                elif (i % 2) != 0:
+                    text += f'-{chunk}-'
+                else:
+                    text += chunk
+
+            items.extend(self._words(text))
+            return ' '.join(items) if items else '<NULL>'
+        elif isinstance(expression, Alternatives):
+            return '(%s)' % ' | '.join(self.expression(child, grammar_name)
+                                       for child in expression.children)
+        elif isinstance(expression, Group):
+            if (len(expression.children) == 1) and \
+               isinstance(expression.children[0], (Alternatives, Group)):
+                # Already in parentheses
+                return self.expression(expression.children[0], grammar_name)
+
+            return '(%s)' % ' '.join(self.expression(child, grammar_name)
+                                     for child in expression.children)
+        elif isinstance(expression, OptionalGroup):
+            return '[%s]' % self.expression(expression.child, grammar_name)
+        elif isinstance(expression, Sequence):
+            return ' '.join(self.expression(child, grammar_name)
+                            for child in expression.children)
+        elif isinstance(expression, RuleRef):
+            if '.' in expression.name:
+                # <OtherGrammar.otherRule>
+                ref_grammar, ref_rule = expression.name.split('.', maxsplit=1)
+                return '<%s>' % self.rule_name(ref_grammar, ref_rule)
+
+            return '<%s>' % self.rule_name(grammar_name, expression.name)
+
+        # Unsupported
+        assert False, expression.__class__
+
+    def slot_lines(self) -> List[str]:
+        '''JSGF rules with the values of referenced slots.'''
+        lines = []
+        for slot_name in self.slots:
+            values = set(' '.join(self._words(value))
+                         for value in self.slot_values[slot_name])
+            values.discard('')
+
+            lines.append('<%s> = %s;' % (self._slot_name(slot_name),
+                                         ' | '.join(sorted(values)) or '<VOID>'))
+
+        return lines
+
+    def _slot_name(self, slot_name:str) -> str:
+        if slot_name not in self.slots:
+            self.slots.append(slot_name)
+
+        return self._jsgf_name(f'-{slot_name}-', f'slot_{slot_name}')
+
+    def _words(self, text:str) -> List[str]:
+        _, tokens = sanitize_sentence(text, self.sentence_casing,
+                                      self.replace_patterns, self.split_pattern)
+
+        if self.dictionary_upper:
+            tokens = [token.upper() for token in tokens]
+        else:
+            tokens = [token.lower() for token in tokens]
+
+        self.words.update(tokens)
+        return tokens
@@ -0,0 +1,442 @@
+import os
+import copy
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import multiprocessing.util
+import concurrent.futures
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional, Iterator, Callable, Tuple, Set
+
+from thespian.actors import ActorAddress
+
+from .actor import RhasspyActor
+from .profiles import Profile
+
+# -----------------------------------------------------------------------------
+# Background training jobs.
+#
+# Trainers write into a staging directory inside of the profile instead of
+# over the files that the current actors are using. Staged files are moved
+# into the profile (os.replace) only when training has finished.
+# -----------------------------------------------------------------------------
+
+logger = logging.getLogger('training')
+
+class TrainingProgress:
+    '''Progress of one stage of a training job.'''
+    def __init__(self, stage:str, items:int=0,
+                 total:Optional[int]=None,
+                 seconds:Optional[float]=None,
+                 finished:bool=False) -> None:
+        self.stage = stage
+        self.items = items
+        self.total = total
+        self.seconds = seconds
+        self.finished = finished
+
+class StageProgress:
+    '''Items processed so far in a stage (see training_stage).'''
+    def __init__(self, total:Optional[int]=None) -> None:
+        self.items = 0
+        self.total = total
+
+@contextmanager
+def training_stage(actor:RhasspyActor, receiver:ActorAddress, stage:str,
+                   total:Optional[int]=None) -> Iterator[StageProgress]:
+    '''Times a training stage and reports its start and end to receiver.'''
+    progress = StageProgress(total)
+    actor.send(receiver, TrainingProgress(stage, total=total))
+    start_time = time.perf_counter()
+
+    yield progress
+
+    actor.send(receiver, TrainingProgress(stage, progress.items, progress.total,
+                                          seconds=time.perf_counter() - start_time,
+                                          finished=True))
+
+class StagedProfile(Profile):
+    '''Snapshot of a profile that writes into a staging directory.
+    Reads prefer staged files over the profile's own files.'''
+    def __init__(self, profile:Profile, staging_dir:str) -> None:
+        self.name = profile.name
+        self.profiles_dirs = profile.profiles_dirs
+        self.layers = profile.layers
+        self.json = copy.deepcopy(profile.json)
+        self.staging_dir = staging_dir
+
+    def read_path(self, *path_parts: str) -> str:
+        staged_path = os.path.join(self.staging_dir, *path_parts)
+        if os.path.exists(staged_path):
+            return staged_path
+
+        return Profile.read_path(self, *path_parts)
+
+    def read_paths(self, *path_parts: str) -> List[str]:
+        paths = Profile.read_paths(self, *path_parts)
+        staged_path = os.path.join(self.staging_dir, *path_parts)
+        if os.path.exists(staged_path):
+            paths.insert(0, staged_path)
+
+        return paths
+
+    def write_path(self, *path_parts: str) -> str:
+        full_path = os.path.join(self.staging_dir, *path_parts)
+        os.makedirs(os.path.split(full_path)[0], exist_ok=True)
+        return full_path
+
+    def write_dir(self, *dir_parts: str) -> str:
+        dir_path = os.path.join(self.staging_dir, *dir_parts)
+        os.makedirs(dir_path, exist_ok=True)
+        return dir_path
+
+# -----------------------------------------------------------------------------
+# Incremental training.
+#
+# Each stage keys its outputs (per intent, word, etc.) by a hash of the
+# stage's inputs. Outputs whose inputs haven't changed are reused from the
+# cache in .cache/training instead of being recomputed. When training in the
+# background, new cache entries are staged and committed with the rest of the
+# training files.
+# -----------------------------------------------------------------------------
+
+# Relative to the profile
+CACHE_DIR = os.path.join('.cache', 'training')
+
+# Training data passed between stages by reference (sentences, etc.).
+# Written to the staging directory of a job, but never committed.
+CORPUS_DIR = '.corpus'
+
+def content_hash(*values: Any) -> str:
+    '''SHA-256 of JSON-serializable values.'''
+    hasher = hashlib.sha256()
+    for value in values:
+        hasher.update(json.dumps(value, sort_keys=True, ensure_ascii=False).encode())
+        hasher.update(b'\0')
+
+    return hasher.hexdigest()
+
+# (path, size, modification time) -> SHA-256 of file contents
+_file_hashes:Dict[Any, str] = {}
+
+def file_hash(path:str) -> str:
+    '''SHA-256 of a file's contents (empty if file doesn't exist).
+    Only re-hashes a file if its size or modification time changed.'''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return ''
+
+    stat_key = (path, stat.st_size, stat.st_mtime_ns)
+    digest = _file_hashes.get(stat_key, None)
+    if digest is None:
+        hasher = hashlib.sha256()
+        with open(path, 'rb') as hash_file:
+            for chunk in iter(lambda: hash_file.read(1024 * 1024), b''):
+                hasher.update(chunk)
+
+        digest = hasher.hexdigest()
+        _file_hashes[stat_key] = digest
+
+    return digest
+
+def tokenizer_settings(profile:Profile) -> List[Any]:
+    '''Settings that change how tagged sentences are split into words.'''
+    tokenizer = profile.get('training.tokenizer', 'regex')
+    return [profile.get('training.sentences.case', None),
+            tokenizer, profile.get(f'training.{tokenizer}', {})]
+
+class TrainingCache:
+    '''Outputs of one training stage keyed by a hash of their inputs.
+    Entries that aren't used in a training run are dropped when saved.'''
+    def __init__(self, profile:Profile, stage:str) -> None:
+        self.profile = profile
+        self.stage = stage
+        self.enabled = profile.get('training.cache', True)
+        self.cache_dir = CACHE_DIR
+
+        # name -> { key, value }
+        self.entries:Dict[str, Dict[str, Any]] = {}
+        self.used:Dict[str, Dict[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+
+        if self.enabled:
+            entries_path = profile.read_path(self.cache_dir, f'{stage}.json')
+            if os.path.exists(entries_path):
+                try:
+                    with open(entries_path, 'r') as entries_file:
+                        self.entries = json.load(entries_file)
+                except Exception:
+                    logger.exception('Failed to load training cache %s', entries_path)
+
+    def get(self, name:str, key:str) -> Optional[Any]:
+        '''Returns the cached value for name if its key matches.'''
+        entry = self.entries.get(name, None)
+        if (entry is None) or (entry['key'] != key) or (entry['value'] is None):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.used[name] = entry
+        return entry['value']
+
+    def put(self, name:str, key:str, value:Any) -> None:
+        if self.enabled:
+            self.used[name] = { 'key': key, 'value': value }
+
+    def get_path(self, name:str, key:str) -> Optional[str]:
+        '''Returns the path of the cached file for name if its key matches.'''
+        if self.get(name, key) is None:
+            return None
+
+        cached_path = self.profile.read_path(self.cache_dir, self.stage, name)
+        if not os.path.exists(cached_path):
+            self.hits -= 1
+            self.misses += 1
+            del self.used[name]
+            return None
+
+        return cached_path
+
+    def get_file(self, name:str, key:str, dest_path:str) -> Optional[Any]:
+        '''Copies the cached file for name to dest_path if its key matches.
+        Returns the cached value or None.'''
+        cached_path = self.get_path(name, key)
+        if cached_path is None:
+            return None
+
+        shutil.copyfile(cached_path, dest_path)
+        return self.used[name]['value']
+
+    def put_file(self, name:str, key:str, src_path:str, value:Any=True) -> None:
+        '''Caches a copy of src_path for name.'''
+        if self.enabled:
+            shutil.copyfile(src_path,
+                            self.profile.write_path(self.cache_dir, self.stage, name))
+            self.put(name, key, value)
+
+    def save(self) -> None:
+        if not self.enabled:
+            return
+
+        entries_path = self.profile.write_path(self.cache_dir, f'{self.stage}.json')
+        with open(entries_path, 'w') as entries_file:
+            json.dump(self.used, entries_file)
+
+        logger.debug('%s: reused %s, recomputed %s', self.stage, self.hits, self.misses)
+
+# -----------------------------------------------------------------------------
+
+class TrainingJob:
+    '''One run of the training pipeline against a snapshot of the profile.'''
+    def __init__(self, profile:Profile,
+                 receiver:Optional[ActorAddress]=None) -> None:
+        self.id = str(uuid.uuid4())
+        self.live_profile = profile
+        self.staging_dir = profile.write_dir('.training', self.id)
+        self.profile = StagedProfile(profile, self.staging_dir)
+        self.receiver = receiver
+
+        self.status = 'running'
+        self.stage = ''
+        self.error = ''
+        self.start_time = time.time()
+        self.end_time:Optional[float] = None
+
+        # stage name -> status, items, total, seconds (in order)
+        self.stages:Dict[str, Dict[str, Any]] = {}
+        self.stage_start:Dict[str, float] = {}
+
+        # Branches of the training graph that are still running, and the
+        # errors of the ones that failed. Intent training starts as soon as
+        # sentences are grouped and runs alongside the rest of speech
+        # training, so the job is only done when every branch has finished.
+        self.branches:Set[str] = set()
+        self.branch_errors:List[str] = []
+
+    def update_stage(self, stage:str, items:int=0,
+                     total:Optional[int]=None,
+                     seconds:Optional[float]=None,
+                     finished:bool=False) -> None:
+        '''Records progress of a stage. Starts the stage if it's new.'''
+        if stage not in self.stages:
+            self.stages[stage] = { 'status': 'running', 'items': 0,
+                                   'total': None, 'seconds': None }
+            self.stage_start[stage] = time.time()
+
+        self.stage = stage
+        info = self.stages[stage]
+        info['items'] = items
+        if total is not None:
+            info['total'] = total
+
+        if finished:
+            info['status'] = 'done'
+            info['seconds'] = seconds if seconds is not None \
+                else (time.time() - self.stage_start[stage])
+
+    def start_branch(self, branch:str) -> None:
+        self.branches.add(branch)
+
+    def finish_branch(self, branch:str, error:str='') -> bool:
+        '''Records the end of a branch. True if no other branch is running.'''
+        self.branches.discard(branch)
+        if len(error) > 0:
+            self.branch_errors.append(error)
+
+        return len(self.branches) == 0
+
+    def stages_json(self) -> List[Dict[str, Any]]:
+        stages = []
+        for stage, info in self.stages.items():
+            info = dict(info)
+            if info['status'] == 'done':
+                info['progress'] = 1.0
+            else:
+                info['seconds'] = time.time() - self.stage_start[stage]
+                total = info['total']
+                info['progress'] = (info['items'] / total) if total else 0.0
+
+            info['name'] = stage
+            stages.append(info)
+
+        return stages
+
+    def commit(self, paths:Optional[List[str]]=None) -> List[str]:
+        '''Moves staged files (all or paths relative to the profile) into
+        the profile. Returns the paths of the committed files.'''
+        if paths is None:
+            paths = []
+            for dir_path, dir_names, file_names in os.walk(self.staging_dir):
+                if dir_path == self.staging_dir:
+                    dir_names[:] = [name for name in dir_names if name != CORPUS_DIR]
+
+                for file_name in file_names:
+                    paths.append(os.path.relpath(os.path.join(dir_path, file_name),
+                                                 self.staging_dir))
+
+        committed = []
+        for rel_path in paths:
+            staged_path = os.path.join(self.staging_dir, rel_path)
+            if not os.path.exists(staged_path):
+                continue
+
+            # Atomic on the same file system
+            live_path = self.live_profile.write_path(rel_path)
+            os.replace(staged_path, live_path)
+            committed.append(live_path)
+
+        logger.debug('Committed %s file(s) from %s', len(committed), self.staging_dir)
+
+        return committed
+
+    def discard(self) -> None:
+        '''Deletes the staging directory.'''
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+        try:
+            # Remove .training if no other jobs are staged
+            os.rmdir(os.path.dirname(self.staging_dir))
+        except OSError:
+            pass
+
+    def finish(self, error:str='') -> None:
+        self.discard()
+        self.error = error
+        self.status = 'failed' if len(error) > 0 else 'complete'
+        self.end_time = time.time()
+
+    def json(self) -> Dict[str, Any]:
+        end_time = self.end_time or time.time()
+        return {
+            'id': self.id,
+            'status': self.status,
+            'stage': self.stage,
+            'error': self.error,
+            'started': self.start_time,
+            'seconds': end_time - self.start_time,
+            'stages': self.stages_json()
+        }
+
+# -----------------------------------------------------------------------------
+# Worker pool.
+#
+# Training work is split into tasks that run in a pool of processes. The pool
+# is kept between training runs, so workers only start once (per actor
+# process) and can keep state from one task to the next.
+# -----------------------------------------------------------------------------
+
+_pool:Optional[concurrent.futures.ProcessPoolExecutor] = None
+_pool_workers = 0
+
+def training_workers(profile:Profile) -> int:
+    '''Number of processes for training (training.workers, 0 for one per CPU).'''
+    workers = int(profile.get('training.workers', 0))
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+
+    return workers
+
+def run_tasks(workers:int,
+              tasks:List[Tuple[Callable[..., Any], Tuple[Any, ...]]]) -> Iterator[Tuple[int, Any]]:
+    '''Runs (function, arguments) tasks in the worker pool (or in this
+    process for one worker). Functions must be defined at module level.
+    Yields the index of each task and its result as tasks finish.'''
+    if (workers <= 1) or (len(tasks) <= 1):
+        for index, (function, args) in enumerate(tasks):
+            yield (index, function(*args))
+
+        return
+
+    global _pool
+    pool = _start_pool(workers)
+
+    try:
+        future_to_index = { pool.submit(function, *args): index
+                            for index, (function, args) in enumerate(tasks) }
+
+        for future in concurrent.futures.as_completed(future_to_index):
+            yield (future_to_index[future], future.result())
+    except concurrent.futures.process.BrokenProcessPool:
+        # Start a new pool next time
+        _pool = None
+        raise
+
+def submit_task(workers:int,
+                function:Callable[..., Any],
+                *args: Any) -> concurrent.futures.Future:
+    '''Starts function(*args) in the worker pool, even for one worker, so the
+    caller can keep handling messages. Check the returned future for the
+    result.'''
+    global _pool
+    pool = _start_pool(workers)
+
+    try:
+        return pool.submit(function, *args)
+    except concurrent.futures.process.BrokenProcessPool:
+        # Start a new pool next time
+        _pool = None
+        raise
+
+def _start_pool(workers:int) -> concurrent.futures.ProcessPoolExecutor:
+    global _pool, _pool_workers
+    if (_pool is None) or (_pool_workers != workers):
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+
+        logger.debug('Starting %s training worker(s)', workers)
+        _pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        _pool_workers = workers
+
+        # Actors run in multiprocessing children, which wait for their own
+        # children to exit. Workers are stopped before that (and before the
+        # queues of the pool are closed).
+        multiprocessing.util.Finalize(None, _pool.shutdown,
+                                      kwargs={ 'cancel_futures': True },
+                                      exitpriority=100)
+
+    return _pool
@@ -6,13 +6,16 @@ import logging
 import math
 import itertools
 import json
+import mmap
+import struct
 import collections
+import collections.abc
 from collections import defaultdict
-import concurrent.futures
+from array import array
 import threading
 import tempfile
 import subprocess
-from typing import Dict, List, Iterable, Optional, Any, Mapping, Tuple
+from typing import Dict, List, Iterable, Iterator, Optional, Any, Mapping, Tuple, Pattern
 
 # -----------------------------------------------------------------------------
 
@@ -51,6 +54,254 @@ class TrainingSentence:
             'tokens': self.tokens
         }
 
+    @classmethod
+    def from_json(cls, sentence_dict: Dict[str, Any]) -> 'TrainingSentence':
+        return TrainingSentence(sentence_dict['sentence'],
+                                [SentenceEntity(**e) for e in sentence_dict['entities']],
+                                sentence_dict['tokens'])
+
+class SentenceStore(collections.abc.Mapping):
+    '''Training sentences of all intents, stored in flat columns.
+
+    Words and entities are interned, so each sentence is a few items in
+    typed arrays instead of a TrainingSentence, a list of tokens, and a list
+    of SentenceEntity objects. Maps intent names to sequences of views that
+    have the same attributes as TrainingSentence.'''
+    def __init__(self) -> None:
+        # word id -> word
+        self.words:List[str] = []
+        self.word_ids:Dict[str, int] = {}
+
+        # entity id -> (entity name, value, text)
+        self.entity_table:List[Tuple[str, str, str]] = []
+        self.entity_table_ids:Dict[Tuple[str, str, str], int] = {}
+
+        # Sentence i is text[text_offsets[i]:text_offsets[i + 1]] (UTF-8)
+        self.text = bytearray()
+        self.text_offsets = array('Q', [0])
+
+        # Sentence i has tokens token_ids[token_offsets[i]:token_offsets[i + 1]]
+        self.token_ids = array('I')
+        self.token_offsets = array('Q', [0])
+
+        # Sentence i has entities entity_offsets[i]:entity_offsets[i + 1]
+        self.entity_offsets = array('Q', [0])
+        self.entity_ids = array('I')
+        self.entity_starts = array('i')
+        self.entity_ends = array('i')
+
+        # intent name -> [first sentence, last sentence + 1]
+        self.intents:Dict[str, List[int]] = {}
+        self._intent_range:List[int] = []
+
+    def add_intent(self, intent_name:str) -> None:
+        '''Starts the sentences of an intent. Sentences are added with add.'''
+        if intent_name in self.intents:
+            raise ValueError(f'Intent {intent_name} was already added')
+
+        index = self.num_sentences
+        self._intent_range = [index, index]
+        self.intents[intent_name] = self._intent_range
+
+    def add(self, sentence:str,
+            entities:List[SentenceEntity],
+            tokens:List[str]) -> None:
+        '''Adds a sentence to the last intent (see add_intent).'''
+        if len(self.intents) == 0:
+            raise ValueError('No intent was added')
+
+        self.text += sentence.encode()
+        self.text_offsets.append(len(self.text))
+
+        word_ids = [self.word_ids.get(token) for token in tokens]
+        if None in word_ids:
+            word_ids = [self._word_id(token) for token in tokens]
+
+        self.token_ids.extend(word_ids)
+        self.token_offsets.append(len(self.token_ids))
+
+        for entity in entities:
+            self.entity_ids.append(self._entity_id((entity.entity, entity.value, entity.text)))
+            self.entity_starts.append(entity.start)
+            self.entity_ends.append(entity.end)
+
+        self.entity_offsets.append(len(self.entity_ids))
+        self._intent_range[1] += 1
+
+    def add_json(self, sentence_dict: Dict[str, Any]) -> None:
+        '''Adds a sentence from TrainingSentence.json.'''
+        self.add(sentence_dict['sentence'],
+                 [SentenceEntity(**e) for e in sentence_dict['entities']],
+                 sentence_dict['tokens'])
+
+    def _word_id(self, word:str) -> int:
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            word_id = self.word_ids[word] = len(self.words)
+            self.words.append(word)
+
+        return word_id
+
+    def _entity_id(self, entity:Tuple[str, str, str]) -> int:
+        entity_id = self.entity_table_ids.get(entity)
+        if entity_id is None:
+            entity_id = self.entity_table_ids[entity] = len(self.entity_table)
+            self.entity_table.append(entity)
+
+        return entity_id
+
+    # -------------------------------------------------------------------------
+
+    # Columns written by save (in order)
+    COLUMNS = ['text', 'text_offsets', 'token_ids', 'token_offsets',
+               'entity_offsets', 'entity_ids', 'entity_starts', 'entity_ends']
+
+    def save(self, path:str) -> None:
+        '''Writes the store to a file that can be mapped into memory (see load).
+        Format is the size of a JSON header, the header, and the columns
+        (aligned to 8 bytes).'''
+        columns = [getattr(self, name) for name in SentenceStore.COLUMNS]
+        header = json.dumps({
+            'words': self.words,
+            'entity_table': self.entity_table,
+            'intents': self.intents,
+            'columns': [[name, _typecode(column), len(column)]
+                        for name, column in zip(SentenceStore.COLUMNS, columns)]
+        }).encode()
+
+        with open(path, 'wb') as store_file:
+            store_file.write(struct.pack('<Q', len(header)))
+            store_file.write(header)
+            for column in columns:
+                store_file.write(bytes(-store_file.tell() % 8))
+                store_file.write(column)
+
+    @classmethod
+    def load(cls, path:str) -> 'SentenceStore':
+        '''Maps a store written by save into memory. Columns are read-only
+        views of the file, so sentences can't be added.'''
+        with open(path, 'rb') as store_file:
+            data = memoryview(mmap.mmap(store_file.fileno(), 0,
+                                        access=mmap.ACCESS_READ))
+
+        header_size = struct.unpack_from('<Q', data)[0]
+        header = json.loads(str(data[8:8 + header_size], 'utf-8'))
+
+        store = cls()
+        store.words = header['words']
+        store.word_ids = { word: word_id for word_id, word in enumerate(store.words) }
+        store.entity_table = [tuple(entity) for entity in header['entity_table']]
+        store.intents = header['intents']
+
+        offset = 8 + header_size
+        for name, typecode, length in header['columns']:
+            offset += -offset % 8
+            size = length * array(typecode).itemsize
+            setattr(store, name, data[offset:offset + size].cast(typecode))
+            offset += size
+
+        return store
+
+    def sentence(self, index:int) -> str:
+        return str(self.text[self.text_offsets[index]:self.text_offsets[index + 1]], 'utf-8')
+
+    def tokens(self, index:int) -> List[str]:
+        words = self.words
+        return [words[word_id] for word_id
+                in self.token_ids[self.token_offsets[index]:self.token_offsets[index + 1]]]
+
+    def entities(self, index:int) -> List[SentenceEntity]:
+        table = self.entity_table
+        return [SentenceEntity(*table[self.entity_ids[i]],
+                               self.entity_starts[i],
+                               self.entity_ends[i])
+                for i in range(self.entity_offsets[index], self.entity_offsets[index + 1])]
+
+    @property
+    def num_sentences(self) -> int:
+        return len(self.text_offsets) - 1
+
+    def __len__(self) -> int:
+        return len(self.intents)
+
+    def __getitem__(self, intent_name:str) -> 'IntentSentences':
+        start, end = self.intents[intent_name]
+        return IntentSentences(self, start, end)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.intents)
+
+def _typecode(column:Any) -> str:
+    if isinstance(column, array):
+        return column.typecode
+    elif isinstance(column, memoryview):
+        return column.format
+
+    return 'B'  # bytearray
+
+class IntentSentences(collections.abc.Sequence):
+    '''Sentences of one intent in a SentenceStore'''
+    __slots__ = ('store', 'start', 'end')
+
+    def __init__(self, store:SentenceStore, start:int, end:int) -> None:
+        self.store = store
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, index:int) -> 'StoredSentence':
+        if index < 0:
+            index += len(self)
+
+        if not (0 <= index < len(self)):
+            raise IndexError(index)
+
+        return StoredSentence(self.store, self.start + index)
+
+    def __iter__(self) -> Iterator['StoredSentence']:
+        for index in range(self.start, self.end):
+            yield StoredSentence(self.store, index)
+
+    def texts(self) -> Iterator[str]:
+        '''Sanitized text of each sentence'''
+        text, offsets = self.store.text, self.store.text_offsets
+        for index in range(self.start, self.end):
+            yield str(text[offsets[index]:offsets[index + 1]], 'utf-8')
+
+class StoredSentence:
+    '''View of one sentence in a SentenceStore (same as TrainingSentence)'''
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store:SentenceStore, index:int) -> None:
+        self.store = store
+        self.index = index
+
+    @property
+    def sentence(self) -> str:
+        return self.store.sentence(self.index)
+
+    @property
+    def entities(self) -> List[SentenceEntity]:
+        return self.store.entities(self.index)
+
+    @property
+    def tokens(self) -> List[str]:
+        return self.store.tokens(self.index)
+
+    @property
+    def token_ids(self) -> array:
+        store = self.store
+        return store.token_ids[store.token_offsets[self.index]:store.token_offsets[self.index + 1]]
+
+    def json(self):
+        return {
+            'sentence': self.sentence,
+            'entities': [e.__dict__ for e in self.entities],
+            'tokens': self.tokens
+        }
+
 # -----------------------------------------------------------------------------
 
 def read_dict(dict_file: Iterable[str],
@@ -98,13 +349,17 @@ def recursive_update(base_dict: Dict[Any, Any],
                      new_dict: Mapping[Any, Any]) -> None:
     '''Recursively overwrites values in base dictionary with values from new dictionary'''
     for k, v in new_dict.items():
-        if isinstance(v, collections.Mapping) and (k in base_dict):
+        if isinstance(v, collections.abc.Mapping) and (k in base_dict):
             recursive_update(base_dict[k], v)
         else:
             base_dict[k] = v
 
 # -----------------------------------------------------------------------------
 
+# Sentence text without tags and (start, end, tag) of each tagged span.
+# Nested spans come before the spans that contain them.
+SentenceSpans = Tuple[str, List[Tuple[int, int, str]]]
+
 def extract_entities(phrase: str) -> Tuple[str, List[SentenceEntity]]:
     '''Extracts embedded entity markings from a phrase.
     Returns the phrase with entities removed and a list of entities.
@@ -114,15 +369,34 @@ def extract_entities(phrase: str) -> Tuple[str, List[SentenceEntity]]:
     If the synonym format [some text](entity name:something else) is used, then
     "something else" will be substituted for "some text".
     '''
-    entities = []
+    phrase, spans = extract_spans(phrase)
+    return phrase, span_entities(phrase, spans)
+
+def extract_spans(phrase: str) -> SentenceSpans:
+    '''Removes entity markings ([some text](entity name)) from a phrase.
+    Returns the phrase with markings removed and the tag of each marked span.'''
+    spans = []
     removed_chars = 0
 
     def match(m) -> str:
         nonlocal removed_chars
         value, entity = m.group(1), m.group(2)
-        replacement = value
         start = m.start(0) - removed_chars
         removed_chars += 1 + len(entity) + 3  # 1 for [, 3 for ], (, and )
+        spans.append((start, start + len(value), entity))
+        return value
+
+    # [text](entity label) => text
+    phrase = re.sub(r'\[([^]]+)\]\(([^)]+)\)', match, phrase)
+
+    return phrase, spans
+
+def span_entities(phrase: str, spans: List[Tuple[int, int, str]]) -> List[SentenceEntity]:
+    '''Creates entities from tagged spans of a phrase (see extract_spans).'''
+    entities = []
+    for start, end, entity in spans:
+        value = phrase[start:end]
+        replacement = value
 
         # Replace value with entity synonym, if present.
         entity_parts = entity.split(':', maxsplit=1)
@@ -130,14 +404,9 @@ def extract_entities(phrase: str) -> Tuple[str, List[SentenceEntity]]:
             entity = entity_parts[0]
             value = entity_parts[1]
 
-        end = m.end(0) - removed_chars
         entities.append(SentenceEntity(entity, value, replacement, start, end))
-        return replacement
 
-    # [text](entity label) => text
-    phrase = re.sub(r'\[([^]]+)\]\(([^)]+)\)', match, phrase)
-
-    return phrase, entities
+    return entities
 
 # -----------------------------------------------------------------------------
 
@@ -251,12 +520,50 @@ class ByteStream:
 
 # -----------------------------------------------------------------------------
 
+def get_process_stats(pid: int) -> Optional[Dict[str, Any]]:
+    '''Reads memory (RSS, PSS, USS) and CPU time for a process from /proc.
+    Returns None if the process doesn't exist.'''
+    proc_dir = os.path.join('/proc', str(pid))
+    stats:Dict[str, Any] = { 'pid': pid }
+
+    try:
+        # smaps_rollup is only available on Linux 4.14+
+        smaps_path = os.path.join(proc_dir, 'smaps_rollup')
+        if not os.path.exists(smaps_path):
+            smaps_path = os.path.join(proc_dir, 'smaps')
+
+        # field -> kB
+        smaps:Dict[str, int] = defaultdict(int)
+        with open(smaps_path, 'r') as smaps_file:
+            for line in smaps_file:
+                parts = line.split()
+                if (len(parts) == 3) and (parts[2] == 'kB'):
+                    smaps[parts[0].rstrip(':')] += int(parts[1])
+
+        stats['rss_bytes'] = smaps['Rss'] * 1024
+        stats['pss_bytes'] = smaps['Pss'] * 1024
+        stats['uss_bytes'] = (smaps['Private_Clean'] + smaps['Private_Dirty']) * 1024
+
+        # utime and stime are fields 14 and 15 (after the command name)
+        with open(os.path.join(proc_dir, 'stat'), 'r') as stat_file:
+            fields = stat_file.read().rsplit(')', maxsplit=1)[1].split()
+
+        ticks = os.sysconf('SC_CLK_TCK')
+        stats['cpu_sec'] = (int(fields[11]) + int(fields[12])) / ticks
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return None
+
+    return stats
+
+# -----------------------------------------------------------------------------
+
 def sanitize_sentence(sentence:str,
                       sentence_casing:str,
                       replace_patterns:List[Any],
                       split_pattern:Any) -> Tuple[str, List[str]]:
     '''Applies profile-specific casing and tokenization to a sentence.
-    Returns the sanitized sentence and tokens.'''
+    Returns the sanitized sentence and tokens.
+    Patterns may be strings or compiled with re.compile.'''
 
     if sentence_casing == 'lower':
         sentence = sentence.lower()
@@ -266,41 +573,51 @@ def sanitize_sentence(sentence:str,
     # Process replacement patterns
     for pattern_set in replace_patterns:
         for pattern, repl in pattern_set.items():
-            sentence = re.sub(pattern, repl, sentence)
+            sentence = _compiled(pattern).sub(repl, sentence)
 
     # Tokenize
-    tokens = [t for t in re.split(split_pattern, sentence)
+    tokens = [t for t in _compiled(split_pattern).split(sentence)
               if len(t.strip()) > 0]
 
     return sentence, tokens
 
-# -----------------------------------------------------------------------------
-
-def group_sentences_by_intent(tagged_sentences: Dict[str, List[str]],
-                              *sanitize_args) -> Dict[str, List[TrainingSentence]]:
-    sentences_by_intent:Dict[str, List[TrainingSentence]] = defaultdict(list)
+def _compiled(pattern:Any) -> Pattern:
+    if isinstance(pattern, str):
+        return re.compile(pattern)
 
-    # Extract entities from tagged sentences
-    with concurrent.futures.ProcessPoolExecutor() as executor:
-        future_to_name = { executor.submit(_process_intent_sentences, intent_sents,
-                                           sanitize_args) : intent_name
-                            for intent_name, intent_sents in tagged_sentences.items() }
-        # Add to the list as they get done
-        for future in concurrent.futures.as_completed(future_to_name):
-            intent_name = future_to_name[future]
-            sentences_by_intent[intent_name] = future.result()
+    return pattern
 
-    return sentences_by_intent
+# -----------------------------------------------------------------------------
 
-def _process_intent_sentences(intent_sents, sanitize_args):
-    training_sents = []
-    for intent_sent in intent_sents:
-        # Template -> untagged sentence + entities
-        sentence, entities = extract_entities(intent_sent)
+def group_sentences_by_intent(sentence_spans: Dict[str, List[SentenceSpans]],
+                              *sanitize_args) -> 'SentenceStore':
+    '''Creates training sentences from untagged sentences and their tag spans.
+    No tags are parsed, so this is done in one process.'''
+    store = SentenceStore()
+    for intent_name, intent_sents in sentence_spans.items():
+        make_training_sentences(store, intent_name, intent_sents, *sanitize_args)
+
+    return store
+
+def make_training_sentences(store: 'SentenceStore',
+                            intent_name: str,
+                            intent_sents: Iterable[SentenceSpans],
+                            sentence_casing:str,
+                            replace_patterns:List[Any],
+                            split_pattern:Any) -> None:
+    '''Adds the training sentences of an intent to a sentence store.'''
+    # Compile patterns once for all sentences
+    replace_patterns = [{ re.compile(pattern): repl
+                          for pattern, repl in pattern_set.items() }
+                        for pattern_set in replace_patterns]
+
+    split_pattern = re.compile(split_pattern)
+
+    store.add_intent(intent_name)
+    for sentence, spans in intent_sents:
+        entities = span_entities(sentence, spans) if len(spans) > 0 else []
 
         # Split sentence into words (tokens)
-        sentence, tokens = sanitize_sentence(sentence, *sanitize_args)
-        training_sents.append(
-            TrainingSentence(sentence, entities, tokens))
-
-    return training_sents
+        sentence, tokens = sanitize_sentence(sentence, sentence_casing,
+                                             replace_patterns, split_pattern)
+        store.add(sentence, entities, tokens)
@@ -7,7 +7,7 @@ import re
 import time
 import subprocess
 from uuid import uuid4
-from typing import Optional, Any, List, Dict
+from typing import Optional, Any, List, Dict, Callable
 
 from thespian.actors import ActorAddress
 
@@ -146,9 +146,24 @@ class PocketsphinxWakeListener(RhasspyActor):
 
     # -------------------------------------------------------------------------
 
+    def get_models(self) -> Dict[str, Callable[[], None]]:
+        return { 'decoder': self.load_decoder }
+
     def load_decoder(self) -> None:
         '''Loads speech decoder if not cached.'''
         if self.decoder is None:
+            self.threshold = float(self.profile.get('wake.pocketsphinx.threshold', 1e-40))
+            self.keyphrase = self.profile.get('wake.pocketsphinx.keyphrase', '')
+            assert len(self.keyphrase) > 0, 'No wake keyphrase'
+
+            if self.profile.get('speech_to_text.pocketsphinx.shared_decoder', False):
+                # Same decoder as speech to text (keyphrase search)
+                from .stt import SharedPocketsphinx
+                shared = SharedPocketsphinx.get(self.profile)
+                self.decoder = shared.search(SharedPocketsphinx.WAKE_SEARCH)
+                self.decoder_started = False
+                return
+
             import pocketsphinx
 
             # Load decoder settings (use speech-to-text configuration as a fallback)
@@ -160,10 +175,6 @@ class PocketsphinxWakeListener(RhasspyActor):
                 self.profile.get('wake.pocketsphinx.dictionary', None) \
                 or self.profile.get('speech_to_text.pocketsphinx.dictionary'))
 
-            self.threshold = float(self.profile.get('wake.pocketsphinx.threshold', 1e-40))
-            self.keyphrase = self.profile.get('wake.pocketsphinx.keyphrase', '')
-            assert len(self.keyphrase) > 0, 'No wake keyphrase'
-
             # Verify that keyphrase words are in dictionary
             keyphrase_words = re.split(r'\s+', self.keyphrase)
             with open(dict_path, 'r') as dict_file:
@@ -279,6 +290,9 @@ class SnowboyWakeListener(RhasspyActor):
 
     # -------------------------------------------------------------------------
 
+    def get_models(self) -> Dict[str, Callable[[], None]]:
+        return { 'detector': self.load_detector }
+
     def load_detector(self) -> None:
         if self.detector is None:
             from snowboy import snowboydetect, snowboydecoder
@@ -387,6 +401,9 @@ class PreciseWakeListener(RhasspyActor):
 
     # -------------------------------------------------------------------------
 
+    def get_models(self) -> Dict[str, Callable[[], None]]:
+        return { 'runner': self.load_runner }
+
     def load_runner(self) -> None:
         if self.engine is None:
             from precise_runner import PreciseEngine
@@ -1,7 +1,15 @@
 import tempfile
 import unittest
 
+from thespian.actors import ActorAddress
+
 from rhasspy.core import RhasspyCore
+from rhasspy.audio_recorder import AudioData
+from rhasspy.command_listener import VoiceCommand
+from rhasspy.stt import (PocketsphinxDecoder, TranscribeWav, WavTranscription,
+                         StartTranscribing, StopTranscribing,
+                         PartialTranscription, TranscribingFailed)
+from rhasspy.streaming import StreamingSession
 
 class RhasspyTestCase(unittest.TestCase):
     def setUp(self):
@@ -79,6 +87,131 @@ class RhasspyTestCase(unittest.TestCase):
         assert 'R AE K S AH K AO R IY K OW F AE L AH P AH T AO R IY IH S' in pronunciations
 
 
+# -----------------------------------------------------------------------------
+# Actors without an actor system
+# -----------------------------------------------------------------------------
+
+def harness(actor_class, state, **attributes):
+    '''Creates an actor in a state that keeps the messages it sends in
+    actor.sent instead of sending them.'''
+    class Harness(actor_class):
+        myAddress = ActorAddress('harness')
+
+        def send(self, address, message):
+            self.sent.append((address, message))
+
+    actor = Harness()
+    actor.sent = []
+    actor.__dict__.update(attributes)
+    actor.transition(state)
+
+    return actor
+
+class FakeDecoder:
+    '''Stands in for pocketsphinx.Decoder (hypothesis is the audio so far).'''
+    def __init__(self):
+        self.text = None
+
+    def start_utt(self):
+        self.text = ''
+
+    def process_raw(self, data, no_search, full_utt):
+        self.text += data.decode()
+
+    def end_utt(self):
+        pass
+
+    def hyp(self):
+        return FakeHypothesis(self.text)
+
+class FakeHypothesis:
+    def __init__(self, hypstr):
+        self.hypstr = hypstr
+
+class StreamingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.first = ActorAddress('first')
+        self.second = ActorAddress('second')
+
+    def test_decoder_owner(self):
+        '''Only the session that started a stream can feed and end it'''
+        decoder = harness(PocketsphinxDecoder, 'loaded', decoder=FakeDecoder())
+        decoder.receiveMessage(StartTranscribing(), self.first)
+        decoder.receiveMessage(StartTranscribing(), self.second)
+        decoder.receiveMessage(AudioData(b'turn on'), self.first)
+        decoder.receiveMessage(AudioData(b'what time'), self.second)
+        decoder.receiveMessage(StopTranscribing(), self.second)
+        self.assertEqual(decoder._state, 'streaming')
+
+        decoder.receiveMessage(StopTranscribing(), self.first)
+        self.assertEqual([(address, message.text) for address, message in decoder.sent],
+                         [(self.first, 'turn on'), (self.first, 'turn on')])
+        self.assertIsInstance(decoder.sent[-1][1], WavTranscription)
+
+        # Queued stream starts once the first is done
+        self.assertEqual(decoder._state, 'streaming')
+        decoder.sent = []
+        decoder.receiveMessage(AudioData(b'what time'), self.second)
+        decoder.receiveMessage(StopTranscribing(), self.second)
+        self.assertEqual([(address, message.text) for address, message in decoder.sent],
+                         [(self.second, 'what time'), (self.second, 'what time')])
+        self.assertEqual(decoder._state, 'loaded')
+
+    def test_decoder_queues_wav(self):
+        '''WAV transcriptions wait for the current stream'''
+        decoder = harness(PocketsphinxDecoder, 'loaded', decoder=FakeDecoder())
+        decoder.transcribe_wav = lambda wav_data: 'from wav'
+        decoder.receiveMessage(StartTranscribing(), self.first)
+        decoder.receiveMessage(TranscribeWav(b''), self.second)
+        self.assertEqual(decoder.sent, [])
+
+        decoder.receiveMessage(StopTranscribing(), self.first)
+        self.assertEqual([(address, message.text) for address, message in decoder.sent],
+                         [(self.first, ''), (self.second, 'from wav')])
+
+    def test_decoder_start_failed(self):
+        '''Receiver is told when a stream can't be decoded'''
+        decoder = harness(PocketsphinxDecoder, 'loaded')
+
+        def load_decoder():
+            raise Exception('no acoustic model')
+
+        decoder.load_decoder = load_decoder
+        decoder.receiveMessage(StartTranscribing(), self.first)
+        self.assertEqual(decoder._state, 'loaded')
+        self.assertEqual(len(decoder.sent), 1)
+        self.assertEqual(decoder.sent[0][0], self.first)
+        self.assertIsInstance(decoder.sent[0][1], TranscribingFailed)
+
+    def session(self, state):
+        return harness(StreamingSession, state,
+                       receiver=self.first, decoder=self.second,
+                       command=ActorAddress('command'), handle=False,
+                       audio=b'', decoder_streaming=True)
+
+    def test_session_fallback(self):
+        '''Session transcribes the whole command if streaming fails'''
+        session = self.session('listening')
+        session.receiveMessage(TranscribingFailed('no acoustic model'), self.second)
+        session.receiveMessage(AudioData(b'\x00\x00'), ActorAddress('client'))
+        self.assertNotIn(self.second, [address for address, _ in session.sent])
+
+        session.receiveMessage(VoiceCommand(b'\x00\x00'), ActorAddress('command'))
+        self.assertEqual(session._state, 'decoding')
+        self.assertEqual(session.sent[-1][0], self.second)
+        self.assertIsInstance(session.sent[-1][1], TranscribeWav)
+
+    def test_session_late_failure(self):
+        '''Session transcribes the whole stream if the failure comes late'''
+        session = self.session('listening')
+        session.receiveMessage(AudioData(b'\x00\x00'), ActorAddress('client'))
+        session.receiveMessage(VoiceCommand(b'\x00\x00'), ActorAddress('command'))
+        self.assertIsInstance(session.sent[-1][1], StopTranscribing)
+
+        session.receiveMessage(TranscribingFailed('no acoustic model'), self.second)
+        self.assertEqual(session.sent[-1][0], self.second)
+        self.assertIsInstance(session.sent[-1][1], TranscribeWav)
+
 # -----------------------------------------------------------------------------
 
 if __name__ == '__main__':